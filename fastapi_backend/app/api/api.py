@@ -1,9 +1,14 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from pydantic import BaseModel
 from typing import List
+import os
+import asyncio
 import base64
+import tempfile
 from io import BytesIO
 from services.image_tagger import ImageTagger
+from fastapi_backend.services.utils.rate_limiter import rate_limiters
+from fastapi_backend.services.utils.upload_storage import UPLOAD_CHUNK_SIZE, UPLOAD_MAX_BYTES, UploadTooLargeError
 from fastapi.responses import JSONResponse
 from .backgound import router as background_router
 
@@ -13,6 +18,9 @@ from .endpoints import image
 
 api_router = APIRouter()
 
+# Largest number of files accepted by /tag-batch/files
+TAG_BATCH_MAX_FILES = int(os.getenv('TAG_BATCH_MAX_FILES', '20'))
+
 # Include the virtual try-on router
 api_router.include_router(virtual_tryon.router,
                           prefix="/virtual-try-on", tags=["virtual-try-on"])
@@ -34,6 +42,12 @@ def read_root():
     return {"message": "Welcome to Fashion AI-Assisted Asset Creation and Management API"}
 
 
+@api_router.get("/rate-limits")
+def get_rate_limits():
+    """Return the per-provider limits and wait-time metrics"""
+    return {"providers": rate_limiters.stats()}
+
+
 @api_router.post("/tag-image")
 async def tag_image(file: UploadFile = File(...), model: str = Form("gpt-4o")):
     """Tag a single image with retail attributes using the image tagger service."""
@@ -44,14 +58,14 @@ async def tag_image(file: UploadFile = File(...), model: str = Form("gpt-4o")):
         # Initialize the image tagger
         tagger = ImageTagger(model=model)
 
-        # Analyze the image
-        analysis = tagger.analyze_image(contents)
+        # Analyze the image, the OpenAI client blocks
+        analysis = await asyncio.to_thread(tagger.analyze_image, contents)
 
         if "error" in analysis:
             raise HTTPException(status_code=500, detail=analysis["error"])
 
         # Generate visualization
-        visualization = tagger.visualize_results(contents, analysis)
+        visualization = await asyncio.to_thread(tagger.visualize_results, contents, analysis)
 
         # Return the results
         return {
@@ -90,15 +104,81 @@ async def tag_batch(request: BatchTagRequest):
         tagger = ImageTagger(model=request.model)
 
         # Process the batch
-        batch_results = tagger.batch_process(image_bytes_list)
+        batch_results = await asyncio.to_thread(tagger.batch_process, image_bytes_list)
+
+        # Return the results
+        return {
+            "success": True,
+            "batch_results": batch_results
+        }
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"success": False, "error": str(e)}
+        )
+
+
+def _spool_upload(upload: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES) -> str:
+    """Copy an upload to a temporary file in chunks and return its path, blocking"""
+    suffix = os.path.splitext(upload.filename or "")[1] or ".jpg"
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        try:
+            size = 0
+            for chunk in iter(lambda: upload.file.read(UPLOAD_CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(
+                        f"{upload.filename or 'Upload'} exceeds the maximum size of {max_bytes} bytes")
+                temp_file.write(chunk)
+        except BaseException:
+            os.unlink(temp_file.name)
+            raise
+    return temp_file.name
+
+
+@api_router.post("/tag-batch/files")
+async def tag_batch_files(files: List[UploadFile] = File(...), model: str = Form("gpt-4o")):
+    """Tag a batch of uploaded image files with retail attributes.
+
+    Multipart alternative to /tag-batch. Each file is spooled to a temporary
+    file and handed to the tagger by path, so only the image being analyzed
+    is held in memory instead of every decoded image in the batch.
+    """
+    if len(files) > TAG_BATCH_MAX_FILES:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "error": f"At most {TAG_BATCH_MAX_FILES} files can be tagged per batch"}
+        )
+
+    temp_paths = []
+    try:
+        for upload in files:
+            temp_paths.append(await asyncio.to_thread(_spool_upload, upload))
+
+        # Initialize the image tagger
+        tagger = ImageTagger(model=model)
+
+        # Process the batch
+        batch_results = await asyncio.to_thread(tagger.batch_process, temp_paths)
 
         # Return the results
         return {
             "success": True,
             "batch_results": batch_results
         }
+    except UploadTooLargeError as e:
+        return JSONResponse(
+            status_code=413,
+            content={"success": False, "error": str(e)}
+        )
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content={"success": False, "error": str(e)}
         )
+    finally:
+        for temp_path in temp_paths:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
@@ -1,7 +1,26 @@
-from fastapi import APIRouter, UploadFile, File, Request
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, Form, Request, Header, HTTPException, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List, Optional
 from fastapi_backend.services.utils.temp_file_upload import upload_image_to_bria
 from fastapi_backend.services.background_applier_bria import BackgroundApplier
+from fastapi_backend.services.background_remover import BackgroundRemover, REMBG_MAX_BATCH, resolve_rembg_model
+from fastapi_backend.services.background_compositor import (
+    COMPOSITE_MAX_BACKGROUNDS, COMPOSITE_MAX_SIDE, background_compositor
+)
+from fastapi_backend.services.prompt_pool import PromptPool
+from fastapi_backend.services.utils.rate_limiter import rate_limiters
+from fastapi_backend.services.utils.fetch_cache import fetch_cache
+from fastapi_backend.services.utils.idempotency import IdempotencyError, idempotency_store
+from fastapi_backend.services.utils.upload_storage import (
+    save_upload_file,
+    read_image_upload,
+    UploadTooLargeError,
+    InvalidImageError
+)
+import asyncio
+import base64
+import json
+import re
 import requests
 import os
 from dotenv import load_dotenv
@@ -10,18 +29,19 @@ import openai
 load_dotenv()
 router = APIRouter()
 
-async def generate_fashion_prompts(attributes, num_variants=4):
+background_remover = BackgroundRemover()
+
+PROMPT_NUMBER_PATTERN = re.compile(r"^\s*\d+[.)]\s+")
+
+
+def build_fashion_prompt_messages(attributes, num_variants=4):
     """
-    Generate a list of fashion-related background prompts using OpenAI.
+    Build the chat messages asking OpenAI for background prompts.
 
     :param attributes: A dictionary containing attributes like Product Type, Colors, Patterns, etc.
     :param num_variants: Number of prompts to generate.
-    :return: List of generated prompts.
+    :return: List of chat messages.
     """
-    client = openai.OpenAI(
-        api_key=os.getenv("OPENAI_API_KEY")
-    )
-
     system_prompt = """
     You are an expert prompt generator for AI image generation.
     Given fashion attributes such as Product Type, Colors, Patterns, Materials, Style, Age Group, and Occasion,
@@ -42,20 +62,120 @@ async def generate_fashion_prompts(attributes, num_variants=4):
     Each prompt should describe a visually appealing setting that complements the fashion theme.
     """
 
-    response = client.chat.completions.create(
-        model="gpt-4",  # Changed from gpt-4o-mini to gpt-4
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        temperature=0.7,
-        max_tokens=300
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def parse_prompt_block(block):
+    """
+    Extract the prompt text from a numbered block such as "1. A sunlit terrace..."
+
+    :return: The prompt without its number, or None if the block is not numbered.
+    """
+    match = PROMPT_NUMBER_PATTERN.match(block)
+    if not match:
+        return None
+    return block[match.end():].strip() or None
+
+
+async def generate_fashion_prompts(attributes, num_variants=4):
+    """
+    Generate a list of fashion-related background prompts using OpenAI.
+
+    :param attributes: A dictionary containing attributes like Product Type, Colors, Patterns, etc.
+    :param num_variants: Number of prompts to generate.
+    :return: List of generated prompts.
+    """
+    # Async client so pool refills in the background do not block the event loop
+    client = openai.AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY")
     )
 
+    async with rate_limiters.get('openai').limit():
+        response = await client.chat.completions.create(
+            model="gpt-4",  # Changed from gpt-4o-mini to gpt-4
+            messages=build_fashion_prompt_messages(attributes, num_variants),
+            temperature=0.7,
+            max_tokens=max(300, 75 * num_variants)
+        )
+
     # Extracting the generated prompts from the response
-    prompts = response.choices[0].message.content.split("\n\n")
-    prompts = [prompt.split(". ", 1)[1] for i, prompt in enumerate(prompts, 1)]
-    return prompts
+    blocks = response.choices[0].message.content.split("\n\n")
+    prompts = [prompt for prompt in (parse_prompt_block(block) for block in blocks) if prompt]
+    return prompts or [block.strip() for block in blocks if block.strip()]
+
+
+async def stream_fashion_prompts(attributes, num_variants=4):
+    """
+    Stream fashion background prompts from OpenAI as each one is completed.
+
+    :param attributes: A dictionary containing attributes like Product Type, Colors, Patterns, etc.
+    :param num_variants: Number of prompts to generate.
+    :return: Async iterator yielding prompts in order.
+    """
+    client = openai.AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY")
+    )
+
+    buffer = ""
+    unnumbered = []
+    yielded = 0
+    # The completion is still being generated while it streams, so it keeps its slot until done
+    async with rate_limiters.get('openai').limit():
+        stream = await client.chat.completions.create(
+            model="gpt-4",
+            messages=build_fashion_prompt_messages(attributes, num_variants),
+            temperature=0.7,
+            max_tokens=max(300, 75 * num_variants),
+            stream=True
+        )
+
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            buffer += chunk.choices[0].delta.content or ""
+
+            # A blank line ends a prompt, so hand it out before the rest arrives
+            while "\n\n" in buffer:
+                block, buffer = buffer.split("\n\n", 1)
+                prompt = parse_prompt_block(block)
+                if prompt:
+                    yielded += 1
+                    yield prompt
+                elif block.strip():
+                    unnumbered.append(block.strip())
+
+    prompt = parse_prompt_block(buffer)
+    if prompt:
+        yielded += 1
+        yield prompt
+    elif buffer.strip():
+        unnumbered.append(buffer.strip())
+
+    # Fall back to plain paragraphs if the model did not number its prompts
+    if not yielded:
+        for block in unnumbered:
+            yield block
+
+
+async def iterate_prompts(prompts):
+    """Iterate over a list or an async iterator of prompts"""
+    if isinstance(prompts, list):
+        for prompt in prompts:
+            yield prompt
+    else:
+        async for prompt in prompts:
+            yield prompt
+
+
+# Prompts cached per normalized attribute set and served in rotation
+prompt_pool = PromptPool(
+    generate_fashion_prompts,
+    pool_file=os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "storage", "prompt_pool.json")
+)
+
 
 @router.post("/upload-to-bria")
 async def upload_to_bria(file: UploadFile = File(...)):
@@ -91,7 +211,8 @@ async def upload_to_bria(file: UploadFile = File(...)):
         "Authorization": f"Basic {os.getenv('IMAGEKIT_API_KEY')}"
     }
 
-    response = requests.post(url, data=payload, files=files, headers=headers)
+    async with rate_limiters.get('imagekit').limit():
+        response = await asyncio.to_thread(requests.post, url, data=payload, files=files, headers=headers)
 
     print(response.json())
 
@@ -105,7 +226,14 @@ async def upload_to_bria(file: UploadFile = File(...)):
 
 
 @router.post("/background-replace")
-async def background_replace(request: Request, request_body: dict):
+async def background_replace(request: Request, request_body: dict, response: Response,
+                             idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    """
+    Replace the background of a product image with Bria, or locally with mode "local"
+
+    Retries carrying the same Idempotency-Key get the original Bria result back
+    instead of submitting another paid request.
+    """
 
     # Extract values with defaults
     fast = request_body.get("fast", True)
@@ -114,6 +242,7 @@ async def background_replace(request: Request, request_body: dict):
     original_quality = request_body.get("original_quality", False)
     num_results = request_body.get("num_results", 4)
     image_url = request_body.get("image_url")
+    mode = request_body.get("mode", "remote")
 
     if not image_url:
         return JSONResponse(
@@ -121,6 +250,9 @@ async def background_replace(request: Request, request_body: dict):
             content={"error": "image_url is required"}
         )
 
+    if mode == "local":
+        return await local_background_replace(request, request_body)
+
     print("Received request with:", {
         "fast": fast,
         "bg_prompt": bg_prompt,
@@ -130,24 +262,310 @@ async def background_replace(request: Request, request_body: dict):
         "image_url": image_url
     })
 
-    background_applier = BackgroundApplier()
-    result = background_applier.background_replace_using_bria_api(
-        fast=fast,
-        bg_prompt=bg_prompt,
-        refine_prompt=refine_prompt,
-        original_quality=original_quality,
-        num_results=num_results,
-        image_url=image_url
-    )
+    async def replace():
+        background_applier = BackgroundApplier()
+        result = await background_applier.background_replace_using_bria_api_async(
+            fast=fast,
+            bg_prompt=bg_prompt,
+            refine_prompt=refine_prompt,
+            original_quality=original_quality,
+            num_results=num_results,
+            image_url=image_url
+        )
+        if "error" in result:
+            # Failed requests are not kept for replays, a retry calls Bria again
+            raise _BriaReplaceError(result)
+        return result
+
+    try:
+        result, replayed = await idempotency_store.run(
+            "background/background-replace", idempotency_key, request_body, replace)
+    except IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except _BriaReplaceError as e:
+        return e.result
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
 
     return result
 
+
+class _BriaReplaceError(Exception):
+    """Carries a Bria error response past the idempotency store"""
+
+    def __init__(self, result: dict):
+        super().__init__(result.get("error"))
+        self.result = result
+
+
+async def load_image_bytes(image_url: str) -> bytes:
+    """
+    Load the raw bytes of an image given as a URL or a base64 data URI
+
+    URLs are downloaded through the shared fetch cache.
+    """
+    if image_url.startswith('data:image'):
+        return base64.b64decode(image_url.split(",", 1)[1])
+
+    image_bytes, _ = await fetch_cache.fetch_bytes(image_url)
+    return image_bytes
+
+
+async def local_background_replace(request: Request, request_body: dict):
+    """
+    Replace the background locally instead of calling Bria
+
+    The product is cut out once with rembg and composited against cached
+    backgrounds from the library. The response uses the same
+    [url, seed, filename] result format as Bria.
+    """
+    num_results = request_body.get("num_results", 4)
+    backgrounds = request_body.get("backgrounds") or background_compositor.list_backgrounds()[:num_results]
+    shadow = request_body.get("shadow", True)
+    size = None
+    if request_body.get("width") and request_body.get("height"):
+        try:
+            size = (int(request_body["width"]), int(request_body["height"]))
+        except (TypeError, ValueError):
+            return JSONResponse(status_code=400, content={"error": "width and height must be integers"})
+        if not all(0 < side <= COMPOSITE_MAX_SIDE for side in size):
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"width and height must be between 1 and {COMPOSITE_MAX_SIDE}"}
+            )
+
+    if not backgrounds:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "No backgrounds available in the background library"}
+        )
+    if len(backgrounds) > COMPOSITE_MAX_BACKGROUNDS:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"At most {COMPOSITE_MAX_BACKGROUNDS} backgrounds can be composited per request"}
+        )
+
+    try:
+        model_name = resolve_rembg_model(request_body.get("tier"), request_body.get("model"))
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    try:
+        image_bytes = await load_image_bytes(request_body["image_url"])
+        cutout = await background_remover.remove_background_to_storage(image_bytes, model_name)
+        cutout_path = background_remover.cutouts_dir / os.path.basename(cutout["fileUrl"])
+
+        composites = await asyncio.to_thread(
+            background_compositor.composite_to_storage,
+            cutout_path, backgrounds, size, 0.9, shadow)
+    except FileNotFoundError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        print(f"Error in local background replace: {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Failed to replace background locally: {str(e)}"}
+        )
+
+    base_url = str(request.base_url).rstrip("/")
+    return {
+        "result": [
+            [f"{base_url}{item['fileUrl']}", 0, item["fileName"]] for item in composites
+        ],
+        "backgrounds": [item["background"] for item in composites],
+        "mode": "local"
+    }
+
+
+@router.get("/library")
+async def list_background_library():
+    """
+    List the pre-generated backgrounds available for local background replacement
+    """
+    return {
+        "backgrounds": [
+            {"name": name, "fileUrl": f"/storage/backgrounds/{name}"}
+            for name in background_compositor.list_backgrounds()
+        ]
+    }
+
+
+@router.post("/library")
+async def add_background_to_library(file: UploadFile = File(...)):
+    """
+    Add a background image to the library used for local background replacement
+    """
+    try:
+        # The library is small and listed by name, keep it flat
+        result = await save_upload_file(
+            file, str(background_compositor.library_dir), "/storage/backgrounds/", sharded=False)
+        result["name"] = os.path.basename(result["fileUrl"])
+        return result
+    except UploadTooLargeError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except InvalidImageError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+
 @router.post("/prompt-generator")
 async def prompt_generator(request: Request, request_body: dict):
     print(request_body,"request_body")
     attributes = request_body.get("attributes", {})
     num_variants = request_body.get("num_variants", 4)
 
-    prompts = await generate_fashion_prompts(request_body, num_variants)
+    prompts = await prompt_pool.get_prompts(request_body, num_variants)
     print(prompts,"prompts")
     return prompts
+
+
+@router.post("/remove-background")
+async def remove_background(
+    file: UploadFile = File(...),
+    tier: Optional[str] = Form(None),
+    model: Optional[str] = Form(None)
+):
+    """
+    Remove the background from a single image locally with rembg
+
+    Use tier "preview" for fast low-cost cutouts and "final" for the best quality.
+    """
+    try:
+        model_name = resolve_rembg_model(tier, model)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    try:
+        image_bytes = await read_image_upload(file)
+        return await background_remover.remove_background_to_storage(image_bytes, model_name)
+    except UploadTooLargeError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except InvalidImageError as e:
+        return JSONResponse(status_code=422, content={"error": str(e)})
+    except Exception as e:
+        print(f"Error removing background: {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Failed to remove background: {str(e)}"}
+        )
+
+
+@router.post("/remove-background/batch")
+async def remove_background_batch(
+    files: List[UploadFile] = File(...),
+    tier: Optional[str] = Form(None),
+    model: Optional[str] = Form(None)
+):
+    """
+    Remove the backgrounds from a batch of images locally with rembg
+    """
+    try:
+        model_name = resolve_rembg_model(tier, model)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    if len(files) > REMBG_MAX_BATCH:
+        return JSONResponse(
+            status_code=413,
+            content={"error": f"At most {REMBG_MAX_BATCH} images can be processed per batch"}
+        )
+
+    try:
+        images = [await read_image_upload(file) for file in files]
+        results = await background_remover.remove_backgrounds_to_storage(images, model_name)
+        return {"results": results}
+    except UploadTooLargeError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except InvalidImageError as e:
+        return JSONResponse(status_code=422, content={"error": str(e)})
+    except Exception as e:
+        print(f"Error removing backgrounds: {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Failed to remove backgrounds: {str(e)}"}
+        )
+
+
+@router.post("/prompt-pipeline")
+async def prompt_pipeline(request: Request, request_body: dict):
+    """
+    Generate background prompts and replace backgrounds for all of them in one call
+
+    A Bria replacement is started as soon as each prompt arrives from OpenAI,
+    so the replacements run concurrently. Events are streamed back as
+    newline-delimited JSON while they happen:
+
+    - {"type": "prompt", "index": i, "prompt": ...}
+    - {"type": "result", "index": i, "prompt": ..., "result": [...]}
+    - {"type": "error", "index": i, "error": ...}
+    - {"type": "done", "count": n}
+    """
+    image_url = request_body.get("image_url")
+    if not image_url:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "image_url is required"}
+        )
+
+    attributes = request_body.get("attributes", request_body)
+    num_variants = request_body.get("num_variants", 4)
+    replace_options = {
+        "fast": request_body.get("fast", True),
+        "refine_prompt": request_body.get("refine_prompt", True),
+        "original_quality": request_body.get("original_quality", False),
+        "num_results": request_body.get("num_results", 1),
+        "image_url": image_url
+    }
+
+    background_applier = BackgroundApplier()
+    events = asyncio.Queue()
+
+    async def replace_background(index, prompt):
+        try:
+            result = await background_applier.background_replace_using_bria_api_async(
+                bg_prompt=prompt, **replace_options)
+            if "error" in result:
+                await events.put({"type": "error", "index": index, "prompt": prompt, "error": result["error"]})
+            else:
+                await events.put({"type": "result", "index": index, "prompt": prompt, "result": result.get("result", [])})
+        except Exception as e:
+            await events.put({"type": "error", "index": index, "prompt": prompt, "error": str(e)})
+
+    async def run_pipeline():
+        tasks = []
+        try:
+            # Serve pooled prompts when available, otherwise stream fresh ones
+            # and keep them for later requests
+            pooled = prompt_pool.take(attributes, num_variants)
+            prompts = pooled or stream_fashion_prompts(attributes, num_variants)
+            generated = []
+            async for prompt in iterate_prompts(prompts):
+                index = len(tasks)
+                await events.put({"type": "prompt", "index": index, "prompt": prompt})
+                tasks.append(asyncio.create_task(replace_background(index, prompt)))
+                generated.append(prompt)
+                if len(tasks) >= num_variants:
+                    break
+            if not pooled:
+                await prompt_pool.add(attributes, generated)
+            await asyncio.gather(*tasks)
+        except Exception as e:
+            print(f"Error in prompt pipeline: {str(e)}")
+            await events.put({"type": "error", "index": None, "error": str(e)})
+        finally:
+            for task in tasks:
+                task.cancel()
+            await events.put({"type": "done", "count": len(tasks)})
+
+    async def event_stream():
+        pipeline = asyncio.create_task(run_pipeline())
+        try:
+            while True:
+                event = await events.get()
+                yield json.dumps(event) + "\n"
+                if event["type"] == "done":
+                    break
+        finally:
+            # Stop outstanding provider calls if the client goes away
+            pipeline.cancel()
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
@@ -1,9 +1,12 @@
 import os
+import asyncio
 from typing import Dict, Any, Optional
-from fastapi import APIRouter, HTTPException, Request, UploadFile, File, Form, Depends
+from fastapi import APIRouter, HTTPException, Request, UploadFile, File, Form, Depends, Header, Response
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from services.image_service import ImageService
+from fastapi_backend.services.utils.rate_limiter import rate_limiters
+from fastapi_backend.services.utils.idempotency import IdempotencyError, idempotency_store
 import requests
 import io
 from PIL import Image
@@ -66,8 +69,9 @@ async def upload_image(file: UploadFile = File(...), image_type: str = "general"
         }
 
         print(f"Uploading to ImageKit, folder: {folder}")
-        response = requests.post(
-            url, data=payload, files=files, headers=headers)
+        async with rate_limiters.get('imagekit').limit():
+            response = await asyncio.to_thread(
+                requests.post, url, data=payload, files=files, headers=headers)
         response_data = response.json()
 
         if "error" in response_data:
@@ -92,9 +96,13 @@ async def upload_image(file: UploadFile = File(...), image_type: str = "general"
 
 
 @router.post("/upscale", response_model=UpscaleResponse)
-async def upscale_image(request: UpscaleRequest, req: Request):
+async def upscale_image(request: UpscaleRequest, req: Request, response: Response,
+                        idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
     """
     Upscale an image using Bria AI API
+
+    Retries carrying the same Idempotency-Key get the original result back
+    instead of upscaling again.
     """
     try:
         # Log the request for debugging
@@ -107,32 +115,43 @@ async def upscale_image(request: UpscaleRequest, req: Request):
             raise HTTPException(
                 status_code=400, detail="Invalid image URL provided")
 
-        print("Calling image_service.upscale_image...")
-        result = image_service.upscale_image(
-            image_url=request.imageUrl,
-            scale=request.scale,
-            enhance_quality=request.enhanceQuality,
-            preserve_details=request.preserveDetails,
-            remove_noise=request.removeNoise
-        )
-        print("Image service result:", result)
-
-        # Ensure we have the expected keys in the result
-        if not result or not isinstance(result, dict) or "upscaledImageUrl" not in result:
-            print("Invalid result structure:", result)
-            raise HTTPException(
-                status_code=500,
-                detail="Invalid response from image service: missing upscaledImageUrl"
+        async def upscale():
+            print("Calling image_service.upscale_image...")
+            # The Bria call and the ImageKit upload are blocking, keep them off the event loop
+            result = await asyncio.to_thread(
+                image_service.upscale_image,
+                image_url=request.imageUrl,
+                scale=request.scale,
+                enhance_quality=request.enhanceQuality,
+                preserve_details=request.preserveDetails,
+                remove_noise=request.removeNoise
             )
-
-        response_data = UpscaleResponse(
-            upscaledImageUrl=result["upscaledImageUrl"],
-            originalImageUrl=result["originalImageUrl"]
-        )
-        print("=== Successfully completed image upscale request ===")
-        print("Response data:", response_data.dict())
+            print("Image service result:", result)
+
+            # Ensure we have the expected keys in the result
+            if not result or not isinstance(result, dict) or "upscaledImageUrl" not in result:
+                print("Invalid result structure:", result)
+                raise HTTPException(
+                    status_code=500,
+                    detail="Invalid response from image service: missing upscaledImageUrl"
+                )
+
+            response_data = UpscaleResponse(
+                upscaledImageUrl=result["upscaledImageUrl"],
+                originalImageUrl=result["originalImageUrl"]
+            )
+            print("=== Successfully completed image upscale request ===")
+            print("Response data:", response_data.dict())
+            return response_data.dict()
+
+        response_data, replayed = await idempotency_store.run(
+            "image/upscale", idempotency_key, request.dict(), upscale)
+        if replayed:
+            response.headers["Idempotent-Replayed"] = "true"
         return response_data
 
+    except IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except HTTPException as he:
         print("=== HTTP Exception in upscale_image endpoint ===")
         print(f"Status code: {he.status_code}")
@@ -4,7 +4,8 @@ API endpoints for model generation functionality
 import json
 import base64
 import logging
-from fastapi import APIRouter, HTTPException, BackgroundTasks, File, UploadFile, Form
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, BackgroundTasks, File, UploadFile, Form, Query, Header, Response
 from fastapi.responses import JSONResponse
 from typing import Optional, Any
 
@@ -17,6 +18,8 @@ from fastapi_backend.app.schemas.model_generation import (
     GalleryResponse
 )
 from fastapi_backend.services.model_generation import ModelGenerationService
+from fastapi_backend.services.utils.gallery_query import GALLERY_DEFAULT_LIMIT, GALLERY_MAX_LIMIT, GalleryFilters
+from fastapi_backend.services.utils.idempotency import IdempotencyError, idempotency_store
 
 # Set up logger
 logging.basicConfig(level=logging.INFO)
@@ -58,6 +61,37 @@ async def analyze_reference_image(request: ReferenceImageAnalysisRequest):
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error analyzing reference image: {str(e)}")
 
+@router.post("/analyze-reference-file", response_model=ReferenceImageAnalysisResponse)
+async def analyze_reference_image_file(reference_image: UploadFile = File(...)):
+    """
+    Analyze a reference image uploaded as multipart form data
+
+    Binary alternative to /analyze-reference that avoids sending the image as base64 JSON.
+    """
+    try:
+        logger.info("Received reference image file analysis request")
+        
+        # Read the reference image
+        image_data = await reference_image.read()
+        if not image_data:
+            raise HTTPException(status_code=400, detail="Reference image file is empty")
+        
+        # Analyze the reference image
+        analysis_result = await model_generation_service.analyze_reference_image(image_data)
+        
+        if not analysis_result.get("success", False):
+            error_message = analysis_result.get("error", "Unknown error")
+            logger.error(f"Error analyzing reference image: {error_message}")
+            raise HTTPException(status_code=500, detail=error_message)
+            
+        logger.info("Reference image analysis successful")
+        return analysis_result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error analyzing reference image file: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error analyzing reference image: {str(e)}")
+
 @router.post("/generate-with-reference", response_model=ModelGenerationResponse)
 async def generate_with_reference(
     prompt: Optional[str] = Form(""),
@@ -166,9 +200,13 @@ async def generate_with_reference(
         raise HTTPException(status_code=500, detail=f"Error generating model with reference: {str(e)}")
 
 @router.post("/generate", response_model=ModelGenerationResponse)
-async def generate_model(request: ModelGenerationRequest):
+async def generate_model(request: ModelGenerationRequest, http_response: Response,
+                         idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
     """
     Submit a model generation request
+
+    Retries carrying the same Idempotency-Key get the original generation ID
+    back instead of submitting another paid job.
     """
     try:
         logger.info(f"Received generate request with prompt: {request.prompt[:50]}...")
@@ -180,16 +218,25 @@ async def generate_model(request: ModelGenerationRequest):
         if "attributes" in request_dict and request_dict["attributes"]:
             if "modelType" not in request_dict["attributes"] or not request_dict["attributes"]["modelType"]:
                 request_dict["attributes"]["modelType"] = "Full Body"
-        
-        response = await model_generation_service.create_generation(request_dict)
-        
-        if not response.get("success", False):
-            error_message = response.get("error", "Unknown error")
-            logger.error(f"Error generating model: {error_message}")
-            raise HTTPException(status_code=500, detail=error_message)
+
+        async def submit():
+            response = await model_generation_service.create_generation(request_dict)
+            
+            if not response.get("success", False):
+                error_message = response.get("error", "Unknown error")
+                logger.error(f"Error generating model: {error_message}")
+                raise HTTPException(status_code=500, detail=error_message)
+            return response
+
+        response, replayed = await idempotency_store.run(
+            "model-generation/generate", idempotency_key, request_dict, submit)
+        if replayed:
+            http_response.headers["Idempotent-Replayed"] = "true"
             
         logger.info(f"Generation submitted successfully with ID: {response.get('generationId')}")
         return response
+    except IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         logger.error(f"Error generating model: {str(e)}")
         import traceback
@@ -290,15 +337,29 @@ async def execute_generation(
         raise HTTPException(status_code=500, detail=f"Error processing generation request: {str(e)}")
 
 @router.get("/gallery", response_model=GalleryResponse)
-async def get_gallery(limit: int = 50):
+async def get_gallery(
+    limit: int = Query(GALLERY_DEFAULT_LIMIT, ge=1, le=GALLERY_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    provider: Optional[str] = None,
+    clothingType: Optional[str] = None,
+    gender: Optional[str] = None,
+    dateFrom: Optional[datetime] = None,
+    dateTo: Optional[datetime] = None
+):
     """
-    Get all saved model generation results for the gallery
+    Get a page of saved model generation results for the gallery, newest first
+
+    Pass the returned nextCursor as cursor to get the following page.
     """
+    filters = GalleryFilters(provider=provider, clothing_type=clothingType, gender=gender,
+                             date_from=dateFrom, date_to=dateTo)
     try:
         logger.info(f"Getting gallery results with limit: {limit}")
-        results = await model_generation_service.get_gallery_results(limit)
-        logger.info(f"Got {len(results)} gallery results")
-        return {"results": results}
+        page = await model_generation_service.get_gallery_results(limit, cursor, filters)
+        logger.info(f"Got {len(page['results'])} gallery results")
+        return page
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error getting gallery results: {str(e)}")
         import traceback
@@ -2,20 +2,22 @@
 API endpoints for virtual try-on functionality
 """
 import os
-import shutil
+import json
+import asyncio
 from typing import List, Dict, Any, Optional
-from fastapi import APIRouter, Depends, File, Form, UploadFile, HTTPException, BackgroundTasks, Body
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, File, Form, UploadFile, HTTPException, BackgroundTasks, Body, Query, Header, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from starlette.requests import Request
 import requests
 from dotenv import load_dotenv
 from PIL import Image
 import io
 import base64
-import uuid
+from datetime import datetime
 
 from fastapi_backend.app.schemas.virtual_tryon import (
     TryOnRequest,
+    TryOnMatrixRequest,
     TryOnResponse,
     TryOnQueryResponse,
     UploadFileResponse,
@@ -23,7 +25,20 @@ from fastapi_backend.app.schemas.virtual_tryon import (
     Base64ImageUploadRequest,
     ImagePreprocessRequest
 )
-from fastapi_backend.services.virtual_tryon import VirtualTryOnService
+from fastapi_backend.services.virtual_tryon import VirtualTryOnService, TRYON_MATRIX_MAX_CELLS
+from fastapi_backend.services.utils.rate_limiter import rate_limiters
+from fastapi_backend.services.utils.fetch_cache import fetch_cache
+from fastapi_backend.services.utils.blob_store import blob_store, hash_bytes
+from fastapi_backend.services.utils.async_io import run_io
+from fastapi_backend.services.utils.idempotency import IdempotencyError, idempotency_store
+from fastapi_backend.services.utils.gallery_query import GALLERY_DEFAULT_LIMIT, GALLERY_MAX_LIMIT, GalleryFilters
+from fastapi_backend.services.utils.upload_storage import (
+    save_upload_file,
+    save_image_stream,
+    UPLOAD_MAX_BYTES,
+    UploadTooLargeError,
+    InvalidImageError
+)
 
 router = APIRouter()
 
@@ -49,6 +64,101 @@ def ensure_upload_dirs_exist():
 ensure_upload_dirs_exist()
 
 
+def get_upload_target(image_type: str):
+    """
+    Get the upload directory and public URL prefix for an image type
+    """
+    _, model_dir, clothing_dir = ensure_upload_dirs_exist()
+    if image_type == "model":
+        return model_dir, "/uploads/models/"
+    return clothing_dir, "/uploads/clothing/"
+
+
+def preprocess_and_store_image(img: Image.Image, image_type: str, maintain_portrait_ratio: bool = True) -> Dict[str, Any]:
+    """
+    Preprocess an opened image according to FASHN AI best practices and upload it
+
+    Uploads to ImageKit and falls back to local storage if the upload fails.
+    Either way the file is named by the hash of the processed content, never
+    by a client-supplied name. Returns the file URL and the processed image
+    dimensions.
+    """
+    # If maintain_portrait_ratio is True, crop to 9:16 ratio
+    if maintain_portrait_ratio:
+        # Calculate target dimensions for 9:16 ratio
+        current_ratio = img.width / img.height
+        target_ratio = 9 / 16  # Portrait ratio
+
+        if current_ratio > target_ratio:  # Image is too wide
+            # Calculate new width to maintain 9:16 ratio
+            new_width = int(img.height * target_ratio)
+            # Crop from center
+            left = (img.width - new_width) // 2
+            right = left + new_width
+            img = img.crop((left, 0, right, img.height))
+        elif current_ratio < target_ratio:  # Image is too tall
+            # Calculate new height to maintain 9:16 ratio
+            new_height = int(img.width / target_ratio)
+            # Crop from center
+            top = (img.height - new_height) // 2
+            bottom = top + new_height
+            img = img.crop((0, top, img.width, bottom))
+
+    # Resize if height > 2000px while maintaining aspect ratio
+    if img.height > 2000:
+        ratio = 2000 / img.height
+        new_width = int(img.width * ratio)
+        img = img.resize((new_width, 2000), Image.LANCZOS)
+
+    # Convert to RGB if needed (in case of RGBA)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    # Save as JPEG with quality 95
+    output_buffer = io.BytesIO()
+    img.save(output_buffer, format='JPEG', quality=95)
+    output_buffer.seek(0)
+    filename = f"{hash_bytes(output_buffer.getvalue())}.jpg"
+
+    # Upload to ImageKit
+    url = "https://upload.imagekit.io/api/v1/files/upload"
+    files = {"file": (filename, output_buffer, "image/jpeg")}
+    payload = {
+        "fileName": filename,
+        "publicKey": "public_gTBjx7RWLu8I8OqyodA+EWeCzVU=",
+        "useUniqueFileName": "true",
+        "folder": f"/virtual-tryon/{image_type}s"
+    }
+    headers = {
+        "Accept": "application/json",
+        "Authorization": f"Basic {os.getenv('IMAGEKIT_API_KEY')}"
+    }
+
+    rate_limiters.get('imagekit').throttle()
+    response = requests.post(
+        url, data=payload, files=files, headers=headers)
+
+    if "error" in response.json():
+        # If ImageKit upload fails, fall back to local storage
+        print(f"ImageKit upload failed: {response.json()}")
+
+        # Choose the appropriate directory based on image type
+        target_dir, url_prefix = get_upload_target(image_type)
+
+        # Save the processed image to the appropriate directory under its content hash
+        file_location = blob_store.store_bytes(output_buffer.getvalue(), "jpg", target_dir)
+
+        # Return the file URL
+        return {"fileUrl": f"{url_prefix}{os.path.basename(file_location)}", "width": img.width, "height": img.height}
+
+    # Return the ImageKit URL and image dimensions
+    return {
+        "fileUrl": response.json().get("url"),
+        "width": img.width,
+        "height": img.height
+    }
+
+
 @router.post("/upload-model", response_model=UploadFileResponse)
 async def upload_model_image(file: UploadFile = File(...)):
     """
@@ -56,13 +166,13 @@ async def upload_model_image(file: UploadFile = File(...)):
     """
     try:
         _, model_dir, _ = ensure_upload_dirs_exist()
-        file_location = os.path.join(model_dir, file.filename)
-
-        with open(file_location, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
 
-        # Return the file URL
-        return {"fileUrl": f"/uploads/models/{file.filename}"}
+        # Stream the file to disk under a content-derived name
+        return await save_upload_file(file, model_dir, "/uploads/models/")
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error uploading file: {str(e)}")
@@ -75,30 +185,40 @@ async def upload_clothing_image(file: UploadFile = File(...)):
     """
     try:
         _, _, clothing_dir = ensure_upload_dirs_exist()
-        file_location = os.path.join(clothing_dir, file.filename)
-
-        with open(file_location, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
 
-        # Return the file URL
-        return {"fileUrl": f"/uploads/clothing/{file.filename}"}
+        # Stream the file to disk under a content-derived name
+        return await save_upload_file(file, clothing_dir, "/uploads/clothing/")
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error uploading file: {str(e)}")
 
 
 @router.post("/submit", response_model=TryOnResponse)
-async def submit_try_on(request: TryOnRequest):
+async def submit_try_on(request: TryOnRequest, response: Response,
+                        idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
     """
     Submit a virtual try-on request
+
+    Retries carrying the same Idempotency-Key get the original task ID back
+    instead of submitting another paid job.
     """
     try:
         # Process the request data
         request_data = request.dict()
 
         # Submit the try-on request
-        response = await virtual_tryon_service.submit_try_on(request_data)
-        return response
+        result, replayed = await idempotency_store.run(
+            "virtual-try-on/submit", idempotency_key, request_data,
+            lambda: virtual_tryon_service.submit_try_on(request_data))
+        if replayed:
+            response.headers["Idempotent-Replayed"] = "true"
+        return result
+    except IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error submitting try-on request: {str(e)}")
@@ -135,15 +255,57 @@ async def execute_try_on(request: TryOnRequest, background_tasks: BackgroundTask
             status_code=500, detail=f"Error executing try-on: {str(e)}")
 
 
+@router.post("/matrix")
+async def try_on_matrix(request: TryOnMatrixRequest):
+    """
+    Try every garment on every model and stream the result grid
+
+    Events are streamed as newline-delimited JSON while cells are submitted
+    and completed, followed by a final "done" event with the whole grid.
+    """
+    cells = len(request.clothesList) * len(request.modelImage)
+    if cells == 0:
+        raise HTTPException(
+            status_code=400, detail="At least one garment and one model image are required")
+    if cells > TRYON_MATRIX_MAX_CELLS:
+        raise HTTPException(
+            status_code=400, detail=f"Matrix of {cells} cells exceeds the limit of {TRYON_MATRIX_MAX_CELLS}")
+
+    request_data = request.dict(exclude={"pollInterval", "timeout"})
+
+    async def event_stream():
+        try:
+            async for event in virtual_tryon_service.stream_try_on_matrix(
+                    request_data, poll_interval=request.pollInterval, timeout=request.timeout):
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            print(f"Error in try-on matrix: {str(e)}")
+            yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+
 @router.get("/gallery", response_model=GalleryResponse)
-async def get_gallery():
+async def get_gallery(
+    cursor: Optional[str] = None,
+    limit: int = Query(GALLERY_DEFAULT_LIMIT, ge=1, le=GALLERY_MAX_LIMIT),
+    provider: Optional[str] = None,
+    clothingType: Optional[str] = None,
+    gender: Optional[str] = None,
+    dateFrom: Optional[datetime] = None,
+    dateTo: Optional[datetime] = None
+):
     """
-    Get all saved try-on results for the gallery
+    Get a page of saved try-on results for the gallery, newest first
+
+    Pass the returned nextCursor as cursor to get the following page.
     """
+    filters = GalleryFilters(provider=provider, clothing_type=clothingType, gender=gender,
+                             date_from=dateFrom, date_to=dateTo)
     try:
-        # Get all gallery results
-        results = await virtual_tryon_service.get_gallery_results()
-        return {"results": results}
+        return await virtual_tryon_service.get_gallery_results(filters, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error getting gallery results: {str(e)}")
@@ -177,17 +339,14 @@ async def upload_base64_image(request_data: Base64ImageUploadRequest = Body(...)
             target_dir = clothing_dir
             url_prefix = "/uploads/clothing/"
 
-        # Generate a unique filename if none provided
-        if not filename:
-            filename = f"{uuid.uuid4()}.jpg"
+        # Keep the extension of the provided filename, the name itself is the content hash
+        extension = os.path.splitext(filename or "")[1].lstrip(".").lower() or "jpg"
 
         # Save the image to the appropriate directory
-        file_location = os.path.join(target_dir, filename)
-        with open(file_location, "wb") as buffer:
-            buffer.write(image_data)
+        file_location = await run_io(blob_store.store_bytes, image_data, extension, target_dir)
 
         # Return the file URL
-        return {"fileUrl": f"{url_prefix}{filename}"}
+        return {"fileUrl": f"{url_prefix}{os.path.basename(file_location)}"}
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error uploading base64 image: {str(e)}")
@@ -207,20 +366,16 @@ async def preprocess_and_upload(request_data: ImagePreprocessRequest = Body(...)
         # Extract data from request
         base64_image = request_data.base64_image
         image_type = request_data.image_type
-        filename = request_data.filename or f"{uuid.uuid4()}.jpg"
         maintain_portrait_ratio = request_data.maintain_portrait_ratio
 
         # Check if the image is a URL (not base64)
         if base64_image.startswith('http'):
-            # It's a URL, download the image
+            # It's a URL, download the image through the shared fetch cache
             print(f"Downloading image from URL: {base64_image}")
-            response = requests.get(base64_image, stream=True, timeout=10)
-            if response.status_code != 200:
-                raise Exception(
-                    f"Failed to download image from URL: {response.status_code}")
+            image_data, _ = await fetch_cache.fetch_bytes(base64_image)
 
             # Open image with PIL
-            img = Image.open(io.BytesIO(response.content))
+            img = Image.open(io.BytesIO(image_data))
         else:
             # It's a base64 image
             # Ensure the base64 string doesn't have prefix like "data:image/jpeg;base64,"
@@ -238,100 +393,92 @@ async def preprocess_and_upload(request_data: ImagePreprocessRequest = Body(...)
                 if base64_image.startswith(('http://', 'https://')):
                     print(
                         f"Attempting to download as URL instead: {base64_image}")
-                    response = requests.get(
-                        base64_image, stream=True, timeout=10)
-                    if response.status_code != 200:
-                        raise Exception(
-                            f"Failed to download image from URL: {response.status_code}")
-                    image_data = response.content
+                    image_data, _ = await fetch_cache.fetch_bytes(base64_image)
                 else:
                     raise Exception(f"Invalid base64 data: {str(e)}")
 
             # Open image with PIL
             img = Image.open(io.BytesIO(image_data))
 
-        # If maintain_portrait_ratio is True, crop to 9:16 ratio
-        if maintain_portrait_ratio:
-            # Calculate target dimensions for 9:16 ratio
-            current_ratio = img.width / img.height
-            target_ratio = 9 / 16  # Portrait ratio
-
-            if current_ratio > target_ratio:  # Image is too wide
-                # Calculate new width to maintain 9:16 ratio
-                new_width = int(img.height * target_ratio)
-                # Crop from center
-                left = (img.width - new_width) // 2
-                right = left + new_width
-                img = img.crop((left, 0, right, img.height))
-            elif current_ratio < target_ratio:  # Image is too tall
-                # Calculate new height to maintain 9:16 ratio
-                new_height = int(img.width / target_ratio)
-                # Crop from center
-                top = (img.height - new_height) // 2
-                bottom = top + new_height
-                img = img.crop((0, top, img.width, bottom))
-
-        # Resize if height > 2000px while maintaining aspect ratio
-        if img.height > 2000:
-            ratio = 2000 / img.height
-            new_width = int(img.width * ratio)
-            img = img.resize((new_width, 2000), Image.LANCZOS)
-
-        # Convert to RGB if needed (in case of RGBA)
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-
-        # Save as JPEG with quality 95
-        output_buffer = io.BytesIO()
-        img.save(output_buffer, format='JPEG', quality=95)
-        output_buffer.seek(0)
-
-        # Upload to ImageKit
-        url = "https://upload.imagekit.io/api/v1/files/upload"
-        files = {"file": (filename, output_buffer, "image/jpeg")}
-        payload = {
-            "fileName": filename,
-            "publicKey": "public_gTBjx7RWLu8I8OqyodA+EWeCzVU=",
-            "useUniqueFileName": "true",
-            "folder": f"/virtual-tryon/{image_type}s"
-        }
-        headers = {
-            "Accept": "application/json",
-            "Authorization": f"Basic {os.getenv('IMAGEKIT_API_KEY')}"
-        }
-
-        response = requests.post(
-            url, data=payload, files=files, headers=headers)
-
-        if "error" in response.json():
-            # If ImageKit upload fails, fall back to local storage
-            print(f"ImageKit upload failed: {response.json()}")
-
-            # Choose the appropriate directory based on image type
-            _, model_dir, clothing_dir = ensure_upload_dirs_exist()
-            if image_type == "model":
-                target_dir = model_dir
-                url_prefix = "/uploads/models/"
-            else:  # clothing
-                target_dir = clothing_dir
-                url_prefix = "/uploads/clothing/"
-
-            # Save the processed image to the appropriate directory
-            file_location = os.path.join(target_dir, filename)
-            with open(file_location, "wb") as buffer:
-                output_buffer.seek(0)
-                buffer.write(output_buffer.read())
-
-            # Return the file URL
-            return {"fileUrl": f"{url_prefix}{filename}", "width": img.width, "height": img.height}
-
-        # Return the ImageKit URL and image dimensions
-        return {
-            "fileUrl": response.json().get("url"),
-            "width": img.width,
-            "height": img.height
-        }
+        # Resizing, the ImageKit upload and the local fallback all block
+        return await asyncio.to_thread(
+            preprocess_and_store_image, img, image_type, maintain_portrait_ratio)
     except Exception as e:
         print(f"Error preprocessing and uploading image: {str(e)}")
         raise HTTPException(
             status_code=500, detail=f"Error preprocessing and uploading image: {str(e)}")
+
+
+@router.post("/upload-file", response_model=UploadFileResponse)
+async def upload_image_file(file: UploadFile = File(...), image_type: str = Form(...)):
+    """
+    Upload a model or clothing image as multipart form data
+
+    Binary alternative to /upload-base64: the file is streamed to disk
+    without being base64-decoded in memory.
+    """
+    try:
+        target_dir, url_prefix = get_upload_target(image_type)
+        return await save_upload_file(file, target_dir, url_prefix)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error uploading file: {str(e)}")
+
+
+@router.post("/upload-binary", response_model=UploadFileResponse)
+async def upload_binary_image(request: Request, image_type: str = "model"):
+    """
+    Upload a model or clothing image as a raw binary request body
+
+    The body is written to disk as it arrives, so the image is never held
+    in memory as a whole.
+    """
+    try:
+        target_dir, url_prefix = get_upload_target(image_type)
+        return await save_image_stream(request.stream(), target_dir, url_prefix)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error uploading binary image: {str(e)}")
+
+
+@router.post("/preprocess-and-upload-file", response_model=UploadFileResponse)
+async def preprocess_and_upload_file(
+    file: UploadFile = File(...),
+    image_type: str = Form(...),
+    maintain_portrait_ratio: bool = Form(True)
+):
+    """
+    Preprocess an uploaded image file and upload it to ImageKit
+
+    Multipart alternative to /preprocess-and-upload. The image is decoded
+    straight from the spooled upload instead of from a base64 string.
+    """
+    try:
+        if file.size is not None and file.size > UPLOAD_MAX_BYTES:
+            raise UploadTooLargeError(
+                f"Upload exceeds the maximum size of {UPLOAD_MAX_BYTES} bytes")
+
+        try:
+            img = Image.open(file.file)
+        except Exception as e:
+            raise InvalidImageError(
+                f"Uploaded file is not a valid image: {str(e)}")
+
+        return await asyncio.to_thread(
+            preprocess_and_store_image, img, image_type, maintain_portrait_ratio)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error preprocessing and uploading image file: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Error preprocessing and uploading image: {str(e)}")
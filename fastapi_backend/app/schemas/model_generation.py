@@ -127,4 +127,5 @@ class ReferenceImageAnalysisResponse(BaseModel):
 
 class GalleryResponse(BaseModel):
     """Schema for a gallery response"""
-    results: List[Dict[str, Any]] = Field(..., description="Gallery results") 
\ No newline at end of file
+    results: List[Dict[str, Any]] = Field(..., description="Gallery results")
+    nextCursor: Optional[str] = Field(None, description="Cursor for the next page, null on the last page") 
\ No newline at end of file
@@ -31,6 +31,14 @@ class TryOnRequest(BaseModel):
         None, description="API provider to use (aidge, fashn)")
 
 
+class TryOnMatrixRequest(TryOnRequest):
+    """Schema for a try-on job that puts every garment on every model"""
+    pollInterval: float = Field(
+        2, ge=0.5, le=60, description="Seconds between polling passes")
+    timeout: int = Field(
+        300, ge=10, le=1800, description="Seconds after which unfinished cells time out")
+
+
 class TryOnResponse(BaseModel):
     """Schema for a virtual try-on response"""
     taskId: str = Field(..., description="Task ID for the try-on request")
@@ -88,12 +96,18 @@ class UploadFileResponse(BaseModel):
         None, description="Width of the image in pixels")
     height: Optional[int] = Field(
         None, description="Height of the image in pixels")
+    contentHash: Optional[str] = Field(
+        None, description="SHA-256 hash of the stored file content")
+    size: Optional[int] = Field(
+        None, description="Size of the stored file in bytes")
 
 
 class GalleryResponse(BaseModel):
     """Schema for a gallery response"""
     results: List[Dict[str, Any]
                   ] = Field(..., description="List of try-on results")
+    nextCursor: Optional[str] = Field(
+        None, description="Cursor for the next page, null on the last page")
 
 
 class Base64ImageUploadRequest(BaseModel):
@@ -111,6 +125,6 @@ class ImagePreprocessRequest(BaseModel):
     image_type: str = Field(...,
                             description="Type of image (model or clothing)")
     filename: Optional[str] = Field(
-        None, description="Optional filename to use")
+        None, description="Ignored, processed images are named by their content hash")
     maintain_portrait_ratio: bool = Field(
         True, description="Whether to maintain 9:16 portrait ratio")
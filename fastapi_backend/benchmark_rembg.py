@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+CPU benchmark for the local background-removal tiers.
+
+Reports warm-up time, mean latency and images per second for each rembg tier.
+
+Usage:
+    python benchmark_rembg.py [--images DIR] [--count N] [--tiers preview,standard,final]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory to the path to allow imports from fastapi_backend
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from fastapi_backend.services.background_remover import (
+    RembgSessionPool,
+    REMBG_TIERS,
+    REMBG_WORKERS,
+    REMBG_ONNX_THREADS
+)
+
+
+def load_images(images_dir, count):
+    """Load up to count images from a directory, or create synthetic product shots."""
+    images = []
+    if images_dir:
+        for name in sorted(os.listdir(images_dir)):
+            if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
+                with Image.open(os.path.join(images_dir, name)) as img:
+                    images.append(img.convert("RGB"))
+            if len(images) >= count:
+                break
+
+    while len(images) < count:
+        # Grey backdrop with a coloured block standing in for the product
+        img = Image.new("RGB", (1024, 1365), (235, 235, 235))
+        img.paste((40 + len(images) * 20 % 200, 90, 160), (312, 300, 712, 1100))
+        images.append(img)
+
+    return images
+
+
+def benchmark_tier(tier, model_name, images, workers, onnx_threads):
+    """Run every image through one tier and return timing figures."""
+    pool = RembgSessionPool(workers=workers, onnx_threads=onnx_threads)
+
+    start_time = time.time()
+    pool.warm_up([model_name])
+    warm_up_seconds = time.time() - start_time
+
+    latencies = []
+
+    def run(image):
+        image_start = time.time()
+        pool.remove(image, model_name)
+        latencies.append(time.time() - image_start)
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(run, images))
+    total_seconds = time.time() - start_time
+
+    return {
+        "tier": tier,
+        "model": model_name,
+        "warm_up": warm_up_seconds,
+        "mean_latency": sum(latencies) / len(latencies),
+        "images_per_second": len(images) / total_seconds
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rembg model tiers on CPU")
+    parser.add_argument("--images", help="Directory with sample product images")
+    parser.add_argument("--count", type=int, default=10, help="Number of images per tier")
+    parser.add_argument("--tiers", default=",".join(REMBG_TIERS), help="Comma-separated tiers to run")
+    parser.add_argument("--workers", type=int, default=REMBG_WORKERS, help="Parallel workers")
+    parser.add_argument("--onnx-threads", type=int, default=REMBG_ONNX_THREADS, help="ONNX threads per session")
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.count)
+    print(f"Benchmarking {len(images)} images with {args.workers} workers x {args.onnx_threads} ONNX threads\n")
+    print(f"{'tier':<10} {'model':<20} {'warm-up s':>10} {'latency s':>10} {'img/s':>8}")
+
+    for tier in [t.strip() for t in args.tiers.split(",") if t.strip()]:
+        if tier not in REMBG_TIERS:
+            print(f"Skipping unknown tier: {tier}")
+            continue
+        result = benchmark_tier(tier, REMBG_TIERS[tier], images, args.workers, args.onnx_threads)
+        print(f"{result['tier']:<10} {result['model']:<20} {result['warm_up']:>10.2f} "
+              f"{result['mean_latency']:>10.3f} {result['images_per_second']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,24 @@
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 import uvicorn
 import os
+import asyncio
+import logging
 from fastapi_backend.app.api.api import api_router
-from fastapi_backend.app.api.backgound import router as background_router
+from fastapi_backend.app.api.backgound import router as background_router, prompt_pool
+from fastapi_backend.app.api.endpoints.virtual_tryon import virtual_tryon_service
+from fastapi_backend.app.api.endpoints.model_generation import model_generation_service
+from fastapi_backend.services.utils.retention import retention_sweeper
+from fastapi_backend.services.utils.blob_store import blob_store
+from fastapi_backend.services.utils.sharding import ShardedStaticFiles, migrate_directory
+from fastapi_backend.services.utils.file_lock import file_lock
+from fastapi_backend.services.background_remover import (
+    rembg_session_pool,
+    REMBG_TIERS,
+    REMBG_WARMUP_TIERS
+)
+
+logger = logging.getLogger(__name__)
 
 # Create upload and storage directories
 upload_dir = os.path.join(os.path.dirname(__file__), "uploads")
@@ -28,9 +42,83 @@ app.add_middleware(
 app.include_router(api_router, prefix="/api")
 app.include_router(background_router, prefix="/background")
 
+# Subdirectories stored in the hash-sharded layout, served under their flat URLs
+SHARDED_UPLOAD_DIRS = ("models", "clothing")
+SHARDED_STORAGE_DIRS = ("images", "model_generation")
+
 # Mount static directories
-app.mount("/uploads", StaticFiles(directory=upload_dir), name="uploads")
-app.mount("/storage", StaticFiles(directory=storage_dir), name="storage")
+app.mount("/uploads", ShardedStaticFiles(directory=upload_dir, sharded_subdirs=SHARDED_UPLOAD_DIRS), name="uploads")
+app.mount("/storage", ShardedStaticFiles(directory=storage_dir, sharded_subdirs=SHARDED_STORAGE_DIRS), name="storage")
+
+
+@app.on_event("startup")
+async def warm_up_background_removal():
+    """Load the rembg models for the warm-up tiers without blocking startup"""
+    models = [REMBG_TIERS[tier] for tier in REMBG_WARMUP_TIERS if tier in REMBG_TIERS]
+    if models:
+        asyncio.get_running_loop().run_in_executor(
+            None, rembg_session_pool.warm_up, models)
+
+
+@app.on_event("startup")
+async def start_prompt_pool_refill():
+    """Keep the background prompt pools of common attribute sets topped up"""
+    prompt_pool.start_refill_worker()
+
+
+@app.on_event("startup")
+async def migrate_to_sharded_layout():
+    """Move files left in the old flat layout into their shards without blocking startup"""
+    def migrate():
+        # Workers start together, one migrates while the others wait and find nothing left
+        with file_lock(os.path.join(storage_dir, ".migrate.lock")):
+            for subdir in SHARDED_UPLOAD_DIRS:
+                migrate_directory(os.path.join(upload_dir, subdir), on_move=blob_store.move_ref)
+            for subdir in SHARDED_STORAGE_DIRS:
+                migrate_directory(os.path.join(storage_dir, subdir), on_move=blob_store.move_ref)
+            # Blobs are stored and released under the store lock, so they do not move underneath it
+            with blob_store._lock:
+                migrate_directory(blob_store.root, skip=[blob_store.index_file.name])
+
+    def log_failure(future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception():
+            logger.error("Error migrating to the sharded layout", exc_info=future.exception())
+
+    asyncio.get_running_loop().run_in_executor(None, migrate).add_done_callback(log_failure)
+
+
+@app.on_event("startup")
+async def start_retention_sweep():
+    """Incrementally clean up old and orphaned images and uploads"""
+    retention_sweeper.start()
+
+
+@app.on_event("startup")
+async def resume_provider_jobs():
+    """Collect the results of try-on and generation jobs that were in flight when the app stopped"""
+    await virtual_tryon_service.resume_jobs()
+    await model_generation_service.resume_jobs()
+
+
+@app.on_event("startup")
+async def resume_title_generation():
+    """Queue the titles that were still being generated when the app stopped"""
+    queued = await virtual_tryon_service.storage_manager.resume_titles()
+    if queued:
+        logger.info(f"Queued titles for {queued} untitled results")
+
+
+@app.on_event("shutdown")
+async def close_provider_clients():
+    """Close pooled provider connections"""
+    await virtual_tryon_service.aidge_client.aclose()
+    await virtual_tryon_service.fashn_client.aclose()
+
+
+@app.on_event("shutdown")
+async def flush_prompt_pool():
+    """Write the prompt pool changes that are waiting for the next batched write"""
+    await prompt_pool.flush()
 
 
 async def root():
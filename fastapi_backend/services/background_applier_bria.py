@@ -1,7 +1,9 @@
 from PIL import Image
 import requests
+import httpx
 import os
 from dotenv import load_dotenv
+from fastapi_backend.services.utils.rate_limiter import rate_limiters
 import re
 
 # Load environment variables
@@ -13,6 +15,7 @@ class BackgroundApplier:
         self.bria_api_token = os.getenv(
             'BRIA_AUTH_TOKEN', '49033049b7044d3c81d9dea5fe36a125')
         self.bria_api_url = "https://engine.prod.bria-api.com/v1/background/replace"
+        self.request_timeout = int(os.getenv('BRIA_REQUEST_TIMEOUT', '120'))
 
     def add_background(self, foreground, background_path, output_path):
         """Adds a new background to the image with a transparent background."""
@@ -50,17 +53,15 @@ class BackgroundApplier:
         # print(fixed_url)
         # return fixed_url
 
-    def background_replace_using_bria_api(self, fast, bg_prompt, refine_prompt, original_quality, num_results, image_url):
+    def _build_bria_replace_request(self, fast, bg_prompt, refine_prompt, original_quality, num_results, image_url):
         """
-        Replace background using Bria API
+        Build the payload and headers for a Bria background replace request
         """
-        print("--------------------------------2")
-        
         # Only try to remove base64 header if the URL starts with data:image
         processed_url = image_url
         if image_url.startswith('data:image'):
             processed_url = self.remove_base64_header(image_url)
-            
+
         payload = {
             'fast': fast,
             'bg_prompt': bg_prompt,
@@ -76,12 +77,24 @@ class BackgroundApplier:
             'api_token': self.bria_api_token
         }
 
+        return payload, headers
+
+    def background_replace_using_bria_api(self, fast, bg_prompt, refine_prompt, original_quality, num_results, image_url):
+        """
+        Replace background using Bria API
+        """
+        print("--------------------------------2")
+
+        payload, headers = self._build_bria_replace_request(
+            fast, bg_prompt, refine_prompt, original_quality, num_results, image_url)
+
         print("Making request with:", {
             "url": self.bria_api_url,
             "headers": headers,
             "payload": payload
         })
 
+        rate_limiters.get('bria').throttle()
         response = requests.post(
             self.bria_api_url,
             json=payload,
@@ -98,3 +111,27 @@ class BackgroundApplier:
                 "error": f"Failed to replace background: {response.text}",
                 "status_code": response.status_code
             }
+
+    async def background_replace_using_bria_api_async(self, fast, bg_prompt, refine_prompt, original_quality, num_results, image_url):
+        """
+        Replace background using Bria API without blocking the event loop
+        """
+        payload, headers = self._build_bria_replace_request(
+            fast, bg_prompt, refine_prompt, original_quality, num_results, image_url)
+
+        async with httpx.AsyncClient(timeout=self.request_timeout) as client:
+            async with rate_limiters.get('bria').limit():
+                response = await client.post(self.bria_api_url, json=payload, headers=headers)
+
+        if response.status_code == 429:
+            rate_limiters.get('bria').pause(1)
+
+        print(f"Bria background replace response status: {response.status_code}")
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            return {
+                "error": f"Failed to replace background: {response.text}",
+                "status_code": response.status_code
+            }
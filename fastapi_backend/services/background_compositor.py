@@ -0,0 +1,216 @@
+"""
+Local background replacement by compositing product cutouts onto a library of
+pre-generated backgrounds
+"""
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+from dotenv import load_dotenv
+
+from fastapi_backend.services.utils.async_io import write_atomic
+
+# Load environment variables
+load_dotenv()
+
+STORAGE_DIR = Path(__file__).parent.parent / "storage"
+
+# Directory holding the pre-generated backgrounds, served under /storage/backgrounds
+BACKGROUND_LIBRARY_DIR = Path(os.getenv(
+    'BACKGROUND_LIBRARY_DIR', str(STORAGE_DIR / "backgrounds")))
+
+# Memory for resized backgrounds kept per worker (bytes, default 256 MB). A 2048x2048
+# background takes 12 MB, so the default holds about 20 of them at the largest canvas
+BACKGROUND_CACHE_BYTES = int(os.getenv('BACKGROUND_CACHE_BYTES', str(256 * 1024 * 1024)))
+
+# Largest canvas side and number of backgrounds accepted per request
+COMPOSITE_MAX_SIDE = int(os.getenv('COMPOSITE_MAX_SIDE', '2048'))
+COMPOSITE_MAX_BACKGROUNDS = int(os.getenv('COMPOSITE_MAX_BACKGROUNDS', '8'))
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+class BackgroundCompositor:
+    """Composites a cutout against many cached backgrounds, sharing the foreground work"""
+
+    def __init__(self, library_dir: Optional[Path] = None, output_dir: Optional[Path] = None,
+                 cache_bytes: int = BACKGROUND_CACHE_BYTES):
+        self.library_dir = Path(library_dir or BACKGROUND_LIBRARY_DIR)
+        self.output_dir = Path(output_dir or STORAGE_DIR / "composites")
+        self.library_dir.mkdir(parents=True, exist_ok=True)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    def list_backgrounds(self) -> List[str]:
+        """List the background names available in the library"""
+        return sorted(
+            name for name in os.listdir(self.library_dir)
+            if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith('.'))
+
+    def _load_background(self, name: str, size: Tuple[int, int]) -> np.ndarray:
+        """
+        Load a background cropped and resized to the canvas size
+
+        Resized backgrounds are kept in an LRU cache bounded by bytes, so
+        repeated composites at the same size skip decoding and resampling.
+        """
+        key = (name, size)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        path = self.library_dir / os.path.basename(name)
+        if not path.exists():
+            raise FileNotFoundError(f"Background not found in library: {name}")
+
+        with Image.open(path) as img:
+            fitted = ImageOps.fit(img.convert("RGB"), size, Image.LANCZOS)
+        array = np.asarray(fitted, dtype=np.uint8)
+
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = array
+                self._cached_bytes += array.nbytes
+            self._cache.move_to_end(key)
+            while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= evicted.nbytes
+        return array
+
+    def _place_cutout(self, cutout: Image.Image, size: Tuple[int, int], scale: float) -> Image.Image:
+        """
+        Trim the cutout to its visible pixels and place it bottom-centred on a
+        transparent canvas, scaled to fit within scale * canvas size
+        """
+        cutout = cutout.convert("RGBA")
+        bbox = cutout.getchannel("A").getbbox()
+        if bbox:
+            cutout = cutout.crop(bbox)
+
+        max_width = int(size[0] * scale)
+        max_height = int(size[1] * scale)
+        ratio = min(max_width / cutout.width, max_height / cutout.height)
+        cutout = cutout.resize(
+            (max(1, int(cutout.width * ratio)), max(1, int(cutout.height * ratio))), Image.LANCZOS)
+
+        canvas = Image.new("RGBA", size, (0, 0, 0, 0))
+        left = (size[0] - cutout.width) // 2
+        top = size[1] - cutout.height - (size[1] - max_height) // 2
+        canvas.paste(cutout, (left, top), cutout)
+        return canvas
+
+    def _shadow_mask(self, alpha: Image.Image, opacity: float, blur: int, offset: Tuple[int, int]) -> np.ndarray:
+        """Build a soft drop-shadow mask (H, W, 1) from the cutout alpha"""
+        shadow = ImageChops.offset(alpha, offset[0], offset[1])
+        shadow = shadow.filter(ImageFilter.GaussianBlur(blur))
+        return (np.asarray(shadow, dtype=np.float32)[..., None] / 255.0) * opacity
+
+    def composite(self,
+                  cutout: Image.Image,
+                  background_names: List[str],
+                  size: Optional[Tuple[int, int]] = None,
+                  scale: float = 0.9,
+                  shadow: bool = True,
+                  shadow_opacity: float = 0.35) -> Iterator[np.ndarray]:
+        """
+        Composite a cutout against several backgrounds
+
+        The cutout placement, alpha and shadow are computed once, then each
+        background is blended on its own, so memory stays at a single
+        canvas whatever the number of backgrounds.
+
+        Args:
+            cutout: RGBA cutout of the product
+            background_names: Names of library backgrounds to use
+            size: Canvas size (width, height), defaults to the cutout size
+            scale: Largest fraction of the canvas the product may fill
+            shadow: Whether to add a soft drop shadow under the product
+            shadow_opacity: Darkness of the shadow (0-1)
+
+        Yields:
+            Array of shape (H, W, 3) per background, in order
+        """
+        size = tuple(size or cutout.size)
+        placed = self._place_cutout(cutout, size, scale)
+
+        rgba = np.asarray(placed, dtype=np.float32)
+        alpha = rgba[..., 3:] / 255.0
+        foreground = rgba[..., :3] * alpha
+        # Background weight, darkened under the shadow
+        background_weight = 1.0 - alpha
+
+        if shadow:
+            blur = max(2, size[1] // 100)
+            offset = (size[0] // 80, size[1] // 60)
+            shadow_mask = self._shadow_mask(placed.getchannel("A"), shadow_opacity, blur, offset)
+            background_weight *= 1.0 - shadow_mask
+
+        for name in background_names:
+            background = self._load_background(name, size)
+            composite = background * background_weight
+            composite += foreground + 0.5
+            yield np.clip(composite, 0, 255).astype(np.uint8)
+
+    def composite_to_storage(self,
+                             cutout_path: Path,
+                             background_names: List[str],
+                             size: Optional[Tuple[int, int]] = None,
+                             scale: float = 0.9,
+                             shadow: bool = True) -> List[Dict[str, Any]]:
+        """
+        Composite a stored cutout against backgrounds and save the results as JPEG
+
+        Results are named after the cutout, background and options, so
+        composites that already exist on disk are not rendered again.
+
+        Returns:
+            One dictionary per background with fileUrl, fileName and background
+        """
+        cutout_path = Path(cutout_path)
+        results = []
+        pending = []
+
+        with Image.open(cutout_path) as cutout:
+            cutout.load()
+        canvas_size = tuple(size or cutout.size)
+        if max(canvas_size) > COMPOSITE_MAX_SIDE:
+            # Large cutouts set the canvas size too, keep it within the limit
+            ratio = COMPOSITE_MAX_SIDE / max(canvas_size)
+            canvas_size = tuple(max(1, int(side * ratio)) for side in canvas_size)
+
+        for name in background_names:
+            key = f"{cutout_path.name}|{name}|{canvas_size}|{scale}|{shadow}"
+            filename = f"{hashlib.sha256(key.encode()).hexdigest()}.jpg"
+            results.append({
+                "fileUrl": f"/storage/composites/{filename}",
+                "fileName": filename,
+                "background": name
+            })
+            if not (self.output_dir / filename).exists():
+                pending.append((name, filename))
+
+        if pending:
+            composites = self.composite(
+                cutout, [name for name, _ in pending], canvas_size, scale, shadow)
+            for (_, filename), pixels in zip(pending, composites):
+                # Written atomically, concurrent requests and clients fetching the URL never see a partial JPEG
+                buffer = io.BytesIO()
+                Image.fromarray(pixels).save(buffer, "JPEG", quality=95)
+                write_atomic(self.output_dir / filename, buffer.getvalue())
+
+        return results
+
+
+# Shared compositor so the background cache is reused across requests
+background_compositor = BackgroundCompositor()
@@ -1,5 +1,12 @@
-from rembg import remove
+from rembg import remove, new_session
 from PIL import Image
+from io import BytesIO
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import asyncio
+import threading
+import uuid
 import requests
 import time
 import hmac
@@ -11,6 +18,133 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+# Speed/quality tiers mapped to rembg models, from fastest to best quality
+REMBG_TIERS = {
+    'preview': os.getenv('REMBG_PREVIEW_MODEL', 'u2netp'),
+    'standard': os.getenv('REMBG_STANDARD_MODEL', 'u2net'),
+    'final': os.getenv('REMBG_FINAL_MODEL', 'isnet-general-use'),
+}
+
+# Models a request may name, the rembg models plus any configured for a tier
+REMBG_MODELS = frozenset((
+    'u2net', 'u2netp', 'u2net_human_seg', 'u2net_cloth_seg', 'silueta',
+    'isnet-general-use', 'isnet-anime', 'birefnet-general', 'birefnet-general-lite',
+    'birefnet-portrait', 'birefnet-dis', 'birefnet-hrsod', 'birefnet-cod', 'birefnet-massive',
+    *REMBG_TIERS.values(),
+))
+
+# Tier used when a request names neither a tier nor a model
+REMBG_DEFAULT_TIER = os.getenv('REMBG_DEFAULT_TIER', 'standard')
+
+# Default rembg model used when a request does not name one
+REMBG_DEFAULT_MODEL = os.getenv('REMBG_MODEL', REMBG_TIERS.get(REMBG_DEFAULT_TIER, 'u2net'))
+
+# Tiers whose sessions are loaded at startup
+REMBG_WARMUP_TIERS = [
+    tier.strip() for tier in os.getenv('REMBG_WARMUP_TIERS', 'preview,standard').split(',') if tier.strip()]
+
+# Largest number of images accepted by one batch request
+REMBG_MAX_BATCH = int(os.getenv('REMBG_MAX_BATCH', '8'))
+
+# Number of images processed in parallel
+REMBG_WORKERS = int(os.getenv('REMBG_WORKERS', '2'))
+
+# ONNX Runtime threads per session, split the cores between the workers by default
+REMBG_ONNX_THREADS = int(os.getenv(
+    'REMBG_ONNX_THREADS', str(max(1, (os.cpu_count() or 1) // max(1, REMBG_WORKERS)))))
+
+
+def resolve_rembg_model(tier: Optional[str] = None, model_name: Optional[str] = None) -> str:
+    """
+    Resolve the rembg model for a request
+
+    An explicit model name wins over the tier. Without either, the default
+    model is used.
+
+    Raises:
+        ValueError: If the tier or model is unknown
+    """
+    if model_name:
+        if model_name not in REMBG_MODELS:
+            raise ValueError(
+                f"Unknown model '{model_name}'. Must be one of: {', '.join(sorted(REMBG_MODELS))}")
+        return model_name
+    if tier:
+        if tier not in REMBG_TIERS:
+            raise ValueError(
+                f"Unknown tier '{tier}'. Must be one of: {', '.join(REMBG_TIERS)}")
+        return REMBG_TIERS[tier]
+    return REMBG_DEFAULT_MODEL
+
+
+class RembgSessionPool:
+    """Keeps one warmed rembg session per model and runs removals on a bounded worker pool"""
+
+    def __init__(self, workers: int = REMBG_WORKERS, onnx_threads: int = REMBG_ONNX_THREADS):
+        self.workers = workers
+        self.onnx_threads = onnx_threads
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="rembg")
+
+    def get_session(self, model_name: Optional[str] = None):
+        """Return the session for a model, creating it on first use"""
+        model_name = model_name or REMBG_DEFAULT_MODEL
+        session = self._sessions.get(model_name)
+        if session is not None:
+            return session
+
+        with self._lock:
+            if model_name not in self._sessions:
+                # rembg sizes the ONNX thread pools from OMP_NUM_THREADS when
+                # the session is created
+                previous = os.environ.get('OMP_NUM_THREADS')
+                os.environ['OMP_NUM_THREADS'] = str(self.onnx_threads)
+                try:
+                    self._sessions[model_name] = new_session(model_name)
+                finally:
+                    if previous is None:
+                        os.environ.pop('OMP_NUM_THREADS', None)
+                    else:
+                        os.environ['OMP_NUM_THREADS'] = previous
+                print(f"Loaded rembg session for model {model_name} with {self.onnx_threads} ONNX threads")
+            return self._sessions[model_name]
+
+    def warm_up(self, model_names: List[str]) -> None:
+        """
+        Load the sessions for the given models and run one small inference each
+
+        The first inference allocates the ONNX Runtime buffers, so running it
+        here keeps that cost off the first real request.
+        """
+        sample = Image.new("RGB", (64, 64), (255, 255, 255))
+        for model_name in model_names:
+            try:
+                start_time = time.time()
+                self.remove(sample, model_name)
+                print(f"Warmed up rembg model {model_name} in {time.time() - start_time:.1f}s")
+            except Exception as e:
+                print(f"Error warming up rembg model {model_name}: {str(e)}")
+
+    def remove(self, image: Image.Image, model_name: Optional[str] = None) -> Image.Image:
+        """Remove the background from an image using the pooled session"""
+        return remove(image, session=self.get_session(model_name))
+
+    def _remove_bytes(self, image_bytes: bytes, model_name: Optional[str]) -> Image.Image:
+        image = Image.open(BytesIO(image_bytes))
+        return self.remove(image, model_name)
+
+    async def remove_async(self, image_bytes: bytes, model_name: Optional[str] = None) -> Image.Image:
+        """Remove the background from encoded image bytes on the worker pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._remove_bytes, image_bytes, model_name)
+
+
+# Shared pool so sessions are loaded once per process
+rembg_session_pool = RembgSessionPool()
+
+
 class BackgroundRemover:
     def __init__(self):
         # Load API credentials from environment variables
@@ -18,18 +152,98 @@ class BackgroundRemover:
         self.access_key_secret = os.getenv('AIDC_ACCESS_KEY_SECRET')
         self.api_domain = os.getenv('AIDC_API_DOMAIN', 'api.aidc-ai.com')
 
-    def remove_background(self, input_path, output_path):
+        # Directory where local cutouts are stored, served under /storage/cutouts
+        self.cutouts_dir = Path(__file__).parent.parent / "storage" / "cutouts"
+        self.cutouts_dir.mkdir(parents=True, exist_ok=True)
+
+    def remove_background(self, input_path, output_path, model_name=None):
         # Open the input image
         image = Image.open(input_path)
-        
+
         # Remove the background
-        output = remove(image)
-        
+        output = rembg_session_pool.remove(image, model_name)
+
         # Save the output image
         output.save(output_path, "PNG")
         print(f"Background removed successfully! Saved as {output_path}")
         return output
 
+    @staticmethod
+    def _image_size(path: Path):
+        with Image.open(path) as image:
+            return image.size
+
+    def _save_png(self, image: Image.Image, filepath: Path) -> None:
+        """Encode a cutout as PNG and move it into place atomically"""
+        temp_path = self.cutouts_dir / f".{uuid.uuid4().hex}.part"
+        image.save(temp_path, "PNG")
+        os.replace(temp_path, filepath)
+
+    async def remove_background_to_storage(self, image_bytes: bytes, model_name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Remove the background from an image and store the cutout as PNG
+
+        Cutouts are named after the input content and model, so repeated
+        requests for the same image are served from disk.
+
+        Args:
+            image_bytes: Encoded input image
+            model_name: rembg model to use
+
+        Returns:
+            Dictionary with fileUrl, width, height and model
+
+        Raises:
+            ValueError: If the model is unknown
+        """
+        # The model name is part of the filename, so only known models are accepted
+        model_name = resolve_rembg_model(model_name=model_name)
+        content_hash = hashlib.sha256(image_bytes).hexdigest()
+        filename = f"{content_hash}_{model_name}.png"
+        filepath = self.cutouts_dir / filename
+
+        if filepath.exists():
+            width, height = await asyncio.to_thread(self._image_size, filepath)
+        else:
+            output = await rembg_session_pool.remove_async(image_bytes, model_name)
+            await asyncio.to_thread(self._save_png, output, filepath)
+            width, height = output.size
+
+        return {
+            "fileUrl": f"/storage/cutouts/{filename}",
+            "width": width,
+            "height": height,
+            "model": model_name
+        }
+
+    async def remove_backgrounds_to_storage(self, images: List[bytes], model_name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Remove the backgrounds from a batch of images
+
+        The images are processed concurrently on the shared worker pool. Failures
+        are reported per image instead of failing the whole batch.
+
+        Args:
+            images: Encoded input images
+            model_name: rembg model to use
+
+        Returns:
+            One result per input, either a stored cutout or an error
+        """
+        results = await asyncio.gather(
+            *[self.remove_background_to_storage(image, model_name) for image in images],
+            return_exceptions=True
+        )
+
+        batch = []
+        for index, result in enumerate(results):
+            if isinstance(result, Exception):
+                print(f"Error removing background from image {index}: {result}")
+                batch.append({"index": index, "error": str(result)})
+            else:
+                batch.append({"index": index, **result})
+        return batch
+
     def background_remove_using_aidc_api(self, data):
         api_name = "/ai/image/cut/out"
 
@@ -61,4 +275,4 @@ class BackgroundRemover:
         # Http request
         response = requests.post(url, data=request_data, headers=headers)
         print(response.text)
-        return response.text
\ No newline at end of file
+        return response.text
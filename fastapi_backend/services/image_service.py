@@ -1,13 +1,14 @@
 import os
+import asyncio
 import requests
 import json
-from typing import Dict, Any, Optional
-import tempfile
+from typing import Dict, Any, Optional, Tuple
 from pathlib import Path
 import aiohttp
 import ssl
 import base64
-import shutil
+from fastapi_backend.services.utils.rate_limiter import rate_limiters
+from fastapi_backend.services.utils.fetch_cache import fetch_cache
 
 
 class ImageService:
@@ -19,12 +20,11 @@ class ImageService:
         self.bria_api_token = os.getenv("BRIA_AUTH_TOKEN", "")
         self.bria_api_base_url = "https://engine.prod.bria-api.com/v1"
 
-    def _download_image(self, image_url: str) -> str:
-        """Download image from URL and save to temp file"""
+    def _download_image(self, image_url: str) -> Tuple[bytes, str]:
+        """Download image from URL and return its content and file extension"""
         try:
             # Disable SSL verification for the download request as well
-            response = requests.get(image_url, stream=True, verify=False)
-            response.raise_for_status()
+            cached = fetch_cache.fetch_sync(image_url, verify=False)
 
             # Get file extension from URL, but strip query parameters first
             url_path = image_url.split('?')[0]  # Remove query parameters
@@ -34,11 +34,8 @@ class ImageService:
             if len(ext) > 10:  # Reasonable limit for file extensions
                 ext = '.png'  # Default to .png if extension seems invalid
 
-            # Create temp file with correct extension
-            with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as temp_file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    temp_file.write(chunk)
-                return temp_file.name
+            # Read straight from the cache, no temp file copy
+            return cached.path.read_bytes(), ext
         except Exception as e:
             raise Exception(f"Failed to download image: {str(e)}")
 
@@ -56,28 +53,18 @@ class ImageService:
         print(f"Downloading image from Bria API URL: {bria_url}")
         try:
             # Download the image from Bria
-            temp_file_path = self._download_image(bria_url)
-
-            try:
-                # Read the file content
-                with open(temp_file_path, 'rb') as f:
-                    file_content = f.read()
-
-                # Upload to ImageKit
-                imagekit_url = self.upload_file_to_imagekit(
-                    file_content,
-                    "result.png",
-                    "virtual-tryon/results"
-                )
-
-                print(f"Bria result uploaded to ImageKit: {imagekit_url}")
-                return imagekit_url
-            finally:
-                # Clean up temp file
-                try:
-                    os.unlink(temp_file_path)
-                except Exception as e:
-                    print(f"Warning: Failed to clean up temp file: {str(e)}")
+            file_content, _ = await fetch_cache.fetch_bytes(bria_url, verify=False)
+
+            # Upload to ImageKit
+            imagekit_url = await asyncio.to_thread(
+                self.upload_file_to_imagekit,
+                file_content,
+                "result.png",
+                "virtual-tryon/results"
+            )
+
+            print(f"Bria result uploaded to ImageKit: {imagekit_url}")
+            return imagekit_url
         except Exception as e:
             print(f"Error processing Bria result: {str(e)}")
             # Return the original URL as fallback
@@ -99,60 +86,47 @@ class ImageService:
             print(f"Uploading file to ImageKit in folder {folder}...")
             url = "https://upload.imagekit.io/api/v1/files/upload"
 
-            # Create a temporary file to send to ImageKit
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_file:
-                temp_file.write(file_content)
-                temp_file_path = temp_file.name
-
-            try:
-                # Prepare the multipart form data
-                files = {
-                    'file': (file_name, open(temp_file_path, 'rb'), 'image/png')
-                }
-
-                # Set the payload parameters
-                payload = {
-                    "fileName": file_name,
-                    "publicKey": "public_gTBjx7RWLu8I8OqyodA+EWeCzVU=",
-                    "folder": folder,
-                    "useUniqueFileName": "true"
-                }
+            # Prepare the multipart form data, the content is sent from memory
+            files = {
+                'file': (file_name, file_content, 'image/png')
+            }
 
-                # Set the headers
-                headers = {
-                    "Accept": "application/json",
-                    "Authorization": f"Basic {os.getenv('IMAGEKIT_API_KEY')}"
-                }
+            # Set the payload parameters
+            payload = {
+                "fileName": file_name,
+                "publicKey": "public_gTBjx7RWLu8I8OqyodA+EWeCzVU=",
+                "folder": folder,
+                "useUniqueFileName": "true"
+            }
 
-                # Make the API request
-                response = requests.post(
-                    url, data=payload, files=files, headers=headers, verify=False)
+            # Set the headers
+            headers = {
+                "Accept": "application/json",
+                "Authorization": f"Basic {os.getenv('IMAGEKIT_API_KEY')}"
+            }
 
-                if not response.ok:
-                    error_data = response.json() if response.text else {
-                        "error": "Unknown error"}
-                    print(f"ImageKit upload error: {error_data}")
-                    raise Exception(
-                        f"ImageKit upload failed with status {response.status_code}: {error_data.get('error', 'Unknown error')}")
+            # Make the API request
+            rate_limiters.get('imagekit').throttle()
+            response = requests.post(
+                url, data=payload, files=files, headers=headers, verify=False)
 
-                # Parse the response
-                response_data = response.json()
+            if not response.ok:
+                error_data = response.json() if response.text else {
+                    "error": "Unknown error"}
+                print(f"ImageKit upload error: {error_data}")
+                raise Exception(
+                    f"ImageKit upload failed with status {response.status_code}: {error_data.get('error', 'Unknown error')}")
 
-                if "url" not in response_data:
-                    print(f"ImageKit response missing URL: {response_data}")
-                    raise Exception("ImageKit response missing URL field")
+            # Parse the response
+            response_data = response.json()
 
-                print(
-                    f"File uploaded successfully to: {response_data['url']}")
-                return response_data["url"]
+            if "url" not in response_data:
+                print(f"ImageKit response missing URL: {response_data}")
+                raise Exception("ImageKit response missing URL field")
 
-            finally:
-                # Clean up the temporary file
-                try:
-                    os.unlink(temp_file_path)
-                except Exception as e:
-                    print(
-                        f"Warning: Failed to clean up temporary file {temp_file_path}: {str(e)}")
+            print(
+                f"File uploaded successfully to: {response_data['url']}")
+            return response_data["url"]
 
         except Exception as e:
             print(f"Error uploading file to ImageKit: {str(e)}")
@@ -223,8 +197,8 @@ class ImageService:
                     # Upload image to ImageKit
                     print(
                         "Detected blob URL for image, uploading file content to ImageKit...")
-                    image_url = self.upload_file_to_imagekit(
-                        image_file_content, "image.png", "virtual-tryon/edits")
+                    image_url = await asyncio.to_thread(
+                        self.upload_file_to_imagekit, image_file_content, "image.png", "virtual-tryon/edits")
                     print(f"Image uploaded to ImageKit: {image_url}")
 
                 payload["image_url"] = image_url
@@ -232,8 +206,8 @@ class ImageService:
                 try:
                     # Upload image to ImageKit
                     print("Uploading image file content to ImageKit...")
-                    image_url = self.upload_file_to_imagekit(
-                        image_file_content, "image.png", "virtual-tryon/edits")
+                    image_url = await asyncio.to_thread(
+                        self.upload_file_to_imagekit, image_file_content, "image.png", "virtual-tryon/edits")
                     print(f"Image uploaded to ImageKit: {image_url}")
                     payload["image_url"] = image_url
                 except Exception as upload_err:
@@ -248,7 +222,7 @@ class ImageService:
             mask_url = None
             try:
                 # Upload mask to ImageKit to get a URL
-                mask_url = self.upload_mask_to_imagekit(mask_file_content)
+                mask_url = await asyncio.to_thread(self.upload_mask_to_imagekit, mask_file_content)
                 payload["mask_url"] = mask_url
                 print(f"Using mask_url: {mask_url}")
             except Exception as upload_err:
@@ -405,8 +379,8 @@ class ImageService:
                     # Upload image to ImageKit
                     print(
                         "Detected blob URL for image, uploading file content to ImageKit...")
-                    image_url = self.upload_file_to_imagekit(
-                        image_file_content, "image.png", "virtual-tryon/edits")
+                    image_url = await asyncio.to_thread(
+                        self.upload_file_to_imagekit, image_file_content, "image.png", "virtual-tryon/edits")
                     print(f"Image uploaded to ImageKit: {image_url}")
 
                 payload["image_url"] = image_url
@@ -414,8 +388,8 @@ class ImageService:
                 try:
                     # Upload image to ImageKit
                     print("Uploading image file content to ImageKit...")
-                    image_url = self.upload_file_to_imagekit(
-                        image_file_content, "image.png", "virtual-tryon/edits")
+                    image_url = await asyncio.to_thread(
+                        self.upload_file_to_imagekit, image_file_content, "image.png", "virtual-tryon/edits")
                     print(f"Image uploaded to ImageKit: {image_url}")
                     payload["image_url"] = image_url
                 except Exception as upload_err:
@@ -430,7 +404,7 @@ class ImageService:
             mask_url = None
             try:
                 # Upload mask to ImageKit to get a URL
-                mask_url = self.upload_mask_to_imagekit(mask_file_content)
+                mask_url = await asyncio.to_thread(self.upload_mask_to_imagekit, mask_file_content)
                 payload["mask_url"] = mask_url
                 print(f"Using mask_url: {mask_url}")
             except Exception as upload_err:
@@ -543,162 +517,131 @@ class ImageService:
         try:
             # Download the image first
             print(f"Downloading image from {image_url}...")
-            temp_file_path = self._download_image(image_url)
-            print(f"Image downloaded to {temp_file_path}")
+            image_content, image_ext = self._download_image(image_url)
+            print(f"Image downloaded ({len(image_content)} bytes)")
 
-            try:
-                # Call the Bria AI API to upscale the image
-                url = f"{self.bria_api_base_url}/image/increase_resolution"
-
-                # Prepare the multipart form data
-                files = {
-                    'file': ('image' + Path(temp_file_path).suffix, open(temp_file_path, 'rb'), 'image/jpeg')
-                }
-
-                data = {
-                    'scale': str(scale),
-                    'enhance_quality': str(enhance_quality).lower(),
-                    'preserve_details': str(preserve_details).lower(),
-                    'remove_noise': str(remove_noise).lower()
-                }
+            # Call the Bria AI API to upscale the image
+            url = f"{self.bria_api_base_url}/image/increase_resolution"
 
-                # Set the headers
-                headers = {
-                    "api_token": self.bria_api_token
-                }
+            # Prepare the multipart form data
+            files = {
+                'file': ('image' + image_ext, image_content, 'image/jpeg')
+            }
 
-                print("Making request to Bria API...")
-                print("Form data:", data)
-                print("Using headers:", {
-                      k: v if k != "api_token" else "[REDACTED]" for k, v in headers.items()})
+            data = {
+                'scale': str(scale),
+                'enhance_quality': str(enhance_quality).lower(),
+                'preserve_details': str(preserve_details).lower(),
+                'remove_noise': str(remove_noise).lower()
+            }
 
-                # Make the API request with SSL verification disabled
-                # Disable SSL verification for requests to avoid certificate issues
-                response = requests.post(
-                    url, files=files, data=data, headers=headers, verify=False
-                )
+            # Set the headers
+            headers = {
+                "api_token": self.bria_api_token
+            }
 
-                print(f"Bria API response status code: {response.status_code}")
-                print("Bria API response headers:", dict(response.headers))
-                print("Bria API raw response text:", response.text)
+            print("Making request to Bria API...")
+            print("Form data:", data)
+            print("Using headers:", {
+                  k: v if k != "api_token" else "[REDACTED]" for k, v in headers.items()})
+
+            # Make the API request with SSL verification disabled
+            # Disable SSL verification for requests to avoid certificate issues
+            rate_limiters.get('bria').throttle()
+            response = requests.post(
+                url, files=files, data=data, headers=headers, verify=False
+            )
+
+            print(f"Bria API response status code: {response.status_code}")
+            print("Bria API response headers:", dict(response.headers))
+            print("Bria API raw response text:", response.text)
+
+            # Check if the request was successful
+            if response.status_code != 200:
+                error_message = "Unknown error"
+                try:
+                    error_data = response.json()
+                    if isinstance(error_data, dict):
+                        error_message = error_data.get(
+                            "message", "Unknown error")
+                except:
+                    error_message = response.text or "Unknown error"
+                raise Exception(
+                    f"Bria API error (status {response.status_code}): {error_message}")
 
-                # Check if the request was successful
-                if response.status_code != 200:
-                    error_message = "Unknown error"
-                    try:
-                        error_data = response.json()
-                        if isinstance(error_data, dict):
-                            error_message = error_data.get(
-                                "message", "Unknown error")
-                    except:
-                        error_message = response.text or "Unknown error"
+            # Parse the response
+            try:
+                # Try to parse as JSON
+                data = response.json()
+                print("Bria API parsed JSON response:",
+                      json.dumps(data, indent=2))
+
+                # Check if data is a dictionary
+                if not isinstance(data, dict):
+                    print("Response is not a dictionary:", data)
+                    # If it's a string, it might be a direct URL
+                    if isinstance(data, str) and (data.startswith('http://') or data.startswith('https://')):
+                        return {
+                            "upscaledImageUrl": data,
+                            "originalImageUrl": image_url
+                        }
                     raise Exception(
-                        f"Bria API error (status {response.status_code}): {error_message}")
-
-                # Parse the response
-                try:
-                    # Try to parse as JSON
-                    data = response.json()
-                    print("Bria API parsed JSON response:",
+                        f"Unexpected response format: {type(data)}")
+
+                # Extract the upscaled image URL checking for different response formats
+                upscaled_image_url = None
+                if "urls" in data and isinstance(data["urls"], list) and data["urls"]:
+                    # New format with urls array
+                    upscaled_image_url = data["urls"][0]
+                elif "result_url" in data:
+                    upscaled_image_url = data["result_url"]
+                elif "result" in data and isinstance(data["result"], dict) and "imageUrl" in data["result"]:
+                    upscaled_image_url = data["result"]["imageUrl"]
+
+                if not upscaled_image_url:
+                    # Log the full response for debugging
+                    print("Unable to find upscaled image URL in response:",
                           json.dumps(data, indent=2))
+                    raise Exception(
+                        "No upscaled image URL in the Bria API response")
 
-                    # Check if data is a dictionary
-                    if not isinstance(data, dict):
-                        print("Response is not a dictionary:", data)
-                        # If it's a string, it might be a direct URL
-                        if isinstance(data, str) and (data.startswith('http://') or data.startswith('https://')):
-                            return {
-                                "upscaledImageUrl": data,
-                                "originalImageUrl": image_url
-                            }
-                        raise Exception(
-                            f"Unexpected response format: {type(data)}")
+                # Download the Bria image and upload to ImageKit
+                print("Downloading result from Bria and uploading to ImageKit...")
+                file_content, _ = self._download_image(upscaled_image_url)
 
-                    # Extract the upscaled image URL checking for different response formats
-                    upscaled_image_url = None
-                    if "urls" in data and isinstance(data["urls"], list) and data["urls"]:
-                        # New format with urls array
-                        upscaled_image_url = data["urls"][0]
-                    elif "result_url" in data:
-                        upscaled_image_url = data["result_url"]
-                    elif "result" in data and isinstance(data["result"], dict) and "imageUrl" in data["result"]:
-                        upscaled_image_url = data["result"]["imageUrl"]
-
-                    if not upscaled_image_url:
-                        # Log the full response for debugging
-                        print("Unable to find upscaled image URL in response:",
-                              json.dumps(data, indent=2))
-                        raise Exception(
-                            "No upscaled image URL in the Bria API response")
+                browser_viewable_url = self.upload_file_to_imagekit(
+                    file_content,
+                    "upscaled.png",
+                    "virtual-tryon/upscaled"
+                )
 
-                    # Download the Bria image and upload to ImageKit
-                    print("Downloading result from Bria and uploading to ImageKit...")
-                    bria_image_path = self._download_image(upscaled_image_url)
+                print(
+                    f"Upscaled image uploaded to ImageKit: {browser_viewable_url}")
 
-                    try:
-                        with open(bria_image_path, 'rb') as f:
-                            file_content = f.read()
+                # Return the upscaled image URL and original image URL
+                return {
+                    "upscaledImageUrl": browser_viewable_url,
+                    "originalImageUrl": image_url
+                }
 
-                        browser_viewable_url = self.upload_file_to_imagekit(
-                            file_content,
-                            "upscaled.png",
-                            "virtual-tryon/upscaled"
-                        )
+            except json.JSONDecodeError:
+                # If it's not JSON, it might be a direct response with the URL
+                if response.text and (response.text.startswith('http://') or response.text.startswith('https://')):
+                    # Download and reupload
+                    file_content, _ = self._download_image(response.text)
 
-                        print(
-                            f"Upscaled image uploaded to ImageKit: {browser_viewable_url}")
+                    browser_viewable_url = self.upload_file_to_imagekit(
+                        file_content,
+                        "upscaled.png",
+                        "virtual-tryon/upscaled"
+                    )
 
-                        # Return the upscaled image URL and original image URL
-                        return {
-                            "upscaledImageUrl": browser_viewable_url,
-                            "originalImageUrl": image_url
-                        }
-                    finally:
-                        # Clean up downloaded file
-                        try:
-                            os.unlink(bria_image_path)
-                        except Exception as e:
-                            print(
-                                f"Warning: Failed to clean up downloaded file: {str(e)}")
-
-                except json.JSONDecodeError:
-                    # If it's not JSON, it might be a direct response with the URL
-                    if response.text and (response.text.startswith('http://') or response.text.startswith('https://')):
-                        # Download and reupload
-                        bria_image_path = self._download_image(response.text)
-
-                        try:
-                            with open(bria_image_path, 'rb') as f:
-                                file_content = f.read()
-
-                            browser_viewable_url = self.upload_file_to_imagekit(
-                                file_content,
-                                "upscaled.png",
-                                "virtual-tryon/upscaled"
-                            )
+                    return {
+                        "upscaledImageUrl": browser_viewable_url,
+                        "originalImageUrl": image_url
+                    }
 
-                            return {
-                                "upscaledImageUrl": browser_viewable_url,
-                                "originalImageUrl": image_url
-                            }
-                        finally:
-                            # Clean up downloaded file
-                            try:
-                                os.unlink(bria_image_path)
-                            except Exception as e:
-                                print(
-                                    f"Warning: Failed to clean up downloaded file: {str(e)}")
-
-                    raise Exception(f"Invalid JSON response: {response.text}")
-
-            finally:
-                # Clean up the temporary file
-                try:
-                    os.unlink(temp_file_path)
-                    print(f"Cleaned up temporary file {temp_file_path}")
-                except Exception as e:
-                    print(
-                        f"Warning: Failed to clean up temporary file {temp_file_path}: {str(e)}")
+                raise Exception(f"Invalid JSON response: {response.text}")
 
         except Exception as e:
             print(f"Error upscaling image: {str(e)}")
@@ -10,6 +10,7 @@ from io import BytesIO
 import tempfile
 from openai import OpenAI
 from dotenv import load_dotenv
+from fastapi_backend.services.utils.rate_limiter import rate_limiters
 
 # Load environment variables
 load_dotenv()
@@ -137,6 +138,7 @@ class ImageTagger:
         # Call the vision model
         start_time = time.time()
         try:
+            rate_limiters.get('openai').throttle()
             response = self.client.chat.completions.create(
                 model=self.model,
                 messages=[
@@ -6,10 +6,19 @@ import json
 import time
 import asyncio
 import logging
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import httpx
 from dotenv import load_dotenv
 from .utils.storage import StorageManager
+from fastapi_backend.services.utils.rate_limiter import rate_limiters
+from fastapi_backend.services.utils.derivatives import derivatives, derivative_key
+from fastapi_backend.services.utils.sharding import iter_files, sharded_path
+from fastapi_backend.services.utils.async_io import read_json_file, run_io, write_json_file
+from fastapi_backend.services.utils.file_lock import file_lock
+from fastapi_backend.services.utils.job_registry import COMPLETED, FAILED, PROCESSING, Job, job_id, job_registry
+from fastapi_backend.services.utils.gallery_query import (
+    GALLERY_DEFAULT_LIMIT, GalleryFilters, GalleryRecord, GalleryStore, clamp_limit, to_timestamp
+)
 from .reference_image_analyzer import ReferenceImageAnalyzer
 import base64
 import re
@@ -40,10 +49,19 @@ class ModelGenerationService:
         self.default_model_id = os.getenv('LEONARDO_MODEL_ID', 'b2614463-296c-462a-9586-aafdb8f00e36')  # Flux Precision (Flux Dev)
         self.storage_manager = StorageManager()
         self.reference_analyzer = ReferenceImageAnalyzer()
+        # Running thumbnail jobs by record path, so each record has at most one
+        # and they are not garbage collected
+        self._thumbnail_tasks: Dict[str, asyncio.Task] = {}
         
         # Storage directory for generated images
         self.storage_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "storage", "model_generation")
         os.makedirs(self.storage_dir, exist_ok=True)
+        # Serializes writes of generation records across workers
+        self._records_lock = file_lock(os.path.join(self.storage_dir, ".records.lock"))
+        # Gallery of the records, ordered by the timestamp stored in each record
+        self._gallery = GalleryStore(
+            os.path.join(os.path.dirname(self.storage_dir), "model_generation.sqlite3"),
+            legacy=self._legacy_gallery)
         
         # Organize poses into categories for female full body
         self.female_full_body_poses_by_category = {
@@ -213,35 +231,80 @@ class ModelGenerationService:
         for poses in self.male_full_body_poses_by_category.values():
             self.male_full_body_poses.extend(poses)
             
-    def _save_json_file(self, filepath: str, data: Dict[str, Any]) -> None:
-        """Save data to a JSON file
+    async def _save_generation_result(self, generation_id: str, images: List[Dict[str, Any]]) -> None:
+        """Persist finished generation images and schedule their gallery thumbnails
         
         Args:
-            filepath: Path to the JSON file
-            data: Data to save
+            generation_id: ID of the generation
+            images: Generated images, each with a url
         """
+        missing = []
+        for image in images:
+            manifest = await run_io(derivatives.lookup, derivative_key(image["url"])) if image.get("url") else None
+            if manifest:
+                image["thumbnails"] = manifest["thumbnails"]
+                image["placeholder"] = manifest["placeholder"]
+            elif image.get("url"):
+                missing.append(image["url"])
+
+        result_data = {
+            "generationId": generation_id,
+            "images": images,
+            "timestamp": time.time()
+        }
+        json_path = str(sharded_path(self.storage_dir, f"{generation_id}.json"))
+        await run_io(os.makedirs, os.path.dirname(json_path), exist_ok=True)
+
+        def write():
+            with self._records_lock:
+                # Saved again by later polls, keep the first timestamp so the gallery order is stable
+                try:
+                    result_data["timestamp"] = read_json_file(json_path).get("timestamp", result_data["timestamp"])
+                except (FileNotFoundError, ValueError):
+                    pass
+                write_json_file(json_path, result_data, indent=2)
+                self._index_record(result_data, generation_id)
+
         try:
-            with open(filepath, 'w') as f:
-                json.dump(data, f, indent=2)
+            await run_io(write)
         except Exception as e:
-            logger.error(f"Error saving JSON file {filepath}: {e}")
-    
-    def _load_json_file(self, filepath: str) -> Optional[Dict[str, Any]]:
-        """Load data from a JSON file
+            logger.error(f"Error saving JSON file {json_path}: {e}")
+        logger.info(f"Saved results to {json_path}")
+
+        # Every poll of a finished generation saves it again, reuse the running job
+        if missing and json_path not in self._thumbnail_tasks:
+            task = asyncio.create_task(self._add_thumbnails(json_path, missing))
+            self._thumbnail_tasks[json_path] = task
+            task.add_done_callback(lambda _: self._thumbnail_tasks.pop(json_path, None))
+
+    async def _add_thumbnails(self, json_path: str, urls: List[str]) -> None:
+        """Render thumbnails for generated images and back-fill them into the saved result
         
         Args:
-            filepath: Path to the JSON file
-            
-        Returns:
-            Loaded data or None if the file doesn't exist or can't be loaded
+            json_path: Path of the saved generation result
+            urls: URLs of the images without thumbnails
         """
+        manifests = await asyncio.gather(*[derivatives.generate_for_url(url) for url in urls])
+        by_url = {url: manifest for url, manifest in zip(urls, manifests) if manifest}
+        if not by_url:
+            return
+
+        def merge():
+            # Re-read under the lock so a concurrent save of the record is not overwritten
+            with self._records_lock:
+                data = read_json_file(json_path)
+                for image in data.get("images") or []:
+                    manifest = by_url.get(image.get("url"))
+                    if manifest:
+                        image["thumbnails"] = manifest["thumbnails"]
+                        image["placeholder"] = manifest["placeholder"]
+                write_json_file(json_path, data, indent=2)
+                self._index_record(data, os.path.basename(json_path)[:-len('.json')])
+
         try:
-            if os.path.exists(filepath):
-                with open(filepath, 'r') as f:
-                    return json.load(f)
+            await run_io(merge)
         except Exception as e:
-            logger.error(f"Error loading JSON file {filepath}: {e}")
-        return None
+            logger.error(f"Error adding thumbnails to {json_path}: {e}")
     
     def _file_exists(self, filepath: str) -> bool:
         """Check if a file exists
@@ -295,14 +358,19 @@ class ModelGenerationService:
         for attempt in range(self.max_retries):
             try:
                 async with httpx.AsyncClient(timeout=self.request_timeout) as client:
-                    if method == "GET":
-                        logger.info(f"Making GET request to {endpoint}")
-                        response = await client.get(url, headers=headers)
-                    elif method == "POST":
-                        logger.info(f"Making POST request to {endpoint}")
-                        response = await client.post(url, headers=headers, json=data)
-                    else:
-                        raise ValueError(f"Unsupported HTTP method: {method}")
+                    async with rate_limiters.get('leonardo').limit():
+                        if method == "GET":
+                            logger.info(f"Making GET request to {endpoint}")
+                            response = await client.get(url, headers=headers)
+                        elif method == "POST":
+                            logger.info(f"Making POST request to {endpoint}")
+                            response = await client.post(url, headers=headers, json=data)
+                        else:
+                            raise ValueError(f"Unsupported HTTP method: {method}")
+
+                    if response.status_code == 429:
+                        # Hold back every Leonardo call, not just this one
+                        rate_limiters.get('leonardo').pause(2 ** attempt)
                     
                     # Log response status code
                     logger.info(f"API response status code: {response.status_code}")
@@ -872,6 +940,12 @@ class ModelGenerationService:
                     }
             
             logger.info(f"Generation submitted successfully with ID: {generation_id}")
+
+            # Record the paid generation so its images are still collected if this worker restarts
+            try:
+                await run_io(job_registry.record, "generation", "leonardo", generation_id, request_data)
+            except Exception as e:
+                logger.error(f"Error recording generation job {generation_id}: {e}")
             
             return {
                 "success": True,
@@ -889,7 +963,69 @@ class ModelGenerationService:
             }
     
     async def check_generation_status(self, generation_id: str) -> Dict[str, Any]:
-        """Check the status of a generation
+        """Check the status of a generation and record it in the job registry
+        
+        Args:
+            generation_id: ID of the generation to check
+            
+        Returns:
+            Status response with images if available
+        """
+        response = await self._fetch_generation_status(generation_id)
+        await self._record_status(generation_id, response)
+        return response
+
+    async def _record_status(self, generation_id: str, response: Dict[str, Any]) -> str:
+        """Record the outcome of a status check in the job registry and return the job state
+        
+        Errors reaching the API are not recorded, the job is polled again later.
+        """
+        status = response.get("status")
+        if status == "finished":
+            state, result, error = COMPLETED, response.get("images"), None
+        elif status == "failed":
+            state, result, error = FAILED, None, response.get("error") or "Generation failed"
+        elif status == "error":
+            return PROCESSING
+        else:
+            state, result, error = PROCESSING, None, None
+
+        try:
+            await run_io(job_registry.transition, job_id("generation", "leonardo", generation_id),
+                         state, result, error)
+        except Exception as e:
+            logger.error(f"Error recording generation job status for {generation_id}: {e}")
+        return state
+
+    async def _poll_job(self, job: Job) -> str:
+        """Poll a registered generation, finished images are saved by the status check"""
+        response = await self._fetch_generation_status(job.task_id)
+        return await self._record_status(job.task_id, response)
+
+    async def _follow_job(self, generation_id: str) -> None:
+        """Keep polling a generation in the background after its caller stopped waiting"""
+        try:
+            job = await run_io(job_registry.get, job_id("generation", "leonardo", generation_id))
+            if job:
+                job_registry.follow(job, self._poll_job)
+        except Exception as e:
+            logger.error(f"Error following generation job {generation_id}: {e}")
+
+    async def resume_jobs(self) -> int:
+        """Resume polling for generations left unfinished by a previous run
+        
+        Returns:
+            Number of resumed generations
+        """
+        jobs = await run_io(job_registry.unfinished, "generation")
+        for job in jobs:
+            job_registry.follow(job, self._poll_job)
+        if jobs:
+            logger.info(f"Resumed polling for {len(jobs)} unfinished generations")
+        return len(jobs)
+
+    async def _fetch_generation_status(self, generation_id: str) -> Dict[str, Any]:
+        """Query the Leonardo.ai API for the status of a generation, saving finished images
         
         Args:
             generation_id: ID of the generation to check
@@ -965,14 +1101,7 @@ class ModelGenerationService:
                 
                 # Save results if finished
                 if status == "finished" and images:
-                    result_data = {
-                        "generationId": generation_id,
-                        "images": images,
-                        "timestamp": time.time()
-                    }
-                    json_path = os.path.join(self.storage_dir, f"{generation_id}.json")
-                    self._save_json_file(json_path, result_data)
-                    logger.info(f"Saved results to {json_path}")
+                    await self._save_generation_result(generation_id, images)
                     
                 logger.info(f"Returning status response with {len(images)} images")
                 logger.info(f"Current status: {status}")
@@ -1061,14 +1190,7 @@ class ModelGenerationService:
                 
                 # Save results if finished
                 if status == "finished" and images:
-                    result_data = {
-                        "generationId": generation_id,
-                        "images": images,
-                        "timestamp": time.time()
-                    }
-                    json_path = os.path.join(self.storage_dir, f"{generation_id}.json")
-                    self._save_json_file(json_path, result_data)
-                    logger.info(f"Saved results to {json_path}")
+                    await self._save_generation_result(generation_id, images)
                     
                 logger.info(f"Returning status response with {len(images)} images")
                 logger.info(f"Current status: {status}")
@@ -1128,14 +1250,7 @@ class ModelGenerationService:
                 
                 # Save results if finished
                 if status == "finished" and images:
-                    result_data = {
-                        "generationId": generation_id,
-                        "images": images,
-                        "timestamp": time.time()
-                    }
-                    json_path = os.path.join(self.storage_dir, f"{generation_id}.json")
-                    self._save_json_file(json_path, result_data)
-                    logger.info(f"Saved results to {json_path}")
+                    await self._save_generation_result(generation_id, images)
                     
                 logger.info(f"Returning status response with {len(images)} images")
                 logger.info(f"Current status: {status}")
@@ -1200,14 +1315,7 @@ class ModelGenerationService:
                 
                 # Save results if finished
                 if status == "finished" and images:
-                    result_data = {
-                        "generationId": generation_id,
-                        "images": images,
-                        "timestamp": time.time()
-                    }
-                    json_path = os.path.join(self.storage_dir, f"{generation_id}.json")
-                    self._save_json_file(json_path, result_data)
-                    logger.info(f"Saved results to {json_path}")
+                    await self._save_generation_result(generation_id, images)
                     
                 logger.info(f"Returning status response with {len(images)} images")
                 logger.info(f"Current status: {status}")
@@ -1263,14 +1371,7 @@ class ModelGenerationService:
                 
                 # Save results if finished
                 if status == "finished" and images:
-                    result_data = {
-                        "generationId": generation_id,
-                        "images": images,
-                        "timestamp": time.time()
-                    }
-                    json_path = os.path.join(self.storage_dir, f"{generation_id}.json")
-                    self._save_json_file(json_path, result_data)
-                    logger.info(f"Saved results to {json_path}")
+                    await self._save_generation_result(generation_id, images)
                     
                 logger.info(f"Returning status response with {len(images)} images")
                 logger.info(f"Current status: {status}")
@@ -1327,6 +1428,8 @@ class ModelGenerationService:
             # If we reach here, we've exceeded the maximum number of attempts
             # Return a timeout response instead of an error
             logger.warning(f"Generation timed out after {max_attempts} attempts")
+            # Leonardo is still working on it, collect the images in the background
+            await self._follow_job(generation_id)
             return {
                 "success": True,
                 "status": "processing",
@@ -1344,47 +1447,76 @@ class ModelGenerationService:
                 "error": f"Error executing generation: {str(e)}"
             }
     
-    async def get_gallery_results(self, limit: int = 50) -> List[Dict[str, Any]]:
-        """Get all saved model generation results for the gallery
+    async def get_gallery_results(self, limit: int = GALLERY_DEFAULT_LIMIT, cursor: Optional[str] = None,
+                                  filters: Optional[GalleryFilters] = None) -> Dict[str, Any]:
+        """Get one page of saved model generation results for the gallery, newest first
         
         Args:
             limit: Maximum number of results to return
+            cursor: Cursor returned with the previous page
+            filters: Filters on provider, clothing type, gender and date range
             
         Returns:
-            List of generation results
+            Dictionary with the generation results and the cursor of the next page
+
+        Raises:
+            ValueError: If the cursor is malformed
         """
-        results = []
+        return await run_io(
+            self._query_gallery, filters or GalleryFilters(), cursor, clamp_limit(limit))
+
+    @staticmethod
+    def _gallery_record(data: Dict[str, Any], generation_id: str) -> Optional[GalleryRecord]:
+        """Gallery record of a generation, None if it has no images"""
+        # Older records store "results", newer ones store "images"
+        images = (data.get("results") or data.get("images")) if data else None
+        if not images:
+            return None
+
+        request_data = data.get("requestData") or {}
+        attributes = request_data.get("attributes") or {}
+        generation_id = data.get("generationId", generation_id)
+        return GalleryRecord(
+            id=generation_id,
+            timestamp=to_timestamp(data.get("timestamp")),
+            provider="leonardo",
+            clothing_type=request_data.get("wearType"),
+            gender=attributes.get("gender") or request_data.get("gender"),
+            data={
+                "generationId": generation_id,
+                "prompt": data.get("prompt", ""),
+                "timestamp": data.get("timestamp", 0),
+                "completedTimestamp": data.get("completedTimestamp", 0),
+                "results": images
+            }
+        )
+
+    def _index_record(self, data: Dict[str, Any], generation_id: str) -> None:
+        """Add or refresh a saved generation in the gallery, blocking"""
+        record = self._gallery_record(data, generation_id)
+        if record:
+            self._gallery.put(record)
+
+    def _legacy_gallery(self):
+        """Generation files saved before the gallery database existed"""
+        for entry in iter_files(self.storage_dir):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                record = self._gallery_record(read_json_file(entry.path), entry.name[:-len('.json')])
+            except Exception as e:
+                logger.error(f"Error loading record {entry.path}: {e}")
+                continue
+            if record:
+                yield record
+
+    def _query_gallery(self, filters: GalleryFilters, cursor: Optional[str], limit: int) -> Dict[str, Any]:
+        """Page through the generation records newest first by their own timestamp
         
-        try:
-            # Get all JSON files in the storage directory
-            json_files = self._list_json_files(self.storage_dir)
-            
-            # Sort by creation time, newest first
-            json_files.sort(key=lambda x: os.path.getctime(x), reverse=True)
-            
-            # Limit the number of files
-            json_files = json_files[:limit]
-            
-            # Load each file and add to results if it has completed results
-            for file_path in json_files:
-                try:
-                    data = self._load_json_file(file_path)
-                    if data and data.get("completed", False) and data.get("results"):
-                        results.append({
-                            "generationId": data.get("generationId", ""),
-                            "prompt": data.get("prompt", ""),
-                            "timestamp": data.get("timestamp", 0),
-                            "completedTimestamp": data.get("completedTimestamp", 0),
-                            "results": data.get("results", [])
-                        })
-                except Exception as e:
-                    logger.error(f"Error loading file {file_path}: {str(e)}")
-                    continue
-            
-            return results
-        except Exception as e:
-            logger.error(f"Error getting gallery results: {str(e)}")
-            return []
+        Blocking, runs on the storage thread pool.
+        """
+        results, next_cursor = self._gallery.page(filters, cursor, limit)
+        return {"results": results, "nextCursor": next_cursor}
     
     def _get_clothing_description(self, wear_type: str, gender: str) -> str:
         """Get a clothing description based on wear type and gender
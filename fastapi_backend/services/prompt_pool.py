@@ -0,0 +1,324 @@
+"""
+Cache and precomputed pool for fashion background prompts
+
+Product attributes repeat heavily across a catalog, so prompts are cached per
+normalized attribute set and served in rotation. A background worker keeps the
+pools of frequently requested and seeded attribute sets topped up. The number of
+attribute sets is capped, the least recently used ones are evicted first, and
+changes are written to disk in batches.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+
+from fastapi_backend.services.utils.file_lock import file_lock, read_json_map, update_json_map
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Attributes that influence the generated prompts
+PROMPT_ATTRIBUTE_KEYS = ('productType', 'colors', 'patterns', 'materials', 'style', 'ageGroup', 'occasion')
+
+# Prompts kept per attribute set
+PROMPT_POOL_SIZE = int(os.getenv('PROMPT_POOL_SIZE', '16'))
+
+# Prompts requested from OpenAI per generation call
+PROMPT_POOL_BATCH = int(os.getenv('PROMPT_POOL_BATCH', '8'))
+
+# Age after which a pool is refreshed in the background (seconds)
+PROMPT_POOL_TTL = int(os.getenv('PROMPT_POOL_TTL', str(7 * 24 * 3600)))
+
+# Interval between background refill passes (seconds)
+PROMPT_POOL_REFILL_INTERVAL = int(os.getenv('PROMPT_POOL_REFILL_INTERVAL', '300'))
+
+# Number of most requested attribute sets kept topped up by the refill worker
+PROMPT_POOL_TOP_KEYS = int(os.getenv('PROMPT_POOL_TOP_KEYS', '50'))
+
+# Attribute sets kept in the pool, least recently used ones are evicted beyond this
+PROMPT_POOL_MAX_ENTRIES = int(os.getenv('PROMPT_POOL_MAX_ENTRIES', '1000'))
+
+# Delay after a change before the pool is written, changes in between share one write (seconds)
+PROMPT_POOL_SAVE_DELAY = float(os.getenv('PROMPT_POOL_SAVE_DELAY', '5'))
+
+# Optional JSON file with a list of attribute sets to pre-generate
+PROMPT_POOL_SEED_FILE = os.getenv('PROMPT_POOL_SEED_FILE')
+
+PromptGenerator = Callable[[Dict[str, Any], int], Awaitable[List[str]]]
+
+
+def normalize_attributes(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Normalize prompt attributes so equivalent requests share a cache entry
+
+    Strings are trimmed and lowercased, lists are deduplicated and sorted, and
+    attributes that do not affect the prompt are dropped.
+    """
+    normalized = {}
+    for key in PROMPT_ATTRIBUTE_KEYS:
+        value = attributes.get(key)
+        if isinstance(value, (list, tuple)):
+            items = sorted({str(item).strip().lower() for item in value if str(item).strip()})
+            if items:
+                normalized[key] = items
+        elif value is not None and str(value).strip() and str(value).strip().upper() != 'N/A':
+            normalized[key] = str(value).strip().lower()
+    return normalized
+
+
+def _last_used(entry: Dict[str, Any]) -> float:
+    return entry.get('used', entry.get('updated', 0))
+
+
+def attributes_key(attributes: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """Return the cache key and normalized attributes for an attribute set"""
+    normalized = normalize_attributes(attributes)
+    key = hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+    return key, normalized
+
+
+class PromptPool:
+    """Serves background prompts from per-attribute pools with rotation"""
+
+    def __init__(self, generator: PromptGenerator, pool_file: Optional[Path] = None,
+                 pool_size: int = PROMPT_POOL_SIZE, batch_size: int = PROMPT_POOL_BATCH,
+                 ttl: int = PROMPT_POOL_TTL, max_entries: int = PROMPT_POOL_MAX_ENTRIES,
+                 save_delay: float = PROMPT_POOL_SAVE_DELAY):
+        self.generator = generator
+        self.pool_file = Path(pool_file) if pool_file else None
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.save_delay = save_delay
+        # Least recently used first
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._refill_task: Optional[asyncio.Task] = None
+        # Keys changed or evicted since the last write
+        self._dirty: Set[str] = set()
+        self._removed: Set[str] = set()
+        self._save_task: Optional[asyncio.Task] = None
+        self._load()
+
+    def _load(self) -> None:
+        """Load persisted pools"""
+        if not self.pool_file or not self.pool_file.exists():
+            return
+        self._merge(read_json_map(self.pool_file))
+
+    def _merge(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        """Add entries saved by other workers, keeping the order by last use"""
+        added = {key: entry for key, entry in entries.items() if key not in self._entries}
+        if not added:
+            return
+        self._entries = OrderedDict(sorted({**self._entries, **added}.items(), key=lambda item: _last_used(item[1])))
+        self._evict()
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_entries:
+            key, _ = self._entries.popitem(last=False)
+            self._dirty.discard(key)
+            self._removed.add(key)
+
+    def _touch(self, key: str, entry: Dict[str, Any]) -> None:
+        """Mark an entry as used and changed, and schedule a write"""
+        entry['used'] = time.time()
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._dirty.add(key)
+        self._removed.discard(key)
+        self._evict()
+        self._schedule_save()
+
+    def _schedule_save(self) -> None:
+        if not self.pool_file or (self._save_task and not self._save_task.done()):
+            return
+        try:
+            self._save_task = asyncio.get_running_loop().create_task(self._save_later())
+        except RuntimeError:
+            # No event loop, written with the next change made on one
+            pass
+
+    async def _save_later(self) -> None:
+        await asyncio.sleep(self.save_delay)
+        await self.flush()
+
+    def _write(self, updates: Dict[str, Any], removed: Iterable[str]) -> Dict[str, Any]:
+        """Merge the changes into the pool file and trim it to the entry limit, blocking"""
+        with file_lock(f"{self.pool_file}.lock"):
+            merged = update_json_map(self.pool_file, updates, removed)
+            excess = len(merged) - self.max_entries
+            if excess > 0:
+                # The other workers' entries count against the limit too
+                oldest = sorted(merged, key=lambda key: _last_used(merged[key]))[:excess]
+                merged = update_json_map(self.pool_file, {}, oldest)
+            return merged
+
+    async def flush(self) -> None:
+        """Write the pending changes now, without blocking the event loop"""
+        if not self.pool_file or not (self._dirty or self._removed):
+            return
+        # Copied on the loop so later changes to the pools cannot race the write
+        updates = json.loads(json.dumps({key: self._entries[key] for key in self._dirty if key in self._entries}))
+        removed = set(self._removed)
+        self._dirty.clear()
+        self._removed.clear()
+
+        try:
+            merged = await asyncio.to_thread(self._write, updates, removed)
+        except Exception as e:
+            logger.error(f"Error saving prompt pool: {e}")
+            # Kept for the next write unless changed again since
+            self._dirty.update(key for key in updates if key in self._entries)
+            self._removed.update(removed)
+            return
+        self._merge(merged)
+
+    def _rotate(self, entry: Dict[str, Any], count: int) -> List[str]:
+        """Take count prompts from the pool, continuing where the last request stopped"""
+        prompts = entry['prompts']
+        cursor = entry.get('cursor', 0) % len(prompts)
+        selected = [prompts[(cursor + i) % len(prompts)] for i in range(min(count, len(prompts)))]
+        entry['cursor'] = (cursor + len(selected)) % len(prompts)
+        return selected
+
+    def _is_stale(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry.get('updated', 0) > self.ttl
+
+    async def _fill(self, key: str, attributes: Dict[str, Any], count: int) -> Dict[str, Any]:
+        """
+        Generate prompts for an attribute set and add them to its pool
+
+        Concurrent fills for the same key share one generator call.
+        """
+        if key in self._in_flight:
+            return await asyncio.shield(self._in_flight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            prompts = await self.generator(attributes, max(count, self.batch_size))
+            entry = self._entries.get(key) or {'attributes': attributes, 'prompts': [], 'cursor': 0, 'hits': 0}
+
+            # Newest prompts replace the oldest once the pool is full
+            merged = [p for p in entry['prompts'] if p not in prompts] + list(prompts)
+            entry['prompts'] = merged[-self.pool_size:]
+            entry['cursor'] = entry.get('cursor', 0) % max(1, len(entry['prompts']))
+            entry['updated'] = time.time()
+            self._touch(key, entry)
+            future.set_result(entry)
+            return entry
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else is waiting
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    def take(self, attributes: Dict[str, Any], count: int) -> Optional[List[str]]:
+        """
+        Return pooled prompts without generating any
+
+        Returns None if the pool for these attributes cannot serve count prompts.
+        """
+        key, _ = attributes_key(attributes)
+        entry = self._entries.get(key)
+        if not entry or len(entry['prompts']) < count:
+            return None
+        entry['hits'] = entry.get('hits', 0) + 1
+        self._touch(key, entry)
+        return self._rotate(entry, count)
+
+    async def add(self, attributes: Dict[str, Any], prompts: List[str]) -> None:
+        """Add prompts that were generated elsewhere to the pool"""
+        if not prompts:
+            return
+        key, normalized = attributes_key(attributes)
+        entry = self._entries.get(key) or {
+            'attributes': normalized, 'prompts': [], 'cursor': 0, 'hits': 0, 'updated': time.time()}
+        merged = [p for p in entry['prompts'] if p not in prompts] + list(prompts)
+        entry['prompts'] = merged[-self.pool_size:]
+        entry['hits'] = entry.get('hits', 0) + 1
+        self._touch(key, entry)
+
+    async def get_prompts(self, attributes: Dict[str, Any], count: int = 4) -> List[str]:
+        """
+        Get count prompts for an attribute set, generating them only on a miss
+
+        Args:
+            attributes: Product attributes (productType, colors, style, ...)
+            count: Number of prompts to return
+
+        Returns:
+            List of prompts
+        """
+        key, normalized = attributes_key(attributes)
+        entry = self._entries.get(key)
+
+        if entry is None or len(entry['prompts']) < count:
+            entry = await self._fill(key, normalized, count)
+
+        entry['hits'] = entry.get('hits', 0) + 1
+        self._touch(key, entry)
+        return self._rotate(entry, count)
+
+    def _load_seed_attributes(self) -> List[Dict[str, Any]]:
+        """Load the attribute sets listed in PROMPT_POOL_SEED_FILE"""
+        if not PROMPT_POOL_SEED_FILE or not os.path.exists(PROMPT_POOL_SEED_FILE):
+            return []
+        try:
+            with open(PROMPT_POOL_SEED_FILE) as f:
+                return [item for item in json.load(f) if isinstance(item, dict)]
+        except Exception as e:
+            logger.error(f"Error loading prompt pool seed file: {e}")
+            return []
+
+    async def refill(self) -> int:
+        """
+        Top up the pools of seeded and frequently requested attribute sets
+
+        Returns:
+            Number of pools that were generated or refreshed
+        """
+        candidates = {}
+        for attributes in self._load_seed_attributes():
+            key, normalized = attributes_key(attributes)
+            candidates[key] = normalized
+
+        popular = sorted(self._entries.items(), key=lambda item: item[1].get('hits', 0), reverse=True)
+        for key, entry in popular[:PROMPT_POOL_TOP_KEYS]:
+            candidates.setdefault(key, entry.get('attributes', {}))
+
+        refilled = 0
+        for key, attributes in candidates.items():
+            entry = self._entries.get(key)
+            if entry and len(entry['prompts']) >= self.pool_size and not self._is_stale(entry):
+                continue
+            try:
+                await self._fill(key, attributes, self.batch_size)
+                refilled += 1
+            except Exception as e:
+                logger.error(f"Error refilling prompt pool: {e}")
+        return refilled
+
+    async def _refill_loop(self, interval: int) -> None:
+        while True:
+            refilled = await self.refill()
+            if refilled:
+                logger.info(f"Refilled {refilled} prompt pools")
+            await asyncio.sleep(interval)
+
+    def start_refill_worker(self, interval: int = PROMPT_POOL_REFILL_INTERVAL) -> None:
+        """Start the background task that keeps the pools topped up"""
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill_loop(interval))
@@ -4,11 +4,13 @@ Service for analyzing reference images to extract detailed descriptions for mode
 import os
 import base64
 import io
+import asyncio
 import logging
 from typing import Dict, Any, Optional
 from openai import OpenAI
 from dotenv import load_dotenv
 from PIL import Image
+from fastapi_backend.services.utils.rate_limiter import rate_limiters
 
 # Load environment variables
 load_dotenv()
@@ -101,18 +103,21 @@ class ReferenceImageAnalyzer:
             
             # Call the GPT-4o API
             logger.info("Calling OpenAI API to analyze reference image")
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": [
-                        {"type": "image_url", 
-                         "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                    ]}
-                ],
-                max_tokens=1500,
-                response_format={"type": "json_object"}
-            )
+            # The OpenAI client is blocking, keep it off the event loop
+            async with rate_limiters.get('openai').limit():
+                response = await asyncio.to_thread(
+                    self.client.chat.completions.create,
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": [
+                            {"type": "image_url", 
+                             "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+                        ]}
+                    ],
+                    max_tokens=1500,
+                    response_format={"type": "json_object"}
+                )
             
             # Extract and parse the response
             if not response.choices:
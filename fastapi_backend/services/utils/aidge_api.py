@@ -6,12 +6,29 @@ import time
 import hmac
 import hashlib
 import json
+import logging
+from typing import Any, Dict, Optional
+
+import httpx
 import requests
 from dotenv import load_dotenv
 
+from fastapi_backend.services.utils.rate_limiter import rate_limiters
+
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Timeouts for Aidge requests (seconds)
+AIDGE_CONNECT_TIMEOUT = float(os.getenv('AIDGE_CONNECT_TIMEOUT', '5'))
+AIDGE_READ_TIMEOUT = float(os.getenv('AIDGE_READ_TIMEOUT', '30'))
+AIDGE_POOL_TIMEOUT = float(os.getenv('AIDGE_POOL_TIMEOUT', '10'))
+
+# Maximum number of open connections to the Aidge API
+AIDGE_MAX_CONNECTIONS = int(os.getenv('AIDGE_MAX_CONNECTIONS', '20'))
+
+
 class AidgeApiClient:
     def __init__(self):
         # Load API credentials from environment variables
@@ -20,49 +37,121 @@ class AidgeApiClient:
         self.api_domain = os.getenv('AIDGE_API_DOMAIN', 'api.aidge.ai')
         self.use_trial_resource = os.getenv('AIDGE_USE_TRIAL_RESOURCE', 'false').lower() == 'true'
 
+        self.timeout = httpx.Timeout(
+            AIDGE_READ_TIMEOUT,
+            connect=AIDGE_CONNECT_TIMEOUT,
+            pool=AIDGE_POOL_TIMEOUT
+        )
+        self.headers = {
+            'Content-Type': 'application/json',
+            'x-iop-trial': str(self.use_trial_resource).lower()
+        }
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _signed_url(self, api_name: str) -> str:
+        """Build the signed request URL for an API endpoint"""
+        timestamp = str(int(time.time() * 1000))
+
+        # Calculate sha256 sign
+        sign_string = self.access_key_secret + timestamp
+        sign = hmac.new(
+            self.access_key_secret.encode('utf-8'),
+            sign_string.encode('utf-8'),
+            hashlib.sha256
+        ).hexdigest().upper()
+
+        return f"https://{self.api_domain}/rest{api_name}?partner_id=aidge&sign_method=sha256&sign_ver=v2&app_key={self.access_key_name}&timestamp={timestamp}&sign={sign}"
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the shared async client, creating it on first use"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                headers=self.headers,
+                limits=httpx.Limits(
+                    max_connections=AIDGE_MAX_CONNECTIONS,
+                    max_keepalive_connections=AIDGE_MAX_CONNECTIONS
+                )
+            )
+        return self._client
+
+    def _log_request(self, api_name: str, data: str) -> None:
+        logger.info("Aidge API request to %s (%d bytes)", api_name, len(data))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Aidge API request body for %s: %s", api_name, data)
+
+    def _log_response(self, api_name: str, elapsed: float, response_data: Dict[str, Any]) -> None:
+        logger.info("Aidge API response from %s in %.2fs, success=%s",
+                    api_name, elapsed, response_data.get('success'))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Aidge API response body from %s: %s", api_name, json.dumps(response_data))
+
+    async def invoke_aidge_api_async(self, api_name: str, data: str) -> Dict[str, Any]:
+        """
+        Call the Aidge AI API without blocking the event loop
+
+        Requests share one pooled connection and are bounded by the connect,
+        read and pool timeouts, so a slow response fails instead of hanging.
+
+        Args:
+            api_name: The API endpoint to call
+            data: The JSON encoded data to send to the API
+
+        Returns:
+            The API response
+        """
+        self._log_request(api_name, data)
+        start_time = time.time()
+
+        try:
+            async with rate_limiters.get('aidge').limit():
+                response = await self._get_client().post(self._signed_url(api_name), content=data)
+            response_data = response.json()
+        except httpx.TimeoutException as error:
+            logger.error("Aidge API timeout on %s after %.2fs", api_name, time.time() - start_time)
+            raise TimeoutError(f"Aidge API request to {api_name} timed out") from error
+        except Exception as error:
+            logger.error("Aidge API error on %s: %s", api_name, error)
+            raise error
+
+        self._log_response(api_name, time.time() - start_time, response_data)
+        return response_data
+
     def invoke_aidge_api(self, api_name, data):
         """
         Utility function to call the Aidge AI API
-        
+
+        Blocking variant for scripts, async code should use invoke_aidge_api_async.
+
         Args:
             api_name: The API endpoint to call
             data: The data to send to the API
-            
+
         Returns:
             The API response
         """
-        timestamp = str(int(time.time() * 1000))
-        
-        # Calculate sha256 sign
-        sign_string = self.access_key_secret + timestamp
-        sign = hmac.new(
-            self.access_key_secret.encode('utf-8'), 
-            sign_string.encode('utf-8'),
-            hashlib.sha256
-        ).hexdigest().upper()
-        
-        # Construct the URL
-        url = f"https://{self.api_domain}/rest{api_name}?partner_id=aidge&sign_method=sha256&sign_ver=v2&app_key={self.access_key_name}&timestamp={timestamp}&sign={sign}"
-        
-        # Set headers
-        headers = {
-            'Content-Type': 'application/json',
-            'x-iop-trial': str(self.use_trial_resource).lower()
-        }
-        
+        self._log_request(api_name, data)
+        start_time = time.time()
+
         try:
-            print(f"Aidge API Request to {api_name}:", json.loads(data))
-            
             # Make the API request
-            response = requests.post(url, data=data, headers=headers)
+            rate_limiters.get('aidge').throttle()
+            response = requests.post(
+                self._signed_url(api_name),
+                data=data,
+                headers=self.headers,
+                timeout=(AIDGE_CONNECT_TIMEOUT, AIDGE_READ_TIMEOUT)
+            )
             response_data = response.json()
-            print(f"Aidge API Response from {api_name}:", json.dumps(response_data, indent=2))
-            return response_data
         except Exception as error:
-            print(f"Aidge API Error: {str(error)}")
-            print("Aidge API Request details:", {
-                "url": url,
-                "headers": headers,
-                "data": json.loads(data)
-            })
+            logger.error("Aidge API error on %s: %s", api_name, error)
             raise error
+
+        self._log_response(api_name, time.time() - start_time, response_data)
+        return response_data
+
+    async def aclose(self) -> None:
+        """Close the pooled connection"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,154 @@
+"""
+Batching of Aidge try-on submissions
+
+The Aidge /ai/virtual/tryon API accepts an array of parameter sets. Submissions
+arriving within a short window are coalesced into one signed request, and the
+returned task IDs are handed back to each caller. Batching needs one task ID
+per parameter set in the response; if Aidge answers a batch with a single task,
+the submissions are sent again one request each and batching is turned off.
+"""
+import os
+import json
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Time to wait for more submissions before sending a batch (seconds, 0 disables batching)
+AIDGE_BATCH_WINDOW = float(os.getenv('AIDGE_BATCH_WINDOW', '0.05'))
+
+# Maximum number of parameter sets per Aidge request
+AIDGE_BATCH_MAX_SIZE = int(os.getenv('AIDGE_BATCH_MAX_SIZE', '10'))
+
+
+
+class SharedTaskError(Exception):
+    """Raised when Aidge returns one task for a batch of parameter sets"""
+
+
+class AidgeTryOnBatcher:
+    """Coalesces concurrent try-on submissions into batched Aidge requests"""
+
+    def __init__(self, client, window: float = AIDGE_BATCH_WINDOW, max_size: int = AIDGE_BATCH_MAX_SIZE):
+        self.client = client
+        self.window = window
+        self.max_size = max(1, max_size)
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # References to running flushes so they are not garbage collected
+        self._flush_tasks: Set[asyncio.Task] = set()
+        # Cleared once Aidge answers a batch with a single task
+        self.batching = True
+
+    async def submit(self, request_params: Dict[str, Any]) -> str:
+        """
+        Submit one try-on parameter set
+
+        Args:
+            request_params: Aidge parameter set (clothesList, model, modelImage, ...)
+
+        Returns:
+            Task ID for this parameter set
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((request_params, future))
+
+        if len(self._pending) >= self.max_size or self.window <= 0 or not self.batching:
+            self._schedule_flush(0)
+        elif self._flush_handle is None:
+            self._schedule_flush(self.window)
+
+        return await future
+
+    def _schedule_flush(self, delay: float) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._flush_handle = loop.call_later(delay, self._start_flush)
+
+    def _start_flush(self) -> None:
+        task = asyncio.get_running_loop().create_task(self._flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush(self) -> None:
+        """Send the pending parameter sets as one request"""
+        self._flush_handle = None
+        batch, self._pending = self._pending[:self.max_size], self._pending[self.max_size:]
+        if self._pending:
+            self._schedule_flush(0)
+        if not batch:
+            return
+
+        if not self.batching:
+            await asyncio.gather(*[self._send([item]) for item in batch])
+            return
+        try:
+            await self._send(batch)
+        except SharedTaskError as error:
+            # The shared task cannot be split reliably between the callers
+            logger.warning("%s, sending each submission on its own from now on", error)
+            self.batching = False
+            await asyncio.gather(*[self._send([item]) for item in batch])
+
+    async def _send(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        """
+        Submit parameter sets in one request and resolve their futures
+
+        Raises:
+            SharedTaskError: If several parameter sets got a single task, the futures are left pending
+        """
+        params = [request_params for request_params, _ in batch]
+        futures = [future for _, future in batch]
+        if len(params) > 1:
+            logger.info("Submitting %d try-on parameter sets in one Aidge request", len(params))
+
+        try:
+            response = await self.client.invoke_aidge_api_async(
+                '/ai/virtual/tryon',
+                json.dumps({'requestParams': json.dumps(params)})
+            )
+            task_ids = self._split_task_ids(response, params)
+        except SharedTaskError:
+            raise
+        except Exception as error:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for future, task_id in zip(futures, task_ids):
+            if not future.done():
+                future.set_result(task_id)
+
+    def _split_task_ids(self, response: Dict[str, Any], params: List[Dict[str, Any]]) -> List[str]:
+        """
+        Map the Aidge response back to one task ID per parameter set
+
+        Raises:
+            SharedTaskError: If the response has a single task for several parameter sets
+        """
+        if not (response.get('success') and response.get('data') and response['data'].get('result')):
+            logger.error("Aidge batch submission failed: %s", response)
+            raise Exception(response.get('resMessage', 'Failed to submit try-on request'))
+
+        result = response['data']['result']
+        if isinstance(result, list) and len(result) == len(params):
+            return [item.get('taskId') for item in result]
+        if not isinstance(result, dict):
+            raise Exception(f"Unexpected try-on submission result: {result}")
+        if isinstance(result.get('taskIds'), list) and len(result['taskIds']) == len(params):
+            return result['taskIds']
+
+        task_id = result.get('taskId')
+        if not task_id:
+            raise Exception('No task ID returned from try-on submission')
+        if len(params) > 1:
+            raise SharedTaskError(f"Aidge returned task {task_id} for {len(params)} parameter sets")
+        return [task_id]
@@ -0,0 +1,161 @@
+"""
+Publish-once hosting for local upload images
+
+Providers need a public URL or inline base64 data for input images. Local
+/uploads files are published once under a name derived from their SHA-256, and
+the content hash to URL mapping is cached on disk, so repeated try-ons with the
+same model or garment photo send a short URL instead of megabytes of base64.
+"""
+import os
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+from fastapi_backend.services.utils.rate_limiter import rate_limiters
+from fastapi_backend.services.utils.blob_store import hash_file
+from fastapi_backend.services.utils.sharding import locate
+from fastapi_backend.services.utils.file_lock import read_json_map, update_json_map
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Public base URL of this server. When set, /uploads files are already
+# reachable from providers and are published by URL without any upload.
+PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL', '').rstrip('/')
+
+# ImageKit folder for published assets
+PUBLISHED_ASSETS_FOLDER = os.getenv('PUBLISHED_ASSETS_FOLDER', 'virtual-tryon/published')
+
+IMAGEKIT_UPLOAD_URL = "https://upload.imagekit.io/api/v1/files/upload"
+
+
+class AssetPublisher:
+    """Publishes local files once and remembers their public URLs by content hash"""
+
+    def __init__(self, mapping_file: Path, uploads_dir: Path):
+        self.mapping_file = Path(mapping_file)
+        self.uploads_dir = Path(uploads_dir)
+        self._urls: Dict[str, str] = read_json_map(self.mapping_file)
+        # (path, size, mtime) -> content hash, so unchanged files are not re-hashed
+        self._hashes: Dict[Tuple[str, int, float], str] = {}
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def _save(self, content_hash: str, url: str) -> None:
+        """Add a published URL to the mapping shared with the other workers"""
+        self.mapping_file.parent.mkdir(parents=True, exist_ok=True)
+        self._urls.update(update_json_map(self.mapping_file, {content_hash: url}))
+
+    def local_path(self, upload_url: str) -> Path:
+        """Map an /uploads/... URL to the file on disk"""
+        path_parts = upload_url.lstrip('/').split('/')
+        if path_parts and path_parts[0] == 'uploads':
+            path_parts = path_parts[1:]
+        if len(path_parts) == 2:
+            # /uploads/<dir>/<name> is stored in the sharded layout
+            path = locate(self.uploads_dir / path_parts[0], path_parts[1]).resolve()
+        else:
+            path = (self.uploads_dir / os.path.join(*path_parts)).resolve()
+        if self.uploads_dir.resolve() not in path.parents:
+            raise ValueError(f"Path is outside the uploads directory: {upload_url}")
+        return path
+
+    async def _content_hash(self, path: Path) -> str:
+        stat = path.stat()
+        key = (str(path), stat.st_size, stat.st_mtime)
+        if key not in self._hashes:
+            self._hashes[key] = await asyncio.to_thread(hash_file, str(path))
+        return self._hashes[key]
+
+    async def _upload(self, path: Path, content_hash: str) -> str:
+        """Upload a file to ImageKit under its content hash and return the URL"""
+        file_name = f"{content_hash}{path.suffix.lower() or '.jpg'}"
+        file_content = await asyncio.to_thread(path.read_bytes)
+        payload = {
+            "fileName": file_name,
+            "publicKey": "public_gTBjx7RWLu8I8OqyodA+EWeCzVU=",
+            "folder": PUBLISHED_ASSETS_FOLDER,
+            "useUniqueFileName": "false"
+        }
+        headers = {
+            "Accept": "application/json",
+            "Authorization": f"Basic {os.getenv('IMAGEKIT_API_KEY')}"
+        }
+
+        async with httpx.AsyncClient(timeout=60) as client:
+            async with rate_limiters.get('imagekit').limit():
+                response = await client.post(
+                    IMAGEKIT_UPLOAD_URL,
+                    data=payload,
+                    files={"file": (file_name, file_content)},
+                    headers=headers
+                )
+
+        response_data = response.json()
+        if not response.is_success or 'url' not in response_data:
+            raise Exception(f"ImageKit upload failed: {response_data}")
+        return response_data['url']
+
+    async def publish(self, upload_url: str) -> str:
+        """
+        Return a stable public URL for a local /uploads image
+
+        Args:
+            upload_url: Local URL such as /uploads/models/<name>.jpg
+
+        Returns:
+            Public URL of the image
+
+        Raises:
+            FileNotFoundError: If the file does not exist
+            Exception: If the file could not be published
+        """
+        path = self.local_path(upload_url)
+        if not path.exists():
+            raise FileNotFoundError(f"File not found: {path}")
+
+        if PUBLIC_BASE_URL:
+            # Keep the flat public URL, the static mount resolves the shard
+            relative_url = upload_url.lstrip('/')
+            if not relative_url.startswith('uploads/'):
+                relative_url = f"uploads/{relative_url}"
+            return f"{PUBLIC_BASE_URL}/{relative_url}"
+
+        content_hash = await self._content_hash(path)
+        if content_hash not in self._urls:
+            # Another worker may have published it since the mapping was loaded
+            self._urls.update(await asyncio.to_thread(read_json_map, self.mapping_file))
+        if content_hash in self._urls:
+            return self._urls[content_hash]
+
+        # Concurrent publishes of the same content share one upload
+        if content_hash in self._in_flight:
+            return await asyncio.shield(self._in_flight[content_hash])
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[content_hash] = future
+        try:
+            url = await self._upload(path, content_hash)
+            self._urls[content_hash] = url
+            await asyncio.to_thread(self._save, content_hash, url)
+            logger.info(f"Published {upload_url} as {url}")
+            future.set_result(url)
+            return url
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(content_hash, None)
+
+
+# Shared publisher so the hash to URL mapping is reused across requests
+asset_publisher = AssetPublisher(
+    mapping_file=Path(__file__).parent.parent.parent / "storage" / "published_assets.json",
+    uploads_dir=Path(os.getenv('UPLOADS_DIR', str(Path(__file__).parent.parent.parent / "uploads")))
+)
@@ -0,0 +1,90 @@
+"""
+Async file I/O for storage reads and writes
+
+Disk access runs on a dedicated thread pool, so a slow disk (e.g. a network
+mount with a slow fsync) holds up storage work only, not the event loop or
+the default executor used for provider calls. Writes go to a temporary file
+that is flushed, fsynced and renamed into place, so readers never observe a
+partially written file.
+"""
+import os
+import json
+import uuid
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Threads dedicated to storage I/O
+STORAGE_IO_THREADS = int(os.getenv('STORAGE_IO_THREADS', '8'))
+
+# Whether writes are fsynced before being renamed into place
+STORAGE_FSYNC = os.getenv('STORAGE_FSYNC', 'true').lower() == 'true'
+
+T = TypeVar('T')
+
+# Shared storage executor, also usable as aiofiles' executor
+io_executor = ThreadPoolExecutor(max_workers=STORAGE_IO_THREADS, thread_name_prefix='storage-io')
+
+
+async def run_io(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run a blocking storage function on the storage thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, functools.partial(func, *args, **kwargs))
+
+
+def write_atomic(path, data: bytes, fsync: bool = STORAGE_FSYNC) -> None:
+    """Write a file through a temporary file and an atomic rename"""
+    path = os.fspath(path)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def read_json_file(path) -> Any:
+    """Read a JSON file, raising if it is missing or invalid"""
+    with open(path, 'rb') as f:
+        return json.loads(f.read())
+
+
+def write_json_file(path, data: Any, indent: int = None) -> None:
+    """Write a JSON file atomically"""
+    write_atomic(path, json.dumps(data, indent=indent).encode())
+
+
+async def read_json(path) -> Any:
+    """Read a JSON file on the storage pool, raising if it is missing or invalid"""
+    return await run_io(read_json_file, path)
+
+
+async def write_json(path, data: Any, indent: int = None) -> None:
+    """Write a JSON file atomically on the storage pool"""
+    # Serialize on the loop so later mutations of data cannot race the write
+    payload = json.dumps(data, indent=indent).encode()
+    await run_io(write_atomic, path, payload)
+
+
+async def read_bytes(path) -> bytes:
+    """Read a file on the storage pool"""
+    def read():
+        with open(path, 'rb') as f:
+            return f.read()
+    return await run_io(read)
+
+
+async def write_bytes(path, data: bytes) -> None:
+    """Write a file atomically on the storage pool"""
+    await run_io(write_atomic, path, data)
@@ -0,0 +1,239 @@
+"""
+Content-addressed blob store for uploads and downloaded images
+
+Every stored file is kept once under storage/blobs, named by the SHA-256 of its
+content. The places the app serves files from (uploads/models, storage/images,
+...) get hard links named <sha256>.<ext> to the blob, so the existing /uploads
+and /storage URLs keep working while identical bytes take disk space only once.
+Blobs and links use the hash-sharded layout from sharding.py.
+A SQLite index records the links of each blob, keyed by the blob name
+(<sha256>.<ext>, the same name as its links), and a blob is deleted together
+with its last link. Storing or releasing a link touches only its own rows, and
+a file lock shared by the workers keeps blob files and index in step.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import logging
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from dotenv import load_dotenv
+
+from fastapi_backend.services.utils.sharding import locate, sharded_path
+from fastapi_backend.services.utils.file_lock import file_lock
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BLOB_STORE_DIR = Path(os.getenv(
+    'BLOB_STORE_DIR', str(Path(__file__).parent.parent.parent / "storage" / "blobs")))
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at REAL
+);
+CREATE INDEX IF NOT EXISTS refs_name ON refs (name);
+"""
+
+# Columns added after the first release of the table
+_MIGRATIONS = {
+    'created_at': 'ALTER TABLE refs ADD COLUMN created_at REAL',
+}
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the SHA-256 of a file, reading it in chunks"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class BlobStore:
+    """SHA-256 keyed file store with reference-counted hard links"""
+
+    def __init__(self, root: Path = BLOB_STORE_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.root / ".index.sqlite3"
+        # JSON index of earlier versions, imported into the database once
+        self.index_file = self.root / "index.json"
+        # Held around every change of blob files and index, also by the other workers
+        self._lock = file_lock(self.root / ".index.lock")
+        # The database is created on first use, not at import
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Short-lived connection that commits on success"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            if not self._initialized:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript(_SCHEMA)
+                columns = {row[1] for row in conn.execute('PRAGMA table_info(refs)')}
+                for column, statement in _MIGRATIONS.items():
+                    if column not in columns:
+                        conn.execute(statement)
+                with self._lock, conn:
+                    self._import_json_index(conn)
+                self._initialized = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _import_json_index(self, conn: sqlite3.Connection) -> None:
+        """Move the entries of a JSON index left by an earlier version into the database"""
+        if not self.index_file.exists():
+            return
+        try:
+            blobs = json.loads(self.index_file.read_text())
+        except Exception as e:
+            logger.error(f"Error loading blob index: {e}")
+            return
+        for key, entry in blobs.items():
+            # The oldest indexes were keyed by content hash alone
+            name = key if '.' in key else f"{key}.{entry['extension']}"
+            conn.execute('INSERT OR IGNORE INTO blobs (name, size) VALUES (?, ?)', (name, entry['size']))
+            conn.executemany('INSERT OR IGNORE INTO refs (path, name) VALUES (?, ?)',
+                             [(path, name) for path in entry['refs']])
+        os.replace(self.index_file, self.root / ".index.json.imported")
+        logger.info(f"Imported {len(blobs)} blobs from {self.index_file}")
+
+    def blob_path(self, content_hash: str, extension: str) -> Path:
+        return self._blob_path(f"{content_hash}.{extension}")
+
+    def _blob_path(self, name: str) -> Path:
+        return locate(self.root, name)
+
+    def _link(self, blob_path: Path, link_path: str) -> None:
+        """Point link_path at the blob, replacing a different file with the same name"""
+        if os.path.exists(link_path) and os.path.samefile(blob_path, link_path):
+            return
+        temp_link = f"{link_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.link(blob_path, temp_link)
+        except OSError:
+            # Hard links are not available across devices, fall back to a copy
+            shutil.copyfile(blob_path, temp_link)
+        os.replace(temp_link, link_path)
+
+    def store_temp(self, temp_path: str, content_hash: str, extension: str, target_dir: str,
+                   sharded: bool = True) -> str:
+        """
+        Take ownership of a fully written temporary file and link it into a directory
+
+        Args:
+            temp_path: File holding the content, moved or deleted by this call
+            content_hash: SHA-256 of the content
+            extension: File extension without the dot
+            target_dir: Directory the file is served from
+            sharded: Whether target_dir uses the hash-sharded layout
+
+        Returns:
+            Path of the link, named <content_hash>.<extension>
+        """
+        name = f"{content_hash}.{extension}"
+        link_path = os.path.abspath(sharded_path(target_dir, name) if sharded else os.path.join(target_dir, name))
+        os.makedirs(os.path.dirname(link_path), exist_ok=True)
+
+        with self._lock:
+            blob_path = self.blob_path(content_hash, extension)
+            if blob_path.exists():
+                # Same content is stored already, keep the existing blob
+                os.remove(temp_path)
+            else:
+                blob_path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(temp_path, blob_path)
+            self._link(blob_path, link_path)
+
+            with self._connect() as conn:
+                conn.execute('INSERT OR IGNORE INTO blobs (name, size) VALUES (?, ?)',
+                             (name, blob_path.stat().st_size))
+                # Links share the mtime of their blob, so the index keeps when each link was made
+                conn.execute('INSERT OR REPLACE INTO refs (path, name, created_at) VALUES (?, ?, ?)',
+                             (link_path, name, time.time()))
+        return link_path
+
+    def store_bytes(self, data: bytes, extension: str, target_dir: str, sharded: bool = True) -> str:
+        """Store in-memory content and link it into a directory, see store_temp"""
+        temp_path = self.root / f".{uuid.uuid4().hex}.part"
+        temp_path.write_bytes(data)
+        return self.store_temp(str(temp_path), hash_bytes(data), extension, target_dir, sharded)
+
+    def store_file(self, source_path: str, extension: str, target_dir: str, sharded: bool = True) -> str:
+        """Store a copy of an existing file and link it into a directory, see store_temp"""
+        temp_path = self.root / f".{uuid.uuid4().hex}.part"
+        shutil.copyfile(source_path, temp_path)
+        return self.store_temp(str(temp_path), hash_file(str(temp_path)), extension, target_dir, sharded)
+
+    def release(self, link_path: str) -> None:
+        """
+        Drop the reference held by a link that was removed
+
+        The blob is deleted once no links remain. Paths that are not links
+        into the store are ignored.
+        """
+        link_path = os.path.abspath(link_path)
+        # Links carry the name of their blob
+        name = os.path.basename(link_path)
+        with self._lock, self._connect() as conn:
+            if not conn.execute('DELETE FROM refs WHERE path = ? AND name = ?', (link_path, name)).rowcount:
+                return
+            if conn.execute('SELECT 1 FROM refs WHERE name = ? LIMIT 1', (name,)).fetchone():
+                return
+            try:
+                self._blob_path(name).unlink()
+            except FileNotFoundError:
+                pass
+            conn.execute('DELETE FROM blobs WHERE name = ?', (name,))
+
+    def move_ref(self, old_path: str, new_path: str) -> None:
+        """Follow a link that was moved, e.g. by the sharded layout migration"""
+        old_path, new_path = os.path.abspath(old_path), os.path.abspath(new_path)
+        with self._lock, self._connect() as conn:
+            conn.execute('UPDATE OR REPLACE refs SET path = ? WHERE path = ?', (new_path, old_path))
+
+    def link_created_at(self, link_path: str) -> Optional[float]:
+        """When a link was last stored, None for paths that are not links into the store"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT created_at FROM refs WHERE path = ?',
+                               (os.path.abspath(link_path),)).fetchone()
+        return row[0] if row else None
+
+    def ref_count(self, content_hash: str, extension: str) -> int:
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM refs WHERE name = ?',
+                                (f"{content_hash}.{extension}",)).fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        """Number of blobs and their total size"""
+        with self._connect() as conn:
+            blobs, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+            links = conn.execute('SELECT COUNT(*) FROM refs').fetchone()[0]
+        return {'blobs': blobs, 'bytes': size, 'links': links}
+
+
+# Shared store used by the upload endpoints and the storage manager
+blob_store = BlobStore()
@@ -0,0 +1,177 @@
+"""
+Thumbnail and placeholder derivatives for gallery images
+
+Gallery pages only need small previews, so when a result image is stored we
+render WebP thumbnails at a few widths and a tiny blurred placeholder that is
+inlined as a data URI. Thumbnails are written under storage/thumbnails, in the
+hash-sharded layout, and served statically through the /storage mount.
+"""
+import io
+import os
+import json
+import base64
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from PIL import Image, ImageFilter, ImageOps
+from dotenv import load_dotenv
+
+from fastapi_backend.services.utils.fetch_cache import fetch_cache
+from fastapi_backend.services.utils.sharding import shard_prefix, sharded_path
+from fastapi_backend.services.utils.async_io import write_atomic
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Thumbnail widths in pixels
+THUMBNAIL_WIDTHS = [int(width) for width in os.getenv('THUMBNAIL_WIDTHS', '160,320,640').split(',') if width.strip()]
+
+# WebP quality of the thumbnails
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', '75'))
+
+# Width of the inlined placeholder in pixels
+PLACEHOLDER_WIDTH = 16
+
+THUMBNAILS_DIR = Path(__file__).parent.parent.parent / "storage" / "thumbnails"
+
+
+def derivative_key(source: str) -> str:
+    """Stable derivative key for an image URL or path"""
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+class DerivativeGenerator:
+    """Renders and looks up the thumbnails and placeholder of stored images"""
+
+    def __init__(self, output_dir: Path = THUMBNAILS_DIR, public_prefix: str = "/storage/thumbnails",
+                 widths: List[int] = THUMBNAIL_WIDTHS, quality: int = THUMBNAIL_QUALITY):
+        self.output_dir = Path(output_dir)
+        self.public_prefix = public_prefix.rstrip('/')
+        self.widths = sorted(set(widths))
+        self.quality = quality
+        # Derivative key -> future of the run rendering it
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def _key_dir(self, key: str) -> Path:
+        return sharded_path(self.output_dir, key)
+
+    def _manifest_path(self, key: str) -> Path:
+        return self._key_dir(key) / "manifest.json"
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the derivatives of an image if they were already generated"""
+        manifest_path = self._manifest_path(key)
+        if not manifest_path.exists():
+            return None
+        try:
+            return json.loads(manifest_path.read_text())
+        except Exception as e:
+            logger.error(f"Error loading derivative manifest {manifest_path}: {e}")
+            return None
+
+    def generate(self, source_path: str, key: str) -> Dict[str, Any]:
+        """
+        Render the derivatives of a local image, reusing them if they exist
+
+        Args:
+            source_path: Path of the full-size image
+            key: Derivative key, see derivative_key
+
+        Returns:
+            Dictionary with the original size, thumbnail URLs by width and the placeholder data URI
+        """
+        existing = self.lookup(key)
+        if existing:
+            return existing
+
+        target_dir = self._key_dir(key)
+        target_dir.mkdir(parents=True, exist_ok=True)
+
+        with Image.open(source_path) as source:
+            image = ImageOps.exif_transpose(source)
+            image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        width, height = image.size
+
+        thumbnails = {}
+        for thumbnail_width in self.widths:
+            # Never upscale, the original is the largest useful size
+            if thumbnail_width >= width and thumbnails:
+                break
+            scaled = image.copy()
+            scaled.thumbnail((min(thumbnail_width, width), height), Image.LANCZOS)
+            buffer = io.BytesIO()
+            scaled.save(buffer, 'WEBP', quality=self.quality, method=4)
+            # Unique temp names, another worker may render the same image concurrently
+            write_atomic(target_dir / f"{thumbnail_width}.webp", buffer.getvalue(), fsync=False)
+            thumbnails[str(thumbnail_width)] = (
+                f"{self.public_prefix}/{shard_prefix(key)}/{key}/{thumbnail_width}.webp")
+
+        tiny = image.copy()
+        tiny.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH * 4), Image.BILINEAR)
+        tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+        buffer = io.BytesIO()
+        tiny.save(buffer, 'WEBP', quality=30)
+        placeholder = f"data:image/webp;base64,{base64.b64encode(buffer.getvalue()).decode()}"
+
+        manifest = {
+            'width': width,
+            'height': height,
+            'thumbnails': thumbnails,
+            'placeholder': placeholder
+        }
+        # The manifest is written last so a partial run is regenerated next time
+        write_atomic(self._manifest_path(key), json.dumps(manifest).encode())
+        return manifest
+
+    async def _coalesced(self, key: str,
+                         render: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        """Run render once for concurrent requests of the same key, they share its result"""
+        if key in self._in_flight:
+            return await asyncio.shield(self._in_flight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            manifest = await render()
+            future.set_result(manifest)
+            return manifest
+        finally:
+            self._in_flight.pop(key, None)
+            if not future.done():
+                # Cancelled, the waiting callers get None like any other failure
+                future.set_result(None)
+
+    async def _generate_for_path(self, source_path: str, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            return await asyncio.to_thread(self.generate, source_path, key)
+        except Exception as e:
+            logger.error(f"Error generating derivatives for {source_path}: {e}")
+            return None
+
+    async def _generate_for_url(self, url: str, key: str) -> Optional[Dict[str, Any]]:
+        existing = await asyncio.to_thread(self.lookup, key)
+        if existing:
+            return existing
+        try:
+            cached = await fetch_cache.fetch(url)
+        except Exception as e:
+            logger.error(f"Error downloading {url} for derivatives: {e}")
+            return None
+        return await self._generate_for_path(str(cached.path), key)
+
+    async def generate_for_path(self, source_path: str, key: str) -> Optional[Dict[str, Any]]:
+        """Render the derivatives of a local image off the event loop, None on failure"""
+        return await self._coalesced(key, lambda: self._generate_for_path(source_path, key))
+
+    async def generate_for_url(self, url: str) -> Optional[Dict[str, Any]]:
+        """Download a remote image through the fetch cache and render its derivatives, None on failure"""
+        key = derivative_key(url)
+        return await self._coalesced(key, lambda: self._generate_for_url(url, key))
+
+# Shared generator used by every storage path
+derivatives = DerivativeGenerator()
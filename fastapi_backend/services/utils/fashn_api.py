@@ -3,12 +3,14 @@ Utility functions for interacting with the Fashn.ai API
 """
 import os
 import json
-import requests
 import time
 import math
+import httpx
 import dateutil.parser
 from typing import Dict, Any, Optional
 from dotenv import load_dotenv
+from .retry import request_with_retry
+from fastapi_backend.services.utils.rate_limiter import rate_limiters
 
 # Load environment variables
 load_dotenv()
@@ -26,190 +28,145 @@ class FashnApiClient:
         
         # Default timeout in seconds
         self.default_timeout = int(os.getenv('FASHN_REQUEST_TIMEOUT', '30'))
+
+        # Total time allowed for a call including retries and backoff, in seconds
+        self.call_deadline = float(os.getenv('FASHN_CALL_DEADLINE', '120'))
+
+        # Backoff between retries in seconds, jittered and doubled per attempt
+        self.retry_base_delay = float(os.getenv('FASHN_RETRY_BASE_DELAY', '1'))
+        self.retry_max_delay = float(os.getenv('FASHN_RETRY_MAX_DELAY', '60'))
+
+        self._client: Optional[httpx.AsyncClient] = None
         
         print(f"Initialized Fashn.ai client with API URL: {self.api_url}")
 
-    def invoke_fashn_api(self, endpoint: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the shared async client, creating it on first use"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(headers={'Authorization': f"Bearer {self.api_key}"})
+        return self._client
+
+    def _error_message(self, response: httpx.Response) -> str:
+        """Extract the error message from an error response"""
+        try:
+            error_data = response.json()
+            if isinstance(error_data, dict):
+                return error_data.get('detail', error_data.get('message', str(error_data)))
+            return str(error_data)
+        except ValueError:
+            return response.text or f"HTTP error {response.status_code}"
+
+    async def _request(self, method: str, url: str, label: str, **kwargs) -> httpx.Response:
+        """
+        Send a request through the retry engine
+
+        Each attempt is bounded by the request timeout and by the time left
+        before the call deadline, and raises on transport failures once the
+        retries are used up.
+        """
+        async def send(remaining: Optional[float]) -> httpx.Response:
+            timeout = self.default_timeout if remaining is None else min(self.default_timeout, remaining)
+            return await self._get_client().request(method, url, timeout=timeout, **kwargs)
+
+        try:
+            return await request_with_retry(
+                send,
+                label,
+                max_retries=self.max_retries,
+                deadline=self.call_deadline,
+                base_delay=self.retry_base_delay,
+                max_delay=self.retry_max_delay,
+                limiter=rate_limiters.get('fashn')
+            )
+        except httpx.TimeoutException:
+            raise Exception(f"Request to {label} timed out after multiple attempts")
+        except httpx.TransportError as e:
+            raise Exception(f"Connection error when calling {label} after multiple attempts: {str(e)}")
+
+    async def invoke_fashn_api(self, endpoint: str, data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Utility function to call the fashn.ai API
-        
+
         Args:
             endpoint: The API endpoint to call
             data: The data to send to the API
-            
+
         Returns:
             The API response
         """
         # Construct the URL - ensure endpoint starts with /
         if not endpoint.startswith('/'):
             endpoint = f"/{endpoint}"
-            
+
         url = f"{self.api_url}{endpoint}"
-        
-        # Set headers with API key
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f"Bearer {self.api_key}"
-        }
-        
+
         # Clean the data by removing None values
         cleaned_data = {k: v for k, v in data.items() if v is not None}
-        print(f"Fashn.ai API Request to {endpoint}:", json.dumps(cleaned_data, indent=2))
-        
+
         # Convert to properly formatted JSON
         json_payload = json.dumps(cleaned_data, ensure_ascii=False)
-        
-        # Implement retry logic for transient errors
-        for attempt in range(self.max_retries):
-            try:
-                # Make the API request with proper timeout
-                response = requests.post(url, data=json_payload, headers=headers, timeout=self.default_timeout)
-                
-                # Check if the response status is successful
-                if response.status_code == 200:
-                    # Safely parse the JSON response
-                    try:
-                        response_data = response.json()
-                        print(f"Fashn.ai API Response from {endpoint}:", json.dumps(response_data, indent=2))
-                        return response_data
-                    except json.JSONDecodeError as e:
-                        print(f"Invalid JSON response: {response.text}")
-                        raise Exception(f"Received invalid JSON response from Fashn.ai API: {str(e)}")
-                elif response.status_code == 429:  # Too Many Requests
-                    wait_time = min(2 ** attempt, 60)  # Exponential backoff, max 60 seconds
-                    print(f"Rate limited (429). Retrying in {wait_time} seconds. Attempt {attempt+1}/{self.max_retries}")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    # Try to parse error response
-                    error_msg = "Unknown error"
-                    try:
-                        error_data = response.json()
-                        if isinstance(error_data, dict):
-                            error_msg = error_data.get('detail', error_data.get('message', str(error_data)))
-                    except:
-                        error_msg = response.text or f"HTTP error {response.status_code}"
-                    
-                    print(f"Fashn.ai API Error: Status {response.status_code}")
-                    print(f"Response content: {response.text}")
-                    
-                    if attempt < self.max_retries - 1 and 500 <= response.status_code < 600:
-                        # Server errors can be retried
-                        wait_time = min(2 ** attempt, 60)
-                        print(f"Server error. Retrying in {wait_time} seconds. Attempt {attempt+1}/{self.max_retries}")
-                        time.sleep(wait_time)
-                        continue
-                    
-                    raise Exception(f"API returned {response.status_code}: {error_msg}")
-                    
-            except requests.exceptions.Timeout:
-                print(f"Fashn.ai API request timed out. Attempt {attempt+1}/{self.max_retries}")
-                if attempt < self.max_retries - 1:
-                    time.sleep(min(2 ** attempt, 60))
-                    continue
-                raise Exception("Request to Fashn.ai API timed out after multiple attempts")
-                
-            except requests.exceptions.ConnectionError:
-                print(f"Fashn.ai API connection error. Attempt {attempt+1}/{self.max_retries}")
-                if attempt < self.max_retries - 1:
-                    time.sleep(min(2 ** attempt, 60))
-                    continue
-                raise Exception("Connection error when calling Fashn.ai API after multiple attempts")
-                
-            except requests.exceptions.RequestException as e:
-                print(f"Fashn.ai API Request exception: {str(e)}")
-                raise Exception(f"Network error when calling Fashn.ai API: {str(e)}")
-        
-        # If we get here, all retries failed
-        raise Exception(f"Failed to call Fashn.ai API after {self.max_retries} attempts")
+        print(f"Fashn.ai API Request to {endpoint} ({len(json_payload)} bytes)")
+
+        response = await self._request(
+            'POST', url, 'Fashn.ai API',
+            content=json_payload.encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+
+        if response.status_code != 200:
+            print(f"Fashn.ai API Error: Status {response.status_code}")
+            print(f"Response content: {response.text}")
+            raise Exception(f"API returned {response.status_code}: {self._error_message(response)}")
+
+        # Safely parse the JSON response
+        try:
+            response_data = response.json()
+        except ValueError as e:
+            print(f"Invalid JSON response: {response.text}")
+            raise Exception(f"Received invalid JSON response from Fashn.ai API: {str(e)}")
 
-    def get_fashn_api_status(self, prediction_id: str) -> Dict[str, Any]:
+        print(f"Fashn.ai API Response from {endpoint}:", json.dumps(response_data, indent=2))
+        return response_data
+
+    async def get_fashn_api_status(self, prediction_id: str) -> Dict[str, Any]:
         """
         Utility function to get status from the fashn.ai API
-        
+
         Args:
             prediction_id: The prediction ID to query
-            
+
         Returns:
             The API response
         """
         # Construct the URL with the correct endpoint format
         url = f"{self.api_url}/status/{prediction_id}"
-        
-        # Set headers with API key
-        headers = {
-            'Authorization': f"Bearer {self.api_key}"
-        }
-        
+
         print(f"Fashn.ai Status Request for ID: {prediction_id}")
-        
-        # Implement retry logic for transient errors
-        for attempt in range(self.max_retries):
-            try:
-                # Make the API request with timeout
-                response = requests.get(url, headers=headers, timeout=self.default_timeout)
-                
-                # Check if the response status is successful
-                if response.status_code == 200:
-                    # Safely parse the JSON response
-                    try:
-                        response_data = response.json()
-                        print(f"Fashn.ai Status Response:", json.dumps(response_data, indent=2))
-                        
-                        # Parse and normalize the response data
-                        normalized_response = self._normalize_status_response(response_data)
-                        return normalized_response
-                        
-                    except json.JSONDecodeError as e:
-                        print(f"Invalid JSON response: {response.text}")
-                        raise Exception(f"Received invalid JSON response from Fashn.ai Status API: {str(e)}")
-                elif response.status_code == 429:  # Too Many Requests
-                    wait_time = min(2 ** attempt, 60)  # Exponential backoff, max 60 seconds
-                    print(f"Rate limited (429). Retrying in {wait_time} seconds. Attempt {attempt+1}/{self.max_retries}")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    # Try to parse error response
-                    error_msg = "Unknown error"
-                    try:
-                        error_data = response.json()
-                        if isinstance(error_data, dict):
-                            error_msg = error_data.get('detail', error_data.get('message', str(error_data)))
-                    except:
-                        error_msg = response.text or f"HTTP error {response.status_code}"
-                    
-                    print(f"Fashn.ai Status API Error: Status {response.status_code}")
-                    print(f"Response content: {response.text}")
-                    
-                    if attempt < self.max_retries - 1 and 500 <= response.status_code < 600:
-                        # Server errors can be retried
-                        wait_time = min(2 ** attempt, 60)
-                        print(f"Server error. Retrying in {wait_time} seconds. Attempt {attempt+1}/{self.max_retries}")
-                        time.sleep(wait_time)
-                        continue
-                    
-                    raise Exception(f"Status API returned {response.status_code}: {error_msg}")
-                    
-            except requests.exceptions.Timeout:
-                print(f"Fashn.ai Status API request timed out. Attempt {attempt+1}/{self.max_retries}")
-                if attempt < self.max_retries - 1:
-                    time.sleep(min(2 ** attempt, 60))
-                    continue
-                raise Exception("Request to Fashn.ai Status API timed out after multiple attempts")
-                
-            except requests.exceptions.ConnectionError:
-                print(f"Fashn.ai Status API connection error. Attempt {attempt+1}/{self.max_retries}")
-                if attempt < self.max_retries - 1:
-                    time.sleep(min(2 ** attempt, 60))
-                    continue
-                raise Exception("Connection error when calling Fashn.ai Status API after multiple attempts")
-                
-            except requests.exceptions.RequestException as e:
-                print(f"Fashn.ai Status API Request exception: {str(e)}")
-                raise Exception(f"Network error when calling Fashn.ai Status API: {str(e)}")
-        
-        # If we get here, all retries failed
-        raise Exception(f"Failed to call Fashn.ai Status API after {self.max_retries} attempts")
+
+        response = await self._request('GET', url, 'Fashn.ai Status API')
+
+        if response.status_code != 200:
+            print(f"Fashn.ai Status API Error: Status {response.status_code}")
+            print(f"Response content: {response.text}")
+            raise Exception(f"Status API returned {response.status_code}: {self._error_message(response)}")
+
+        # Safely parse the JSON response
+        try:
+            response_data = response.json()
+        except ValueError as e:
+            print(f"Invalid JSON response: {response.text}")
+            raise Exception(f"Received invalid JSON response from Fashn.ai Status API: {str(e)}")
+
+        print(f"Fashn.ai Status Response:", json.dumps(response_data, indent=2))
+
+        # Parse and normalize the response data
+        return self._normalize_status_response(response_data)
+
+    async def aclose(self) -> None:
+        """Close the pooled connection"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     def _normalize_status_response(self, response_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -0,0 +1,372 @@
+"""
+On-disk cache for remote source images
+
+Product and garment images are reused across many try-ons and edits. Downloads
+are streamed to disk once and revalidated with conditional GETs (ETag and
+Last-Modified), so an unchanged image costs a 304 instead of a full download.
+The cache is bounded in size and evicts the least recently used files.
+Serving a file touches its mtime, which is the recency eviction goes by, so a
+hit is visible to every worker and survives restarts without rewriting the
+index. Files touched within the in-use window are never evicted, so a worker
+does not delete a file another worker has just handed out. Workers merge the
+entries they changed into the shared index and evict against that index under
+its file lock, batching index writes unless the cache is over budget.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Set, Tuple
+
+import httpx
+import aiofiles
+from dotenv import load_dotenv
+
+from fastapi_backend.services.utils.async_io import io_executor, run_io, write_atomic
+from fastapi_backend.services.utils.file_lock import file_lock, read_json_map
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Directory holding the cached files and their index
+FETCH_CACHE_DIR = Path(os.getenv(
+    'FETCH_CACHE_DIR', str(Path(__file__).parent.parent.parent / "storage" / "fetch_cache")))
+
+# Maximum total size of the cached files in bytes (default 1 GB)
+FETCH_CACHE_MAX_BYTES = int(os.getenv('FETCH_CACHE_MAX_BYTES', str(1024 * 1024 * 1024)))
+
+# Seconds a cached file is served without revalidating it
+FETCH_CACHE_FRESH_SECONDS = int(os.getenv('FETCH_CACHE_FRESH_SECONDS', '300'))
+
+# Seconds after it was last served during which a file is not evicted
+FETCH_CACHE_IN_USE_SECONDS = float(os.getenv('FETCH_CACHE_IN_USE_SECONDS', '60'))
+
+# Largest file the cache downloads in bytes (default 50 MB)
+FETCH_CACHE_MAX_FILE_BYTES = int(os.getenv('FETCH_CACHE_MAX_FILE_BYTES', str(50 * 1024 * 1024)))
+
+# Timeout for downloads in seconds
+FETCH_CACHE_TIMEOUT = float(os.getenv('FETCH_CACHE_TIMEOUT', '30'))
+
+# Seconds index changes are batched before they are written, unless over budget
+FETCH_CACHE_INDEX_INTERVAL = float(os.getenv('FETCH_CACHE_INDEX_INTERVAL', '5'))
+
+FETCH_CHUNK_SIZE = 64 * 1024
+
+
+class FetchTooLargeError(httpx.HTTPError):
+    """Raised when a remote file exceeds FETCH_CACHE_MAX_FILE_BYTES"""
+
+
+class FetchResult(NamedTuple):
+    """A cached download"""
+    path: Path
+    content_type: str
+
+
+class FetchCache:
+    """Size-bounded LRU cache of remote files with conditional revalidation"""
+
+    def __init__(self, cache_dir: Path = FETCH_CACHE_DIR, max_bytes: int = FETCH_CACHE_MAX_BYTES,
+                 fresh_seconds: int = FETCH_CACHE_FRESH_SECONDS,
+                 in_use_seconds: float = FETCH_CACHE_IN_USE_SECONDS,
+                 max_file_bytes: int = FETCH_CACHE_MAX_FILE_BYTES,
+                 index_interval: float = FETCH_CACHE_INDEX_INTERVAL):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index_file = self.cache_dir / "index.json"
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+        self.in_use_seconds = in_use_seconds
+        self.max_file_bytes = max_file_bytes
+        self.index_interval = index_interval
+
+        self._lock = threading.Lock()
+        # Held by every worker while it updates the shared index and evicts
+        self._index_lock = file_lock(f"{self.index_file}.lock")
+        self._entries: Dict[str, Dict[str, Any]] = read_json_map(self.index_file)
+        # Keys whose entries this worker changed since the last save
+        self._dirty: Set[str] = set()
+        self._saved_at = 0.0
+        self._save_task: Optional[asyncio.Task] = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def _save_index(self, keep: Iterable[str] = ()) -> None:
+        """
+        Merge this worker's changes into the shared index, evict over budget and reload the index
+
+        Args:
+            keep: Keys that are not evicted, e.g. the file just stored for the caller
+        """
+        with self._lock:
+            updates = {key: dict(self._entries[key]) for key in self._dirty if key in self._entries}
+            self._dirty = set()
+            self._saved_at = time.time()
+
+        with self._index_lock:
+            entries = read_json_map(self.index_file)
+            entries.update(updates)
+            self._evict(entries, set(keep))
+            write_atomic(self.index_file, json.dumps(entries).encode())
+
+        with self._lock:
+            # Keep the entries changed while the index was being written
+            for key in self._dirty:
+                if key in self._entries:
+                    entries[key] = self._entries[key]
+            self._entries = entries
+
+    def _save_due(self) -> bool:
+        """Whether pending index changes have to be written now rather than batched"""
+        with self._lock:
+            if not self._dirty:
+                return False
+            total = sum(entry.get('size', 0) for entry in self._entries.values())
+            return total > self.max_bytes or time.time() - self._saved_at >= self.index_interval
+
+    def _schedule_save(self) -> None:
+        """Write the batched index changes once the index interval has passed"""
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self) -> None:
+        await asyncio.sleep(max(0.0, self._saved_at + self.index_interval - time.time()))
+        try:
+            await run_io(self._save_index)
+        except Exception as e:
+            logger.error(f"Error saving the fetch cache index: {e}")
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def _cached(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the index entry for a key if its file is still on disk"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and (self.cache_dir / entry['file']).exists():
+            return entry
+        return None
+
+    def _result(self, entry: Dict[str, Any]) -> FetchResult:
+        path = self.cache_dir / entry['file']
+        try:
+            # Records the hit for the eviction in every worker
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return FetchResult(path, entry.get('contentType') or 'image/jpeg')
+
+    def _conditional_headers(self, entry: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('lastModified'):
+                headers['If-Modified-Since'] = entry['lastModified']
+        return headers
+
+    def _store(self, key: str, url: str, response: httpx.Response, temp_path: Path, size: int) -> Dict[str, Any]:
+        """Move a completed download into place and record it in the index"""
+        filename = key
+        os.replace(temp_path, self.cache_dir / filename)
+        now = time.time()
+        entry = {
+            'url': url,
+            'file': filename,
+            'etag': response.headers.get('ETag'),
+            'lastModified': response.headers.get('Last-Modified'),
+            'contentType': response.headers.get('Content-Type', 'image/jpeg').split(';')[0],
+            'size': size,
+            'fetchedAt': now,
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._dirty.add(key)
+        return entry
+
+    def _revalidated(self, key: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            entry['fetchedAt'] = time.time()
+            self._entries[key] = entry
+            self._dirty.add(key)
+        return entry
+
+    def _evict(self, entries: Dict[str, Dict[str, Any]], keep: Set[str]) -> None:
+        """
+        Remove least recently used files until the cache fits its size budget
+
+        Works on the shared index read under its lock. Recency is the file's
+        mtime, and files served within the in-use window are skipped, whichever
+        worker served them.
+        """
+        total = sum(entry.get('size', 0) for entry in entries.values())
+        if total <= self.max_bytes:
+            return
+        used: Dict[str, float] = {}
+        for key, entry in entries.items():
+            try:
+                used[key] = (self.cache_dir / entry['file']).stat().st_mtime
+            except FileNotFoundError:
+                # Already gone, dropped from the index first
+                used[key] = 0.0
+        now = time.time()
+        for key in sorted(used, key=used.get):
+            if total <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            entry = entries[key]
+            path = self.cache_dir / entry['file']
+            try:
+                if now - path.stat().st_mtime < self.in_use_seconds:
+                    continue
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= entry.get('size', 0)
+            del entries[key]
+
+    def _check_size(self, response: httpx.Response, size: int) -> None:
+        """Abort downloads that are, or announce they will be, larger than max_file_bytes"""
+        try:
+            announced = int(response.headers.get('Content-Length', 0))
+        except ValueError:
+            announced = 0
+        if max(size, announced) > self.max_file_bytes:
+            raise FetchTooLargeError(
+                f"{response.url} is larger than the {self.max_file_bytes} byte download limit")
+
+    @staticmethod
+    def _discard(temp_path: Path) -> None:
+        """Remove a partial download if it is still there"""
+        temp_path.unlink(missing_ok=True)
+
+    def _is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry.get('fetchedAt', 0) < self.fresh_seconds
+
+    async def _download(self, key: str, url: str, entry: Optional[Dict[str, Any]], verify: bool) -> Dict[str, Any]:
+        temp_path = self.cache_dir / f".{uuid.uuid4().hex}.part"
+        try:
+            async with httpx.AsyncClient(timeout=FETCH_CACHE_TIMEOUT, verify=verify, follow_redirects=True) as client:
+                async with client.stream('GET', url, headers=self._conditional_headers(entry)) as response:
+                    if response.status_code == 304 and entry:
+                        return self._revalidated(key, entry)
+                    response.raise_for_status()
+
+                    size = 0
+                    self._check_size(response, size)
+                    async with aiofiles.open(temp_path, 'wb', executor=io_executor) as f:
+                        async for chunk in response.aiter_bytes(FETCH_CHUNK_SIZE):
+                            size += len(chunk)
+                            self._check_size(response, size)
+                            await f.write(chunk)
+                    return await run_io(self._store, key, url, response, temp_path, size)
+        finally:
+            await run_io(self._discard, temp_path)
+
+    async def fetch(self, url: str, verify: bool = True) -> FetchResult:
+        """
+        Return a local copy of a remote file, downloading or revalidating it if needed
+
+        Args:
+            url: URL of the file
+            verify: Whether to verify TLS certificates
+
+        Returns:
+            FetchResult with the cached file path and content type
+
+        Raises:
+            httpx.HTTPError: If the file is not cached and cannot be downloaded,
+                FetchTooLargeError if it exceeds max_file_bytes
+        """
+        key = self._key(url)
+        entry = await run_io(self._cached, key)
+        if entry and self._is_fresh(entry):
+            return await run_io(self._result, entry)
+
+        # Concurrent requests for the same URL share one download
+        if key in self._in_flight:
+            return await run_io(self._result, await asyncio.shield(self._in_flight[key]))
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            try:
+                entry = await self._download(key, url, entry, verify)
+            except Exception as e:
+                if not entry:
+                    raise
+                # Serve the stale copy when the origin cannot be reached
+                logger.warning(f"Revalidation of {url} failed, serving cached copy: {e}")
+            if self._save_due():
+                await run_io(self._save_index, {key})
+            else:
+                self._schedule_save()
+            future.set_result(entry)
+            return await run_io(self._result, entry)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def fetch_bytes(self, url: str, verify: bool = True) -> Tuple[bytes, str]:
+        """Return the content and content type of a remote file through the cache"""
+        result = await self.fetch(url, verify=verify)
+        return await run_io(result.path.read_bytes), result.content_type
+
+    def fetch_sync(self, url: str, verify: bool = True) -> FetchResult:
+        """
+        Blocking variant of fetch for code that is not async yet
+
+        Args:
+            url: URL of the file
+            verify: Whether to verify TLS certificates
+
+        Returns:
+            FetchResult with the cached file path and content type
+        """
+        key = self._key(url)
+        entry = self._cached(key)
+        if entry and self._is_fresh(entry):
+            return self._result(entry)
+
+        temp_path = self.cache_dir / f".{uuid.uuid4().hex}.part"
+        try:
+            with httpx.Client(timeout=FETCH_CACHE_TIMEOUT, verify=verify, follow_redirects=True) as client:
+                with client.stream('GET', url, headers=self._conditional_headers(entry)) as response:
+                    if response.status_code == 304 and entry:
+                        entry = self._revalidated(key, entry)
+                    else:
+                        response.raise_for_status()
+                        size = 0
+                        self._check_size(response, size)
+                        with open(temp_path, 'wb') as f:
+                            for chunk in response.iter_bytes(FETCH_CHUNK_SIZE):
+                                size += len(chunk)
+                                self._check_size(response, size)
+                                f.write(chunk)
+                        entry = self._store(key, url, response, temp_path, size)
+        except Exception as e:
+            if not entry:
+                raise
+            logger.warning(f"Revalidation of {url} failed, serving cached copy: {e}")
+        finally:
+            self._discard(temp_path)
+
+        if self._save_due():
+            self._save_index({key})
+        # Otherwise the change is written with the next save
+        return self._result(entry)
+
+
+# Shared cache so every service reuses the same downloads
+fetch_cache = FetchCache()
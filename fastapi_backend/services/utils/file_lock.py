@@ -0,0 +1,135 @@
+"""
+Cross-process locks for files shared by several workers
+
+With uvicorn --workers N every worker has its own copy of the module-level
+services, but all of them share the storage directory. Read-modify-write
+cycles on shared files (store indexes, caches, pools) hold an exclusive
+fcntl lock on a lock file next to the data, so updates from different workers
+are serialized instead of overwriting each other. Where fcntl is not
+available (Windows) the lock only covers the threads of one process.
+"""
+import os
+import json
+import logging
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+from fastapi_backend.services.utils.async_io import write_atomic
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class FileLock:
+    """Exclusive lock across threads and processes, reentrant within a thread"""
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """
+        Take the lock
+
+        Args:
+            blocking: Wait for the lock, otherwise return False if it is held elsewhere
+
+        Returns:
+            True if the lock was taken
+        """
+        if not self._thread_lock.acquire(blocking):
+            return False
+        if self._depth == 0:
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                if fcntl:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BaseException:
+                        os.close(fd)
+                        raise
+                self._fd = fd
+            except BlockingIOError:
+                self._thread_lock.release()
+                return False
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return True
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            fd, self._fd = self._fd, None
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        self._thread_lock.release()
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+_locks: Dict[str, FileLock] = {}
+_locks_guard = threading.Lock()
+
+
+def file_lock(path) -> FileLock:
+    """Return the shared lock for a lock file, one instance per path so nesting within a thread works"""
+    path = os.path.abspath(os.fspath(path))
+    with _locks_guard:
+        if path not in _locks:
+            _locks[path] = FileLock(path)
+        return _locks[path]
+
+
+def read_json_map(path) -> Dict[str, Any]:
+    """Read a JSON object file, empty if it is missing or invalid"""
+    try:
+        with open(path, 'rb') as f:
+            return json.loads(f.read())
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f"Error loading {path}: {e}")
+        return {}
+
+
+def update_json_map(path, updates: Dict[str, Any], removed: Iterable[str] = (),
+                    max_entries: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Merge entries into a JSON object file shared by several workers
+
+    The file is re-read under its lock, so entries written by other workers
+    since this worker loaded it are kept.
+
+    Args:
+        path: JSON file holding an object
+        updates: Entries to add or replace
+        removed: Keys to delete
+        max_entries: Oldest entries, by insertion order, beyond this many are dropped
+
+    Returns:
+        The merged object as written
+    """
+    with file_lock(f"{os.fspath(path)}.lock"):
+        data = read_json_map(path)
+        data.update(updates)
+        for key in removed:
+            data.pop(key, None)
+        if max_entries is not None and len(data) > max_entries:
+            data = dict(list(data.items())[len(data) - max_entries:])
+        write_atomic(path, json.dumps(data).encode())
+        return data
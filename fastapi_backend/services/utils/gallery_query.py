@@ -0,0 +1,263 @@
+"""
+Cursor pagination and filtering for gallery listings
+
+Galleries are listed newest first. A page ends with an opaque cursor encoding
+the (timestamp, id) of its last record, and the next page starts strictly after
+it, so pages stay stable while new results are being added. Gallery records are
+kept in a SQLite table indexed on (timestamp, id), so a page is one indexed
+range query however many records there are.
+"""
+import json
+import base64
+import sqlite3
+import logging
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Default and maximum number of records per gallery page
+GALLERY_DEFAULT_LIMIT = 50
+GALLERY_MAX_LIMIT = 200
+
+
+def encode_cursor(timestamp: float, record_id: str) -> str:
+    """Encode the position of a record as an opaque cursor"""
+    raw = json.dumps([timestamp, record_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """
+    Decode a cursor returned by encode_cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, record_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return float(timestamp), str(record_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def to_timestamp(value) -> float:
+    """Convert an ISO string or epoch number to an epoch timestamp, 0 if unknown"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return 0.0
+    return 0.0
+
+
+@dataclass
+class GalleryFilters:
+    """Server-side gallery filters, unset fields match everything"""
+    provider: Optional[str] = None
+    clothing_type: Optional[str] = None
+    gender: Optional[str] = None
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+
+
+def clamp_limit(limit: int) -> int:
+    return max(1, min(limit, GALLERY_MAX_LIMIT))
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id TEXT PRIMARY KEY,
+    ts REAL NOT NULL,
+    provider TEXT,
+    clothing_type TEXT,
+    gender TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_ts_id ON records (ts, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+@dataclass
+class GalleryRecord:
+    """One gallery record with the columns it is filtered on"""
+    id: str
+    timestamp: float
+    data: Dict[str, Any]
+    provider: Optional[str] = None
+    clothing_type: Optional[str] = None
+    gender: Optional[str] = None
+
+
+def _lower(value: Optional[str]) -> Optional[str]:
+    return value.lower() if value else None
+
+
+class GalleryStore:
+    """
+    SQLite table of gallery records, shared by the workers
+
+    Records are inserted and updated row by row, WAL mode lets pages be read
+    while another worker writes. The timestamp of a record is fixed when it is
+    first stored, so pages stay stable when a record is updated later.
+    """
+
+    def __init__(self, path, legacy: Optional[Callable[[], Iterable[GalleryRecord]]] = None):
+        """
+        Args:
+            path: Database file
+            legacy: Yields the records kept by an earlier storage format, imported
+                once when the database is created
+        """
+        self.path = Path(path)
+        self.legacy = legacy
+        # The database is created on first use, not at import
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Short-lived connection that commits on success, the methods run on the storage pool"""
+        if not self._initialized:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            if not self._initialized:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript(_SCHEMA)
+                if self.legacy:
+                    with conn:
+                        self._import_legacy(conn)
+                self._initialized = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _import_legacy(self, conn: sqlite3.Connection) -> None:
+        # Taking the write lock first makes one worker import while the others wait
+        conn.execute('BEGIN IMMEDIATE')
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'imported'").fetchone():
+            return
+        count = 0
+        for record in self.legacy():
+            self._put(conn, record)
+            count += 1
+        conn.execute("INSERT INTO meta (key, value) VALUES ('imported', '1')")
+        if count:
+            logger.info(f"Imported {count} gallery records into {self.path}")
+
+    @staticmethod
+    def _put(conn: sqlite3.Connection, record: GalleryRecord) -> None:
+        conn.execute(
+            'INSERT INTO records (id, ts, provider, clothing_type, gender, data) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (id) DO UPDATE SET provider = excluded.provider, clothing_type = excluded.clothing_type, '
+            'gender = excluded.gender, data = excluded.data',
+            (record.id, record.timestamp, _lower(record.provider), _lower(record.clothing_type),
+             _lower(record.gender), json.dumps(record.data)))
+
+    def put(self, record: GalleryRecord) -> None:
+        """Insert a record, or replace its data keeping the timestamp it was first stored with"""
+        with self._connect() as conn:
+            self._put(conn, record)
+
+    def insert(self, record: GalleryRecord) -> bool:
+        """Insert a record unless one with the same ID exists, returns whether it was inserted"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO records (id, ts, provider, clothing_type, gender, data) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (record.id, record.timestamp, _lower(record.provider), _lower(record.clothing_type),
+                 _lower(record.gender), json.dumps(record.data)))
+            return cursor.rowcount > 0
+
+    def update(self, updates: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Merge fields into the data of records
+
+        Args:
+            updates: Record ID -> fields to set
+
+        Returns:
+            Number of records found and updated
+        """
+        updated = 0
+        with self._connect() as conn:
+            # Read and write in one write transaction so concurrent updates are not lost
+            conn.execute('BEGIN IMMEDIATE')
+            for record_id, fields in updates.items():
+                row = conn.execute('SELECT data FROM records WHERE id = ?', (record_id,)).fetchone()
+                if not row:
+                    continue
+                data = json.loads(row[0])
+                data.update(fields)
+                conn.execute('UPDATE records SET data = ? WHERE id = ?', (json.dumps(data), record_id))
+                updated += 1
+        return updated
+
+    def get(self, record_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute('SELECT data FROM records WHERE id = ?', (record_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find(self, field: str, value: Any) -> List[Dict[str, Any]]:
+        """Records whose data holds value in a top-level field, oldest first"""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT data FROM records WHERE json_extract(data, ?) = ? ORDER BY ts, id',
+                                (f'$.{field}', value)).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def all(self) -> List[Dict[str, Any]]:
+        """Every record, oldest first"""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT data FROM records ORDER BY ts, id').fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def page(self, filters: GalleryFilters, cursor: Optional[str],
+             limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        One page of records newest first
+
+        Returns:
+            The records and the cursor of the next page, None on the last page
+
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        conditions, params = [], []
+        if cursor:
+            conditions.append('(ts, id) < (?, ?)')
+            params.extend(decode_cursor(cursor))
+        for column, wanted in (('provider', filters.provider),
+                               ('clothing_type', filters.clothing_type),
+                               ('gender', filters.gender)):
+            if wanted:
+                conditions.append(f'{column} = ?')
+                params.append(wanted.lower())
+        if filters.date_from:
+            conditions.append('ts >= ?')
+            params.append(filters.date_from.timestamp())
+        if filters.date_to:
+            conditions.append('ts <= ?')
+            params.append(filters.date_to.timestamp())
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._connect() as conn:
+            rows = conn.execute(
+                f'SELECT ts, id, data FROM records {where} ORDER BY ts DESC, id DESC LIMIT ?',
+                (*params, limit)).fetchall()
+
+        records = [json.loads(data) for _, _, data in rows]
+        if len(rows) < limit:
+            return records, None
+        timestamp, record_id, _ = rows[-1]
+        return records, encode_cursor(timestamp, record_id)
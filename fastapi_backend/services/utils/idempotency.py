@@ -0,0 +1,249 @@
+"""
+Idempotency keys for paid submission endpoints
+
+Clients retrying a submission after a timeout would otherwise start a second
+paid provider job. Requests that carry an Idempotency-Key header are recorded
+in a SQLite table shared by all workers: the first request with a key runs and
+its response is kept for IDEMPOTENCY_TTL_SECONDS, later requests with the same
+key get that response replayed. Duplicates that arrive while the first request
+is still running wait for it instead of submitting again, in-process through a
+shared task and across workers by polling the table. The shared task is
+shielded from its caller, so a client that disconnects does not cancel the
+submission its duplicates are waiting for.
+"""
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from fastapi_backend.services.utils.async_io import run_io
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_DB = Path(os.getenv(
+    'IDEMPOTENCY_DB', str(Path(__file__).parent.parent.parent / "storage" / "idempotency.sqlite3")))
+
+# Seconds a completed response is replayed for
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+
+# Seconds after which an unfinished request is presumed lost (e.g. its worker died)
+IDEMPOTENCY_PENDING_SECONDS = float(os.getenv('IDEMPOTENCY_PENDING_SECONDS', '600'))
+
+# Seconds a duplicate waits for the original request in another worker
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '120'))
+
+# Longest accepted Idempotency-Key header
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+
+PENDING = 'pending'
+DONE = 'done'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    state TEXT NOT NULL,
+    response TEXT,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+CREATE INDEX IF NOT EXISTS idempotency_expires ON idempotency (expires_at);
+"""
+
+
+class IdempotencyError(Exception):
+    """Base class of the idempotency errors, carries the HTTP status for the endpoints"""
+    status_code = 400
+
+
+class IdempotencyConflictError(IdempotencyError):
+    """Raised when a key is reused with a different request"""
+    status_code = 422
+
+
+class IdempotencyInProgressError(IdempotencyError):
+    """Raised when the original request is still running after the wait period"""
+    status_code = 409
+
+
+def request_fingerprint(payload: Any) -> str:
+    """Stable hash of a request body"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """TTL store of responses by idempotency key, with coalescing of concurrent duplicates"""
+
+    def __init__(self, path: Path = IDEMPOTENCY_DB, ttl: float = IDEMPOTENCY_TTL_SECONDS,
+                 pending_timeout: float = IDEMPOTENCY_PENDING_SECONDS,
+                 wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS, poll_interval: float = 0.5):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.pending_timeout = pending_timeout
+        self.wait_seconds = wait_seconds
+        self.poll_interval = poll_interval
+        # The database is created on first use, not at import
+        self._initialized = False
+        self._last_purge = 0.0
+        # (scope, key) -> (fingerprint, task) of requests running in this worker
+        self._in_flight: Dict[Tuple[str, str], Tuple[str, asyncio.Task]] = {}
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Short-lived connection that commits on success, the methods run on the storage pool"""
+        if not self._initialized:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            if not self._initialized:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript(_SCHEMA)
+                self._initialized = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def begin(self, scope: str, key: str, fingerprint: str) -> Tuple[Optional[str], Optional[Any]]:
+        """
+        Claim a key for a new request, or report the request that holds it
+
+        Args:
+            scope: Endpoint the key belongs to
+            key: Client-supplied idempotency key
+            fingerprint: Hash of the request body, see request_fingerprint
+
+        Returns:
+            (None, None) if the key was claimed, (PENDING, None) if the original
+            request is still running, (DONE, response) if it finished
+
+        Raises:
+            IdempotencyConflictError: If the key was used with a different request
+        """
+        now = time.time()
+        with self._connect() as conn:
+            if now - self._last_purge > 3600:
+                conn.execute('DELETE FROM idempotency WHERE expires_at < ?', (now,))
+                self._last_purge = now
+            else:
+                conn.execute('DELETE FROM idempotency WHERE scope = ? AND key = ? AND expires_at < ?',
+                             (scope, key, now))
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO idempotency (scope, key, fingerprint, state, created_at, expires_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (scope, key, fingerprint, PENDING, now, now + self.pending_timeout))
+            if cursor.rowcount:
+                return None, None
+            stored_fingerprint, state, response = conn.execute(
+                'SELECT fingerprint, state, response FROM idempotency WHERE scope = ? AND key = ?',
+                (scope, key)).fetchone()
+
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyConflictError(
+                "Idempotency-Key was already used with a different request")
+        return state, json.loads(response) if state == DONE else None
+
+    def complete(self, scope: str, key: str, response: Any) -> None:
+        """Store the response of a claimed key for replays"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE idempotency SET state = ?, response = ?, expires_at = ? WHERE scope = ? AND key = ?',
+                (DONE, json.dumps(response, default=str), now + self.ttl, scope, key))
+
+    def abandon(self, scope: str, key: str) -> None:
+        """Release a claimed key after a failure, so a retry runs the request again"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM idempotency WHERE scope = ? AND key = ? AND state = ?',
+                         (scope, key, PENDING))
+
+    async def _run_once(self, scope: str, key: str, fingerprint: str,
+                        func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        deadline = time.time() + self.wait_seconds
+        while True:
+            state, response = await run_io(self.begin, scope, key, fingerprint)
+            if state == DONE:
+                return response, True
+            if state is None:
+                break
+            # Another worker is running the original request
+            if time.time() > deadline:
+                raise IdempotencyInProgressError(
+                    "A request with this Idempotency-Key is still in progress")
+            await asyncio.sleep(self.poll_interval)
+
+        try:
+            result = await func()
+        except BaseException:
+            await run_io(self.abandon, scope, key)
+            raise
+        try:
+            await run_io(self.complete, scope, key, result)
+        except Exception as e:
+            # The response is still returned, a later retry just runs again
+            logger.error(f"Error storing idempotent response for {scope} {key}: {e}")
+            await run_io(self.abandon, scope, key)
+        return result, False
+
+    async def run(self, scope: str, key: Optional[str], payload: Any,
+                  func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run a request at most once per idempotency key
+
+        Args:
+            scope: Endpoint the key belongs to
+            key: Client-supplied idempotency key, the request always runs when it is empty
+            payload: Request body, a key reused with a different body is rejected
+            func: Runs the request and returns a JSON-serializable response
+
+        Returns:
+            The response and whether it was replayed from an earlier request
+
+        Raises:
+            IdempotencyError: If the key is invalid, reused or still in progress
+        """
+        if not key:
+            return await func(), False
+        if len(key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+            raise IdempotencyError(
+                f"Idempotency-Key must be at most {IDEMPOTENCY_MAX_KEY_LENGTH} characters")
+
+        fingerprint = request_fingerprint(payload)
+        slot = (scope, key)
+
+        # Concurrent duplicates in this worker share the original request
+        if slot in self._in_flight:
+            in_flight_fingerprint, task = self._in_flight[slot]
+            if in_flight_fingerprint != fingerprint:
+                raise IdempotencyConflictError(
+                    "Idempotency-Key was already used with a different request")
+            result, _ = await asyncio.shield(task)
+            return result, True
+
+        task = asyncio.create_task(self._run_once(scope, key, fingerprint, func))
+        self._in_flight[slot] = (fingerprint, task)
+        task.add_done_callback(lambda done: self._finished(slot, done))
+        # Cancelling this caller leaves the request running for its duplicates
+        return await asyncio.shield(task)
+
+    def _finished(self, slot: Tuple[str, str], task: asyncio.Task) -> None:
+        self._in_flight.pop(slot, None)
+        if not task.cancelled():
+            # Mark the exception retrieved when no duplicate is waiting
+            task.exception()
+
+# Shared store for the paid submission endpoints
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,346 @@
+"""
+Durable registry of submitted provider jobs
+
+Try-on (Fashn, Aidge) and model generation (Leonardo) jobs keep running at the
+provider after we submit them, and we pay for them whether or not anyone polls
+for the result. Every submission is recorded in a SQLite table together with
+its request, and its state moves forward as polls come in:
+
+    submitted -> processing -> completed | failed | expired
+
+When the app starts, jobs that never reached a terminal state are polled again
+in the background, so results of jobs in flight during a restart are still
+collected and persisted. Finished jobs are deleted after JOB_RETENTION_DAYS. With several workers every one of them follows the
+unfinished jobs, but a job is only polled by the worker holding its lease;
+another worker takes over when a lease runs out.
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+import asyncio
+import logging
+from pathlib import Path
+from dataclasses import dataclass
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set
+
+from dotenv import load_dotenv
+
+from fastapi_backend.services.utils.async_io import run_io
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+JOB_REGISTRY_DB = Path(os.getenv(
+    'JOB_REGISTRY_DB', str(Path(__file__).parent.parent.parent / "storage" / "jobs.sqlite3")))
+
+# Seconds between polls of a resumed job
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '10'))
+
+# Jobs older than this are given up on and marked expired (hours)
+JOB_MAX_AGE_HOURS = float(os.getenv('JOB_MAX_AGE_HOURS', '24'))
+
+# Seconds a worker keeps the right to poll a job without renewing it
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', '60'))
+
+# Finished jobs are deleted this long after their last update (days)
+JOB_RETENTION_DAYS = float(os.getenv('JOB_RETENTION_DAYS', '30'))
+
+# Seconds between prunes of finished jobs, run as new jobs are recorded
+JOB_PRUNE_INTERVAL = float(os.getenv('JOB_PRUNE_INTERVAL', '3600'))
+
+# Identifies this worker process in job leases
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+SUBMITTED = 'submitted'
+PROCESSING = 'processing'
+COMPLETED = 'completed'
+FAILED = 'failed'
+EXPIRED = 'expired'
+
+TERMINAL_STATES = {COMPLETED, FAILED, EXPIRED}
+
+# States a job may move to from each state, terminal states are final
+TRANSITIONS = {
+    SUBMITTED: {PROCESSING, COMPLETED, FAILED, EXPIRED},
+    PROCESSING: {PROCESSING, COMPLETED, FAILED, EXPIRED},
+    COMPLETED: set(),
+    FAILED: set(),
+    EXPIRED: set(),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    request TEXT,
+    result TEXT,
+    error TEXT,
+    polls INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at);
+"""
+
+# Columns added after the first release of the table
+_MIGRATIONS = {
+    'lease_owner': 'ALTER TABLE jobs ADD COLUMN lease_owner TEXT',
+    'lease_until': 'ALTER TABLE jobs ADD COLUMN lease_until REAL',
+}
+
+JobPoller = Callable[['Job'], Awaitable[str]]
+
+
+def job_id(kind: str, provider: str, task_id: str) -> str:
+    """Registry key of a provider task"""
+    return f"{kind}:{provider}:{task_id}"
+
+
+@dataclass
+class Job:
+    """One submitted provider job"""
+    id: str
+    kind: str
+    provider: str
+    task_id: str
+    state: str
+    request: Optional[Dict[str, Any]]
+    result: Optional[Any]
+    error: Optional[str]
+    polls: int
+    created_at: float
+    updated_at: float
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> 'Job':
+        return cls(
+            id=row['id'],
+            kind=row['kind'],
+            provider=row['provider'],
+            task_id=row['task_id'],
+            state=row['state'],
+            request=json.loads(row['request']) if row['request'] else None,
+            result=json.loads(row['result']) if row['result'] else None,
+            error=row['error'],
+            polls=row['polls'],
+            created_at=row['created_at'],
+            updated_at=row['updated_at']
+        )
+
+
+class JobRegistry:
+    """SQLite-backed record of provider jobs and their state"""
+
+    def __init__(self, path: Path = JOB_REGISTRY_DB, retention_seconds: float = JOB_RETENTION_DAYS * 86400,
+                 prune_interval: float = JOB_PRUNE_INTERVAL):
+        self.path = Path(path)
+        self.retention_seconds = retention_seconds
+        self.prune_interval = prune_interval
+        self._last_prune = 0.0
+        # The database is created on first use, not at import
+        self._initialized = False
+        # Jobs this process is polling, so a job is never followed twice
+        self._following: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Short-lived connection that commits on success, the methods run on the storage pool"""
+        if not self._initialized:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            if not self._initialized:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript(_SCHEMA)
+                columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+                for column, statement in _MIGRATIONS.items():
+                    if column not in columns:
+                        conn.execute(statement)
+                self._initialized = True
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, kind: str, provider: str, task_id: str,
+               request: Optional[Dict[str, Any]] = None) -> Job:
+        """
+        Record a submitted job, keeping the existing record if it is known already
+
+        Args:
+            kind: Job kind, e.g. "tryon" or "generation"
+            provider: Provider that runs the job
+            task_id: Task ID returned by the provider
+            request: Request the job was submitted with
+
+        Returns:
+            The recorded job
+        """
+        key = job_id(kind, provider, task_id)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO jobs (id, kind, provider, task_id, state, request, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, kind, provider, task_id, SUBMITTED,
+                 json.dumps(request) if request is not None else None, now, now))
+            job = Job.from_row(conn.execute('SELECT * FROM jobs WHERE id = ?', (key,)).fetchone())
+        if now - self._last_prune > self.prune_interval:
+            self.prune()
+        return job
+
+    def prune(self, max_age: Optional[float] = None) -> int:
+        """
+        Delete finished jobs whose last update is older than max_age seconds
+
+        Unfinished jobs are kept, they expire through follow.
+
+        Returns:
+            Number of deleted jobs
+        """
+        max_age = self.retention_seconds if max_age is None else max_age
+        self._last_prune = time.time()
+        terminal = sorted(TERMINAL_STATES)
+        placeholders = ', '.join('?' for _ in terminal)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f'DELETE FROM jobs WHERE updated_at < ? AND state IN ({placeholders})',
+                (self._last_prune - max_age, *terminal))
+        if cursor.rowcount:
+            logger.info(f"Pruned {cursor.rowcount} finished jobs")
+        return cursor.rowcount
+
+    def transition(self, key: str, state: str, result: Any = None, error: Optional[str] = None) -> bool:
+        """
+        Move a job to a new state
+
+        The check and the update are one statement, so concurrent pollers
+        cannot move a job out of a terminal state.
+
+        Args:
+            key: Registry key, see job_id
+            state: New state
+            result: Result to store with the job
+            error: Error message to store with the job
+
+        Returns:
+            True if the job moved, False if it is unknown or the transition is not allowed
+        """
+        if state not in TRANSITIONS:
+            raise ValueError(f"Unknown job state: {state}")
+        allowed_from = [source for source, targets in TRANSITIONS.items() if state in targets]
+        placeholders = ', '.join('?' for _ in allowed_from)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f'UPDATE jobs SET state = ?, result = COALESCE(?, result), error = COALESCE(?, error), '
+                f'polls = polls + 1, updated_at = ? WHERE id = ? AND state IN ({placeholders})',
+                (state, json.dumps(result) if result is not None else None, error, time.time(), key,
+                 *allowed_from))
+            return cursor.rowcount > 0
+
+    def claim(self, key: str, lease: float = JOB_LEASE_SECONDS, owner: str = WORKER_ID) -> bool:
+        """
+        Take or renew the lease on an unfinished job
+
+        Args:
+            key: Registry key, see job_id
+            lease: Seconds until the lease runs out unless it is renewed
+            owner: Worker taking the lease
+
+        Returns:
+            True if the worker holds the lease, False if another worker does or the job is finished
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET lease_owner = ?, lease_until = ? WHERE id = ? AND state IN (?, ?) '
+                'AND (lease_owner IS NULL OR lease_owner = ? OR lease_until < ?)',
+                (owner, now + lease, key, SUBMITTED, PROCESSING, owner, now))
+            return cursor.rowcount > 0
+
+    def get(self, key: str) -> Optional[Job]:
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (key,)).fetchone()
+        return Job.from_row(row) if row else None
+
+    def unfinished(self, kind: Optional[str] = None) -> List[Job]:
+        """Jobs that have not reached a terminal state, oldest first"""
+        query = 'SELECT * FROM jobs WHERE state IN (?, ?)'
+        params: List[Any] = [SUBMITTED, PROCESSING]
+        if kind:
+            query += ' AND kind = ?'
+            params.append(kind)
+        with self._connect() as conn:
+            rows = conn.execute(query + ' ORDER BY created_at', params).fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def stats(self) -> Dict[str, int]:
+        """Number of jobs per state"""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        return {state: count for state, count in rows}
+
+    async def _follow(self, job: Job, poll: JobPoller, interval: float, max_age: float) -> None:
+        try:
+            while True:
+                if time.time() - job.created_at > max_age:
+                    await run_io(self.transition, job.id, EXPIRED, error='Gave up polling the provider')
+                    logger.warning(f"Job {job.id} expired before it finished")
+                    return
+                if not await run_io(self.claim, job.id, max(JOB_LEASE_SECONDS, 2 * interval)):
+                    current = await run_io(self.get, job.id)
+                    if current is None or current.state in TERMINAL_STATES:
+                        return
+                    # Another worker is polling it, stand by in case its lease runs out
+                    await asyncio.sleep(interval)
+                    continue
+                try:
+                    # The poller records the new state itself and returns it
+                    state = await poll(job)
+                except Exception as e:
+                    # Polling errors are transient, try again on the next interval
+                    logger.error(f"Error polling job {job.id}: {e}")
+                    state = None
+                if state in TERMINAL_STATES:
+                    logger.info(f"Job {job.id} finished with state {state}")
+                    return
+                await asyncio.sleep(interval)
+        finally:
+            self._following.discard(job.id)
+
+    def follow(self, job: Job, poll: JobPoller, interval: float = JOB_POLL_INTERVAL,
+               max_age: float = JOB_MAX_AGE_HOURS * 3600) -> None:
+        """
+        Poll a job in the background until it reaches a terminal state
+
+        Must be called from the event loop. Jobs that are followed already are ignored.
+
+        Args:
+            job: Job to poll
+            poll: Queries the provider, records the outcome and returns the job's new state
+            interval: Seconds between polls
+            max_age: Seconds after submission at which the job is marked expired
+        """
+        if job.id in self._following:
+            return
+        self._following.add(job.id)
+        task = asyncio.create_task(self._follow(job, poll, interval, max_age))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+# Shared registry of try-on and generation jobs
+job_registry = JobRegistry()
@@ -0,0 +1,179 @@
+"""
+Per-provider rate limiting and concurrency control for outbound API calls
+
+Each provider gets a token bucket (request rate plus burst) and a concurrency
+budget shared by every service in the process. Callers reserve bucket slots in
+arrival order, so bursts are queued fairly and spread out locally instead of
+being sent to the provider and answered with 429s. A 429 pauses the bucket for
+all callers of that provider.
+"""
+import os
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Default (requests per second, burst, max concurrent requests) per provider,
+# overridable with RATE_LIMIT_<PROVIDER>_RPS, _BURST and _CONCURRENCY
+PROVIDER_LIMITS = {
+    'leonardo': (2.0, 5, 4),
+    'fashn': (2.0, 5, 6),
+    'aidge': (5.0, 10, 10),
+    'bria': (2.0, 5, 4),
+    'imagekit': (5.0, 10, 8),
+    'openai': (3.0, 10, 8),
+}
+
+DEFAULT_LIMITS = (5.0, 10, 10)
+
+
+class ProviderLimiter:
+    """Token bucket and concurrency governor for one provider"""
+
+    def __init__(self, name: str, rate: float, burst: int, max_concurrency: int):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_concurrency = max(1, max_concurrency)
+
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._tolerance = (self.burst - 1) * self._interval
+        # Theoretical arrival time of the next request (GCRA)
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self._requests = 0
+        self._throttled = 0
+        self._rate_limited = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._in_flight = 0
+        self._waiting = 0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _reserve(self) -> float:
+        """Reserve the next request slot and return how long to wait for it"""
+        if not self._interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            next_time = max(self._next_time, now)
+            delay = max(0.0, next_time - self._tolerance - now)
+            self._next_time = next_time + self._interval
+            return delay
+
+    def _record_wait(self, wait: float) -> None:
+        with self._lock:
+            self._requests += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            if wait > 0.001:
+                self._throttled += 1
+
+    @asynccontextmanager
+    async def limit(self):
+        """
+        Wait for a concurrency slot and a rate token, then run the call
+
+        Usage:
+            async with limiter.limit():
+                response = await client.post(...)
+        """
+        start_time = time.monotonic()
+        self._waiting += 1
+        semaphore = self._get_semaphore()
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            delay = self._reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            self._record_wait(time.monotonic() - start_time)
+            self._in_flight += 1
+            try:
+                yield
+            finally:
+                self._in_flight -= 1
+        finally:
+            semaphore.release()
+
+    def throttle(self) -> None:
+        """
+        Wait for a rate token from blocking code
+
+        Used by clients that still make synchronous requests. Only the request
+        rate is shaped, the concurrency budget applies to async callers.
+        """
+        start_time = time.monotonic()
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+        self._record_wait(time.monotonic() - start_time)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every caller for the given time after the provider rate limited us"""
+        with self._lock:
+            self._rate_limited += 1
+            resume_at = time.monotonic() + seconds + self._tolerance
+            self._next_time = max(self._next_time, resume_at)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the limits and wait-time metrics"""
+        with self._lock:
+            return {
+                'provider': self.name,
+                'rate': self.rate,
+                'burst': self.burst,
+                'maxConcurrency': self.max_concurrency,
+                'requests': self._requests,
+                'throttled': self._throttled,
+                'rateLimited': self._rate_limited,
+                'inFlight': self._in_flight,
+                'waiting': self._waiting,
+                'averageWait': self._total_wait / self._requests if self._requests else 0.0,
+                'maxWait': self._max_wait,
+            }
+
+
+class RateLimiterRegistry:
+    """Creates one limiter per provider on first use"""
+
+    def __init__(self):
+        self._limiters: Dict[str, ProviderLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str) -> ProviderLimiter:
+        limiter = self._limiters.get(provider)
+        if limiter is not None:
+            return limiter
+
+        with self._lock:
+            if provider not in self._limiters:
+                rate, burst, concurrency = PROVIDER_LIMITS.get(provider, DEFAULT_LIMITS)
+                prefix = f"RATE_LIMIT_{provider.upper()}"
+                self._limiters[provider] = ProviderLimiter(
+                    provider,
+                    rate=float(os.getenv(f"{prefix}_RPS", str(rate))),
+                    burst=int(os.getenv(f"{prefix}_BURST", str(burst))),
+                    max_concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", str(concurrency)))
+                )
+            return self._limiters[provider]
+
+    def stats(self):
+        return [limiter.stats() for limiter in self._limiters.values()]
+
+
+# Shared registry so every service draws from the same provider budgets
+rate_limiters = RateLimiterRegistry()
@@ -0,0 +1,267 @@
+"""
+Retention and garbage collection for stored images and uploads
+
+Downloaded result images, generation records and uploads accumulate forever.
+The sweeper walks each configured directory incrementally, a bounded number of
+entries per step, so even huge directories are never listed in one go. Files
+older than the policy's age limit are removed, and when a directory exceeds its
+size budget the oldest files go first. Files referenced by stored results and
+files modified within the grace period are never removed. Hard links into the
+blob store share the mtime of their blob, so their age is taken from the time
+the blob store recorded for the link. With several workers
+only the one holding the leader lock sweeps.
+"""
+import os
+import time
+import heapq
+import asyncio
+import logging
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from fastapi_backend.services.utils.storage import StorageManager
+from fastapi_backend.services.utils.blob_store import blob_store
+from fastapi_backend.services.utils.file_lock import FileLock, file_lock
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Whether the background sweep runs at all
+RETENTION_ENABLED = os.getenv('RETENTION_ENABLED', 'true').lower() == 'true'
+
+# Directory entries examined per sweep step
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '500'))
+
+# Seconds between sweep steps, keeps the sweep from competing with requests
+RETENTION_STEP_DELAY = float(os.getenv('RETENTION_STEP_DELAY', '0.5'))
+
+# Seconds between full sweeps of every directory
+RETENTION_SWEEP_INTERVAL = float(os.getenv('RETENTION_SWEEP_INTERVAL', '3600'))
+
+# Files modified more recently than this are never removed (uploads in progress, fresh results)
+RETENTION_GRACE_SECONDS = float(os.getenv('RETENTION_GRACE_SECONDS', '3600'))
+
+# Oldest files remembered per pass for the size policy
+RETENTION_MAX_CANDIDATES = int(os.getenv('RETENTION_MAX_CANDIDATES', '5000'))
+
+BASE_DIR = Path(__file__).parent.parent.parent
+
+# Default (max age in days, max bytes) per directory, 0 disables the limit
+DEFAULT_POLICIES = {
+    'images': (BASE_DIR / "storage" / "images", 30, 5 * 1024 ** 3),
+    'model_generation': (BASE_DIR / "storage" / "model_generation", 0, 0),
+    'uploads_models': (BASE_DIR / "uploads" / "models", 7, 2 * 1024 ** 3),
+    'uploads_clothing': (BASE_DIR / "uploads" / "clothing", 7, 2 * 1024 ** 3),
+}
+
+
+@dataclass
+class RetentionPolicy:
+    """Age and size limits for one directory"""
+    name: str
+    directory: Path
+    max_age_days: float = 0
+    max_bytes: int = 0
+
+    @classmethod
+    def from_env(cls, name: str, directory: Path, max_age_days: float, max_bytes: int) -> 'RetentionPolicy':
+        """Build a policy, overridable with RETENTION_<NAME>_MAX_AGE_DAYS and RETENTION_<NAME>_MAX_BYTES"""
+        prefix = f"RETENTION_{name.upper()}"
+        return cls(
+            name=name,
+            directory=Path(directory),
+            max_age_days=float(os.getenv(f"{prefix}_MAX_AGE_DAYS", str(max_age_days))),
+            max_bytes=int(os.getenv(f"{prefix}_MAX_BYTES", str(max_bytes)))
+        )
+
+
+@dataclass
+class _Pass:
+    """Progress of one sweep over a policy's directory"""
+    stack: List[Iterator[os.DirEntry]]
+    references: Set[str]
+    total_bytes: int = 0
+    # Max-heap on mtime (stored negated) holding the oldest removable files
+    candidates: List[Tuple[float, str, int]] = field(default_factory=list)
+
+
+class RetentionSweeper:
+    """Incrementally enforces retention policies, one bounded step at a time"""
+
+    def __init__(self, policies: List[RetentionPolicy], references: Callable[[], Set[str]],
+                 batch_size: int = RETENTION_BATCH_SIZE, grace_seconds: float = RETENTION_GRACE_SECONDS,
+                 max_candidates: int = RETENTION_MAX_CANDIDATES,
+                 on_remove: Optional[Callable[[str], None]] = None,
+                 leader_lock: Optional[FileLock] = None,
+                 created_at: Optional[Callable[[str], Optional[float]]] = None):
+        self.policies = policies
+        self.references = references
+        self.on_remove = on_remove
+        # Creation time of a path if it is known better than its mtime
+        self.created_at = created_at
+        # Held for the life of the process by the one worker that sweeps
+        self.leader_lock = leader_lock
+        self._is_leader = leader_lock is None
+        self.batch_size = max(1, batch_size)
+        self.grace_seconds = grace_seconds
+        self.max_candidates = max(1, max_candidates)
+
+        self._policy_index = 0
+        self._pass: Optional[_Pass] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats: Dict[str, Dict[str, Any]] = {
+            policy.name: {'removedFiles': 0, 'removedBytes': 0, 'lastBytes': None, 'lastSweep': None}
+            for policy in policies
+        }
+
+    def _remove(self, policy: RetentionPolicy, path: str, size: int) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.error(f"Error removing {path}: {e}")
+            return False
+        if self.on_remove:
+            self.on_remove(path)
+        self._stats[policy.name]['removedFiles'] += 1
+        self._stats[policy.name]['removedBytes'] += size
+        return True
+
+    def _next_entry(self, sweep: _Pass) -> Optional[os.DirEntry]:
+        """Depth-first walk that only ever holds one open listing per directory level"""
+        while sweep.stack:
+            entry = next(sweep.stack[-1], None)
+            if entry is None:
+                sweep.stack.pop()
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                try:
+                    sweep.stack.append(os.scandir(entry.path))
+                except OSError as e:
+                    logger.error(f"Error listing {entry.path}: {e}")
+                continue
+            return entry
+        return None
+
+    def _finish_pass(self, policy: RetentionPolicy, sweep: _Pass) -> None:
+        """Apply the size budget once the directory total is known"""
+        total = sweep.total_bytes
+        if policy.max_bytes and total > policy.max_bytes:
+            for _, path, size in sorted(sweep.candidates, reverse=True):
+                if total <= policy.max_bytes:
+                    break
+                if self._remove(policy, path, size):
+                    total -= size
+            if total > policy.max_bytes:
+                logger.warning(f"Retention {policy.name}: still {total} bytes over a budget of "
+                               f"{policy.max_bytes}, the rest is referenced or recent")
+        self._stats[policy.name]['lastBytes'] = total
+        self._stats[policy.name]['lastSweep'] = time.time()
+
+    def step(self) -> bool:
+        """
+        Examine up to batch_size directory entries
+
+        Returns:
+            True when this step completed a sweep of every policy
+        """
+        if not self.policies:
+            return True
+        policy = self.policies[self._policy_index]
+
+        if self._pass is None:
+            if not policy.directory.exists():
+                return self._advance()
+            self._pass = _Pass(stack=[os.scandir(policy.directory)], references=self.references())
+        sweep = self._pass
+
+        now = time.time()
+        for _ in range(self.batch_size):
+            entry = self._next_entry(sweep)
+            if entry is None:
+                self._finish_pass(policy, sweep)
+                return self._advance()
+
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            modified = stat.st_mtime
+            if self.created_at and now - modified >= self.grace_seconds:
+                created = self.created_at(entry.path)
+                if created is not None:
+                    modified = max(modified, created)
+            age = now - modified
+            if age < self.grace_seconds or os.path.abspath(entry.path) in sweep.references:
+                sweep.total_bytes += stat.st_size
+                continue
+
+            if policy.max_age_days and age > policy.max_age_days * 86400:
+                self._remove(policy, entry.path, stat.st_size)
+                continue
+
+            sweep.total_bytes += stat.st_size
+            if policy.max_bytes:
+                heapq.heappush(sweep.candidates, (-modified, entry.path, stat.st_size))
+                if len(sweep.candidates) > self.max_candidates:
+                    # Drop the newest candidate, the budget is enforced oldest first
+                    heapq.heappop(sweep.candidates)
+        return False
+
+    def _advance(self) -> bool:
+        """Move on to the next policy, returns True after the last one"""
+        if self._pass is not None:
+            for iterator in self._pass.stack:
+                iterator.close()
+        self._pass = None
+        self._policy_index = (self._policy_index + 1) % len(self.policies)
+        return self._policy_index == 0
+
+    def sweep(self) -> None:
+        """Run a complete sweep of every policy synchronously"""
+        while not self.step():
+            pass
+
+    async def run(self, step_delay: float = RETENTION_STEP_DELAY,
+                  interval: float = RETENTION_SWEEP_INTERVAL) -> None:
+        """Sweep forever, pausing between steps and between full sweeps"""
+        while True:
+            if not self._is_leader:
+                # Another worker sweeps, take over if it goes away
+                self._is_leader = self.leader_lock.acquire(blocking=False)
+                if not self._is_leader:
+                    await asyncio.sleep(interval)
+                    continue
+            try:
+                finished = await asyncio.to_thread(self.step)
+            except Exception as e:
+                logger.error(f"Retention sweep step failed: {e}")
+                self._advance()
+                finished = False
+            await asyncio.sleep(interval if finished else step_delay)
+
+    def start(self) -> None:
+        """Start the background sweep if it is enabled and not running yet"""
+        if RETENTION_ENABLED and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self.run())
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Removal counters and last measured size per policy"""
+        return {name: dict(values) for name, values in self._stats.items()}
+
+
+# Shared sweeper started with the app
+retention_sweeper = RetentionSweeper(
+    [RetentionPolicy.from_env(name, *limits) for name, limits in DEFAULT_POLICIES.items()],
+    references=StorageManager().referenced_paths,
+    # Removed files may be the last link to a stored blob
+    on_remove=blob_store.release,
+    leader_lock=file_lock(BASE_DIR / "storage" / ".retention.lock"),
+    created_at=blob_store.link_created_at
+)
@@ -0,0 +1,128 @@
+"""
+Non-blocking retry engine for provider HTTP calls
+
+Retries wait with asyncio.sleep, so other requests keep being served while one
+call backs off. Delays use exponential backoff with full jitter, honour the
+provider's Retry-After header and never run past the call's deadline.
+"""
+import time
+import random
+import asyncio
+import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Iterable, Optional
+
+import httpx
+
+from .rate_limiter import ProviderLimiter
+
+logger = logging.getLogger(__name__)
+
+# Status codes that are worth retrying
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+class RetryDeadlineExceeded(Exception):
+    """Raised when a call cannot complete before its deadline"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header into a number of seconds
+
+    Args:
+        value: Header value, either delay seconds or an HTTP date
+
+    Returns:
+        Seconds to wait, or None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff with full jitter for a zero-based attempt number"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+async def request_with_retry(send: Callable[[float], Awaitable[httpx.Response]],
+                             label: str,
+                             max_retries: int = 3,
+                             deadline: Optional[float] = None,
+                             base_delay: float = 1.0,
+                             max_delay: float = 60.0,
+                             retry_statuses: Iterable[int] = RETRYABLE_STATUS_CODES,
+                             limiter: Optional[ProviderLimiter] = None) -> httpx.Response:
+    """
+    Send a request, retrying transient failures without blocking the event loop
+
+    Args:
+        send: Coroutine function sending the request, called with the seconds
+            left before the deadline so it can bound its own timeout
+        label: Name of the call used in log messages
+        max_retries: Maximum number of attempts
+        deadline: Total seconds allowed for all attempts and waits
+        base_delay: Backoff delay for the first retry
+        max_delay: Largest backoff delay
+        retry_statuses: Response status codes that are retried
+        limiter: Provider limiter each attempt waits for. A 429 pauses it, so
+            concurrent calls to the same provider back off together.
+
+    Returns:
+        The last response. Non-retryable error responses are returned as-is so
+        the caller can map them to its own errors.
+
+    Raises:
+        RetryDeadlineExceeded: If the deadline passes before a response is received
+        httpx.TimeoutException, httpx.TransportError: If every attempt failed
+    """
+    retry_statuses = frozenset(retry_statuses)
+    expires_at = time.monotonic() + deadline if deadline else None
+    attempts = max(1, max_retries)
+
+    for attempt in range(attempts):
+        remaining = expires_at - time.monotonic() if expires_at else None
+        if remaining is not None and remaining <= 0:
+            raise RetryDeadlineExceeded(f"{label} did not complete within {deadline}s")
+
+        retry_after = None
+        try:
+            if limiter is not None:
+                async with limiter.limit():
+                    response = await send(remaining)
+            else:
+                response = await send(remaining)
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if response.status_code == 429 and limiter is not None:
+                limiter.pause(retry_after if retry_after is not None else base_delay)
+            if response.status_code not in retry_statuses or attempt == attempts - 1:
+                return response
+            logger.warning("%s returned %s, attempt %d/%d",
+                           label, response.status_code, attempt + 1, attempts)
+        except (httpx.TimeoutException, httpx.TransportError) as error:
+            if attempt == attempts - 1:
+                raise
+            logger.warning("%s failed with %s, attempt %d/%d",
+                           label, type(error).__name__, attempt + 1, attempts)
+
+        delay = retry_after if retry_after is not None else backoff_delay(attempt, base_delay, max_delay)
+        delay = min(delay, max_delay)
+        if expires_at is not None and time.monotonic() + delay >= expires_at:
+            raise RetryDeadlineExceeded(
+                f"{label} would exceed its {deadline}s deadline while backing off {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    # Unreachable, the last attempt always returns or raises
+    raise RetryDeadlineExceeded(f"{label} failed after {attempts} attempts")
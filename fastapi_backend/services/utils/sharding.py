@@ -0,0 +1,124 @@
+"""
+Two-level hash-sharded directory layout
+
+Large stores keep each file under <dir>/<ab>/<cd>/<name>, where ab and cd are
+taken from the content hash in the file name (or from a hash of the name for
+other files). No directory holds more than a few hundred entries, so listings
+and lookups stay fast at catalog scale. Public URLs keep the flat form
+(/uploads/models/<name>); ShardedStaticFiles resolves them to the sharded
+path, and falls back to the flat path for files that are not migrated yet.
+"""
+import os
+import re
+import hashlib
+import logging
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+from fastapi.staticfiles import StaticFiles
+
+logger = logging.getLogger(__name__)
+
+# Names starting with a hex digest are sharded on the digest itself
+_HEX_PREFIX = re.compile(r'^[0-9a-f]{4}')
+
+# Shard directories are named with two hex characters
+_SHARD_NAME = re.compile(r'^[0-9a-f]{2}$')
+
+
+def shard_prefix(name: str) -> str:
+    """Return the relative shard directory (e.g. "ab/cd") for a file name"""
+    key = name.lower() if _HEX_PREFIX.match(name.lower()) else hashlib.sha256(name.encode()).hexdigest()
+    return f"{key[:2]}/{key[2:4]}"
+
+
+def sharded_path(directory, name: str) -> Path:
+    """Path of a file in the sharded layout, used for writes"""
+    return Path(directory) / shard_prefix(name) / name
+
+
+def locate(directory, name: str) -> Path:
+    """Path of an existing file, looking in the shard first and then in the flat legacy layout"""
+    path = sharded_path(directory, name)
+    if not path.exists():
+        flat_path = Path(directory) / name
+        if flat_path.exists():
+            return flat_path
+    return path
+
+
+def iter_files(directory) -> Iterator[os.DirEntry]:
+    """Yield the files of a store, both flat and sharded, listing one shard at a time"""
+    try:
+        top = os.scandir(directory)
+    except FileNotFoundError:
+        return
+    with top:
+        for entry in top:
+            if entry.is_file(follow_symlinks=False):
+                yield entry
+            elif entry.is_dir(follow_symlinks=False) and _SHARD_NAME.match(entry.name):
+                with os.scandir(entry.path) as level_one:
+                    for shard in level_one:
+                        if shard.is_dir(follow_symlinks=False) and _SHARD_NAME.match(shard.name):
+                            with os.scandir(shard.path) as files:
+                                yield from (f for f in files if f.is_file(follow_symlinks=False))
+
+
+def migrate_directory(directory, on_move: Optional[Callable[[str, str], None]] = None,
+                      skip: Iterable[str] = ()) -> int:
+    """
+    Move the flat files of a directory into the sharded layout
+
+    Safe to run while the app is serving: readers use locate, which also
+    checks the flat path, and files are moved with an atomic rename.
+
+    Args:
+        directory: Directory to migrate
+        on_move: Called with the old and new path of every moved file
+        skip: File names that stay in place (indexes and similar)
+
+    Returns:
+        Number of files moved
+    """
+    skip = set(skip)
+    moved = 0
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return 0
+    with entries:
+        for entry in entries:
+            if (not entry.is_file(follow_symlinks=False) or entry.name.startswith('.')
+                    or entry.name.endswith(('.tmp', '.part')) or entry.name in skip):
+                continue
+            target = sharded_path(directory, entry.name)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if target.exists():
+                # A newer copy was written to the shard already
+                os.remove(entry.path)
+            else:
+                os.replace(entry.path, target)
+            if on_move:
+                on_move(entry.path, str(target))
+            moved += 1
+    if moved:
+        logger.info(f"Moved {moved} files in {directory} to the sharded layout")
+    return moved
+
+
+class ShardedStaticFiles(StaticFiles):
+    """StaticFiles that serves <subdir>/<name> from <subdir>/<ab>/<cd>/<name> for sharded subdirectories"""
+
+    def __init__(self, *args, sharded_subdirs: Iterable[str] = (), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sharded_subdirs = set(sharded_subdirs)
+
+    def lookup_path(self, path: str) -> Tuple[str, Optional[os.stat_result]]:
+        parts = path.split(os.sep)
+        if len(parts) == 2 and parts[0] in self.sharded_subdirs:
+            full_path, stat_result = super().lookup_path(
+                os.path.join(parts[0], *shard_prefix(parts[1]).split('/'), parts[1]))
+            if stat_result:
+                return full_path, stat_result
+        return super().lookup_path(path)
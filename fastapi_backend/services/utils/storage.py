@@ -1,17 +1,30 @@
 """
 Storage utility for managing virtual try-on results
+
+Result records are rows of a SQLite gallery store shared by the workers, so
+saves and back-fills touch only their own row and gallery pages are indexed
+range queries. Results kept in results.json by earlier versions are imported
+into it once.
 """
 import os
 import json
+import asyncio
 import uuid
-import requests
 from pathlib import Path
-import shutil
 import hashlib
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import Iterator, List, Dict, Any, Optional, Set, Tuple
 import openai
 from dotenv import load_dotenv
+from fastapi_backend.services.utils.rate_limiter import rate_limiters
+from fastapi_backend.services.utils.fetch_cache import fetch_cache
+from fastapi_backend.services.utils.blob_store import blob_store
+from fastapi_backend.services.utils.sharding import sharded_path
+from fastapi_backend.services.utils.async_io import run_io
+from fastapi_backend.services.utils.asset_publisher import asset_publisher
+from fastapi_backend.services.utils.title_worker import TitleWorker, hash_url
+from fastapi_backend.services.utils.derivatives import derivatives, derivative_key
+from fastapi_backend.services.utils.gallery_query import GalleryFilters, GalleryRecord, GalleryStore, to_timestamp
 
 # Load environment variables
 load_dotenv()
@@ -22,42 +35,62 @@ openai_client = None
 if OPENAI_API_KEY:
     openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
 
+DEFAULT_TITLE = "Virtual Try-On Result"
+
+# References to running background saves so they are not garbage collected
+_background_tasks = set()
+
+
 class StorageManager:
-    def __init__(self):
+    def __init__(self, storage_dir: Optional[Path] = None):
         # Define storage paths
         base_dir = Path(__file__).parent.parent.parent
-        self.storage_dir = base_dir / "storage"
+        self.storage_dir = Path(storage_dir) if storage_dir else base_dir / "storage"
         self.images_dir = self.storage_dir / "images"
+        # Results of earlier versions, imported into the database on first use
         self.results_file = self.storage_dir / "results.json"
+        self.results = GalleryStore(self.storage_dir / "results.sqlite3", legacy=self._legacy_results)
         
         # Ensure storage directories exist
         self._ensure_directories_exist()
 
+        # Titles are generated in the background and back-filled into the record
+        self.title_worker = TitleWorker(
+            self.generate_titles,
+            self._set_titles,
+            hash_image=self._hash_output_image,
+            cache_file=self.storage_dir / "titles.json"
+        )
+
     def _ensure_directories_exist(self):
         """Create storage directories if they don't exist"""
         self.storage_dir.mkdir(parents=True, exist_ok=True)
         self.images_dir.mkdir(parents=True, exist_ok=True)
 
-    def _load_results(self) -> List[Dict[str, Any]]:
-        """Load existing results or create empty array"""
-        self._ensure_directories_exist()
-
-        if self.results_file.exists():
-            try:
-                return json.loads(self.results_file.read_text())
-            except Exception as e:
-                print(f"Error loading results: {e}")
-                return []
-        return []
+    @staticmethod
+    def _gallery_record(result: Dict[str, Any]) -> GalleryRecord:
+        metadata = result.get('metadata') or {}
+        return GalleryRecord(
+            id=result.get('id', ''),
+            timestamp=to_timestamp(result.get('timestamp')),
+            data=result,
+            provider=metadata.get('provider'),
+            clothing_type=metadata.get('clothingType'),
+            gender=metadata.get('gender')
+        )
 
-    def _save_results(self, results: List[Dict[str, Any]]):
-        """Save results to file"""
-        self._ensure_directories_exist()
-        
+    def _legacy_results(self) -> Iterator[GalleryRecord]:
+        """Results saved to results.json by earlier versions"""
+        if not self.results_file.exists():
+            return
         try:
-            self.results_file.write_text(json.dumps(results, indent=2))
+            results = json.loads(self.results_file.read_text())
         except Exception as e:
-            print(f"Error saving results: {e}")
+            print(f"Error loading results: {e}")
+            return
+        for result in results:
+            if result.get('id'):
+                yield self._gallery_record(result)
 
     async def download_image(self, url: str) -> Optional[str]:
         """
@@ -73,31 +106,17 @@ class StorageManager:
             return None
             
         try:
-            # Create a hash of the URL to use as the filename
-            url_hash = hashlib.md5(url.encode()).hexdigest()
             extension = url.split('.')[-1]
             if '?' in extension:
                 extension = extension.split('?')[0]
             if not extension or len(extension) > 5:
                 extension = 'jpg'
                 
-            filename = f"{url_hash}.{extension}"
-            filepath = self.images_dir / filename
-            
-            # If the file already exists, return its path
-            if filepath.exists():
-                return str(filepath)
-                
-            # Download the image
-            response = requests.get(url, stream=True)
-            if response.status_code == 200:
-                with open(filepath, 'wb') as f:
-                    response.raw.decode_content = True
-                    shutil.copyfileobj(response.raw, f)
-                return str(filepath)
-            else:
-                print(f"Failed to download image from {url}, status code: {response.status_code}")
-                return None
+            # Download the image through the shared fetch cache and store it
+            # under its content hash, so the same image is kept only once
+            cached = await fetch_cache.fetch(url)
+            return await run_io(
+                blob_store.store_file, str(cached.path), extension.lower(), str(self.images_dir))
         except Exception as e:
             print(f"Error downloading image from {url}: {e}")
             return None
@@ -112,9 +131,28 @@ class StorageManager:
         Returns:
             Generated title for the try-on result
         """
+        return (await self.generate_titles([output_image_url]))[0] or DEFAULT_TITLE
+
+    async def generate_titles(self, output_image_urls: List[str]) -> List[Optional[str]]:
+        """
+        Generate titles for several try-on results in one vision request
+
+        Args:
+            output_image_urls: URLs of the output images
+
+        Returns:
+            One title per image, in the same order, None where no title could be generated
+        """
         if not OPENAI_API_KEY or not openai_client:
-            return "Virtual Try-On Result"
-            
+            return [None] * len(output_image_urls)
+
+        # The OpenAI client is blocking, keep it off the event loop
+        async with rate_limiters.get('openai').limit():
+            return await asyncio.to_thread(self._generate_titles_sync, output_image_urls)
+
+    def _generate_titles_sync(self, output_image_urls: List[str]) -> List[Optional[str]]:
+        """Blocking vision call behind generate_titles"""
+        titles: List[Optional[str]] = [None] * len(output_image_urls)
         try:
             # Call OpenAI API for image description
             response = openai_client.chat.completions.create(
@@ -122,7 +160,8 @@ class StorageManager:
                 messages=[
                     {
                         "role": "system",
-                        "content": "You are a fashion expert. Describe this clothing try-on image in a concise, appealing title (max 10 words) that would work well for a fashion catalog."
+                        "content": "You are a fashion expert. Describe each clothing try-on image in a concise, appealing title (max 10 words) that would work well for a fashion catalog. "
+                                   "Reply with a JSON object {\"titles\": [...]} holding one title per image, in the order the images are given."
                     },
                     {
                         "role": "user",
@@ -130,71 +169,119 @@ class StorageManager:
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": output_image_url
+                                    "url": url
                                 }
                             }
+                            for url in output_image_urls
                         ]
                     }
                 ],
-                max_tokens=50
+                max_tokens=50 * len(output_image_urls),
+                response_format={"type": "json_object"}
             )
             
-            # Extract the generated title from the response
+            # Extract the generated titles from the response
             if response.choices and response.choices[0].message.content:
-                title = response.choices[0].message.content.strip()
-                # Remove quotes if present
-                if title.startswith('"') and title.endswith('"'):
-                    title = title[1:-1]
-                return title
+                generated = json.loads(response.choices[0].message.content).get('titles', [])
+                for index, title in enumerate(generated[:len(titles)]):
+                    title = str(title).strip()
+                    # Remove quotes if present
+                    if title.startswith('"') and title.endswith('"'):
+                        title = title[1:-1]
+                    if title:
+                        titles[index] = title
                 
         except Exception as e:
-            print(f"Error generating title: {e}")
+            print(f"Error generating titles: {e}")
             
-        return "Virtual Try-On Result"
+        return titles
+
+    def _update_result(self, result_id: str, fields: Dict[str, Any]) -> None:
+        """Update fields of a stored result"""
+        if not self.results.update({result_id: fields}):
+            print(f"Result {result_id} not found, skipping update")
+
+    def _update_results(self, updates: Dict[str, Dict[str, Any]]) -> None:
+        """Update fields of several stored results in one transaction"""
+        self.results.update(updates)
+
+    async def _set_titles(self, titles: Dict[str, str]) -> None:
+        """Back-fill generated titles"""
+        await run_io(
+            self._update_results, {result_id: {'title': title} for result_id, title in titles.items()})
+
+    async def resume_titles(self) -> int:
+        """
+        Queue titles for results left with the placeholder title, e.g. by a restart
+
+        Returns:
+            Number of queued results
+        """
+        untitled = [result for result in await run_io(self.results.find, 'title', DEFAULT_TITLE)
+                    if result.get('outputImageUrl')]
+        for result in untitled:
+            self.title_worker.enqueue(result['id'], result['outputImageUrl'])
+        return len(untitled)
 
-    async def save_result(self, result_data: Dict[str, Any]) -> Dict[str, Any]:
+    async def _hash_output_image(self, url: str) -> str:
+        """Key the title cache on the image content, or on the URL if it cannot be fetched"""
+        try:
+            data, _ = await fetch_cache.fetch_bytes(url)
+            return hashlib.sha256(data).hexdigest()
+        except Exception:
+            return await hash_url(url)
+
+    async def _store_images(self, result_id: str, result_data: Dict[str, Any]) -> None:
+        """Download the result images concurrently and record their local paths and thumbnails"""
+        fields = {
+            'modelImagePath': 'modelImageUrl',
+            'clothingImagePath': 'clothingImageUrl',
+            'outputImagePath': 'outputImageUrl'
+        }
+        paths = await asyncio.gather(
+            *[self.download_image(result_data.get(url_key)) for url_key in fields.values()])
+        updates = dict(zip(fields, paths))
+
+        # Gallery previews of the output image
+        output_path = updates['outputImagePath']
+        if output_path:
+            manifest = await derivatives.generate_for_path(
+                output_path, derivative_key(result_data['outputImageUrl']))
+            if manifest:
+                updates['thumbnails'] = manifest['thumbnails']
+                updates['placeholder'] = manifest['placeholder']
+
+        await run_io(self._update_result, result_id, updates)
+
+    async def save_result(self, result_data: Dict[str, Any], result_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Save a try-on result
+
+        The record is persisted straight away. The images are downloaded
+        concurrently in the background and the title is generated by the title
+        worker, both are back-filled into the record when ready.
         
         Args:
             result_data: The result data to save
+            result_id: Deterministic ID under which the result is saved once,
+                later saves return the stored record. Random by default.
             
         Returns:
             The saved result data with additional metadata
         """
         try:
-            # Load existing results
-            results = self._load_results()
-            
             # Generate a unique ID for this result
-            result_id = str(uuid.uuid4())
+            result_id = result_id or str(uuid.uuid4())
             timestamp = datetime.now().isoformat()
             
-            # Download and save images locally
-            model_image_path = None
-            clothing_image_path = None
-            output_image_path = None
-            
-            if 'modelImageUrl' in result_data:
-                model_image_path = await self.download_image(result_data['modelImageUrl'])
-                
-            if 'clothingImageUrl' in result_data:
-                clothing_image_path = await self.download_image(result_data['clothingImageUrl'])
-                
-            if 'outputImageUrl' in result_data:
-                output_image_path = await self.download_image(result_data['outputImageUrl'])
-                
-            # Generate a title for this result
-            title = await self.generate_title(result_data.get('outputImageUrl', ''))
-            
             # Create the result entry
             saved_result = {
                 'id': result_id,
-                'title': title,
+                'title': DEFAULT_TITLE,
                 'timestamp': timestamp,
-                'modelImagePath': model_image_path,
-                'clothingImagePath': clothing_image_path,
-                'outputImagePath': output_image_path,
+                'modelImagePath': None,
+                'clothingImagePath': None,
+                'outputImagePath': None,
                 'modelImageUrl': result_data.get('modelImageUrl', ''),
                 'clothingImageUrl': result_data.get('clothingImageUrl', ''),
                 'outputImageUrl': result_data.get('outputImageUrl', ''),
@@ -204,12 +291,18 @@ class StorageManager:
                     'provider': result_data.get('provider', 'aidge')
                 }
             }
-            
-            # Add this result to the list
-            results.append(saved_result)
-            
-            # Save the updated results
-            self._save_results(results)
+
+            if not await run_io(self.results.insert, self._gallery_record(saved_result)):
+                # Saved before, e.g. by another poll of the same task
+                return await run_io(self.results.get, result_id) or saved_result
+
+            # Download the images and generate the title off the request path
+            task = asyncio.create_task(self._store_images(result_id, result_data))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+            if saved_result['outputImageUrl']:
+                self.title_worker.enqueue(result_id, saved_result['outputImageUrl'])
             
             return saved_result
             
@@ -222,6 +315,48 @@ class StorageManager:
         Get all saved results
         
         Returns:
-            List of all saved results
+            List of all saved results, oldest first
+        """
+        return self.results.all()
+
+    def query_results(self, filters: GalleryFilters, cursor: Optional[str] = None,
+                      limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Get one page of saved results, newest first
+        
+        Args:
+            filters: Filters the results must match
+            cursor: Cursor returned with the previous page, None for the first page
+            limit: Maximum number of results in the page
+            
+        Returns:
+            The page of results and the cursor of the next page, None on the last page
+
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        return self.results.page(filters, cursor, limit)
+
+    def referenced_paths(self) -> Set[str]:
+        """
+        Absolute paths of the local files that saved results still point to
+
+        Used by the retention sweep so referenced images and uploads are kept.
         """
-        return self._load_results()
+        referenced = set()
+        for record in self.results.all():
+            for key in ('modelImagePath', 'clothingImagePath', 'outputImagePath'):
+                if record.get(key):
+                    # Match by file name, the stored path may come from another checkout
+                    # or predate the sharded layout
+                    name = Path(record[key]).name
+                    referenced.add(os.path.abspath(sharded_path(self.images_dir, name)))
+                    referenced.add(os.path.abspath(self.images_dir / name))
+            for key in ('modelImageUrl', 'clothingImageUrl', 'outputImageUrl'):
+                url = record.get(key) or ''
+                if url.startswith('/uploads/'):
+                    try:
+                        referenced.add(os.path.abspath(asset_publisher.local_path(url)))
+                    except ValueError:
+                        continue
+        return referenced
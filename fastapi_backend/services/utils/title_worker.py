@@ -0,0 +1,149 @@
+"""
+Background queue for generating gallery titles
+
+Title generation is a slow vision-model call, so it runs off the request path.
+Saves enqueue the result and the queue back-fills the title once it is ready.
+Queued images are sent to the model in batches by a bounded number of workers,
+and titles are cached by the hash of the output image so identical images are
+only described once. Images the generator could not describe keep their
+placeholder title and are not cached, so a later save tries again. The cache
+keeps the most recent TITLE_CACHE_MAX_ENTRIES titles. The queue lives in
+memory, results still carrying the placeholder title are queued again at
+startup.
+"""
+import os
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from fastapi_backend.services.utils.file_lock import read_json_map, update_json_map
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Images described per model request
+TITLE_BATCH_SIZE = int(os.getenv('TITLE_BATCH_SIZE', '4'))
+
+# Seconds to wait for more queued images before sending a partial batch
+TITLE_BATCH_WINDOW = float(os.getenv('TITLE_BATCH_WINDOW', '0.5'))
+
+# Number of batches generated concurrently
+TITLE_WORKERS = int(os.getenv('TITLE_WORKERS', '2'))
+
+# Titles kept in the cache file, the oldest are dropped first
+TITLE_CACHE_MAX_ENTRIES = int(os.getenv('TITLE_CACHE_MAX_ENTRIES', '10000'))
+
+# Returns one title per URL, None where no title could be generated
+TitleGenerator = Callable[[List[str]], Awaitable[List[Optional[str]]]]
+TitleCallback = Callable[[Dict[str, str]], Awaitable[None]]
+ImageHasher = Callable[[str], Awaitable[str]]
+
+
+async def hash_url(url: str) -> str:
+    """Fallback image key when the content cannot be read"""
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+class TitleWorker:
+    """Generates titles from a queue in batches and hands them to a callback"""
+
+    def __init__(self, generate: TitleGenerator, on_titles: TitleCallback,
+                 hash_image: ImageHasher = hash_url, cache_file: Optional[Path] = None,
+                 batch_size: int = TITLE_BATCH_SIZE, batch_window: float = TITLE_BATCH_WINDOW,
+                 workers: int = TITLE_WORKERS, cache_size: int = TITLE_CACHE_MAX_ENTRIES):
+        self.generate = generate
+        self.on_titles = on_titles
+        self.hash_image = hash_image
+        self.cache_file = Path(cache_file) if cache_file else None
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window
+        self.workers = max(1, workers)
+        self.cache_size = max(1, cache_size)
+
+        self._titles: Dict[str, str] = read_json_map(self.cache_file) if self.cache_file else {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def _save_cache(self, titles: Dict[str, str]) -> None:
+        """Merge new titles into the cache file shared with the other workers"""
+        self._titles = update_json_map(self.cache_file, titles, max_entries=self.cache_size)
+
+    def enqueue(self, result_id: str, output_image_url: str) -> None:
+        """
+        Queue a title for a saved result
+
+        Must be called from the event loop. The workers are started on first use.
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._run()))
+        self._queue.put_nowait((result_id, output_image_url))
+
+    async def _next_batch(self) -> List[Tuple[str, str]]:
+        """Wait for a queued image, then collect more until the batch is full or the window closes"""
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _process(self, batch: List[Tuple[str, str]]) -> None:
+        keys = await asyncio.gather(*[self.hash_image(url) for _, url in batch])
+
+        titles = {}
+        pending: Dict[str, List[str]] = {}
+        urls: Dict[str, str] = {}
+        for (result_id, url), key in zip(batch, keys):
+            if key in self._titles:
+                titles[result_id] = self._titles[key]
+            else:
+                pending.setdefault(key, []).append(result_id)
+                urls[key] = url
+
+        if pending:
+            keys_to_generate = list(pending)
+            generated = await self.generate([urls[key] for key in keys_to_generate])
+            new_titles = {}
+            for key, title in zip(keys_to_generate, generated):
+                if title is None:
+                    # Failed, e.g. the model was unavailable, leave it uncached
+                    continue
+                new_titles[key] = title
+                for result_id in pending[key]:
+                    titles[result_id] = title
+            self._titles.update(new_titles)
+            if self.cache_file and new_titles:
+                await asyncio.to_thread(self._save_cache, new_titles)
+
+        if titles:
+            await self.on_titles(titles)
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._process(batch)
+            except Exception as e:
+                logger.error(f"Error generating titles for {len(batch)} results: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def join(self) -> None:
+        """Wait until every queued title has been processed"""
+        if self._queue is not None:
+            await self._queue.join()
@@ -0,0 +1,240 @@
+"""
+Streaming storage for uploaded images.
+
+Uploads are written to disk in chunks while being hashed, so the request body
+is never held in memory as a whole. Files are named after the SHA-256 of their
+content and kept in the content-addressed blob store, which makes repeated
+uploads of the same image idempotent and stops unrelated uploads that share a
+client filename from overwriting each other.
+"""
+import io
+import os
+import uuid
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Dict, Optional
+
+import aiofiles
+from PIL import Image
+from fastapi import UploadFile
+from dotenv import load_dotenv
+
+from fastapi_backend.services.utils.blob_store import blob_store
+from fastapi_backend.services.utils.async_io import io_executor, run_io
+
+# Load environment variables
+load_dotenv()
+
+# Size of the chunks read from the request body
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+
+# Maximum accepted upload size in bytes (default 20 MB)
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(20 * 1024 * 1024)))
+
+# Maximum accepted image size in pixels (width * height)
+UPLOAD_MAX_PIXELS = int(os.getenv('UPLOAD_MAX_PIXELS', str(50_000_000)))
+
+# File extensions used for the image formats Pillow can identify
+FORMAT_EXTENSIONS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'WEBP': 'webp',
+    'GIF': 'gif',
+    'BMP': 'bmp',
+    'TIFF': 'tiff',
+}
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured byte or pixel limits"""
+
+
+class InvalidImageError(Exception):
+    """Raised when an upload is not a readable image"""
+
+
+async def iter_upload_file(file: UploadFile, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """
+    Iterate over the contents of an uploaded file in chunks
+
+    Args:
+        file: The uploaded file
+        chunk_size: Number of bytes to read per chunk
+
+    Yields:
+        Chunks of the file content
+    """
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _identify_image(path: str) -> Dict[str, Any]:
+    """
+    Read the header of an image file to get its format and dimensions
+
+    Args:
+        path: Path to the image file
+
+    Returns:
+        Dictionary with format, width and height
+
+    Raises:
+        InvalidImageError: If the file is not a readable image
+    """
+    try:
+        # Image.open only parses the header, the pixel data is not decoded
+        with Image.open(path) as img:
+            return {'format': img.format, 'width': img.width, 'height': img.height}
+    except Exception:
+        raise InvalidImageError("Uploaded file is not a valid image")
+
+
+def _check_image_bytes(data: bytes, max_pixels: int) -> None:
+    """Check that encoded image bytes are an image within the pixel limit, decoding only the header"""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+    except Exception:
+        raise InvalidImageError("Uploaded file is not a valid image")
+    if width * height > max_pixels:
+        raise UploadTooLargeError(
+            f"Image is {width}x{height}, which exceeds the maximum of {max_pixels} pixels")
+
+
+async def read_image_upload(file: UploadFile,
+                            max_bytes: Optional[int] = None,
+                            max_pixels: Optional[int] = None) -> bytes:
+    """
+    Read an uploaded image into memory within the byte and pixel limits
+
+    The upload is read in chunks and rejected as soon as it passes max_bytes,
+    and its dimensions are checked from the header before anything decodes it.
+
+    Args:
+        file: The uploaded file
+        max_bytes: Maximum accepted size in bytes (defaults to UPLOAD_MAX_BYTES)
+        max_pixels: Maximum accepted width * height (defaults to UPLOAD_MAX_PIXELS)
+
+    Returns:
+        The encoded image bytes
+
+    Raises:
+        UploadTooLargeError: If the upload exceeds the byte or pixel limits
+        InvalidImageError: If the upload is empty or not an image
+    """
+    max_bytes = max_bytes or UPLOAD_MAX_BYTES
+    max_pixels = max_pixels or UPLOAD_MAX_PIXELS
+
+    chunks = []
+    size = 0
+    async for chunk in iter_upload_file(file):
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLargeError(
+                f"Upload exceeds the maximum size of {max_bytes} bytes")
+        chunks.append(chunk)
+    if size == 0:
+        raise InvalidImageError("Uploaded file is empty")
+
+    data = b''.join(chunks)
+    await asyncio.to_thread(_check_image_bytes, data, max_pixels)
+    return data
+
+
+def _discard(path: str) -> None:
+    """Remove a temporary file if it is still there"""
+    if os.path.exists(path):
+        os.remove(path)
+
+
+async def save_image_stream(chunks: AsyncIterator[bytes],
+                            target_dir: str,
+                            url_prefix: str,
+                            max_bytes: Optional[int] = None,
+                            max_pixels: Optional[int] = None,
+                            sharded: bool = True) -> Dict[str, Any]:
+    """
+    Write an image to disk from a stream of chunks under a content-derived name
+
+    Args:
+        chunks: Async iterator yielding the raw image bytes
+        target_dir: Directory to store the image in
+        url_prefix: Public URL prefix for the directory (e.g. "/uploads/models/")
+        max_bytes: Maximum accepted size in bytes (defaults to UPLOAD_MAX_BYTES)
+        max_pixels: Maximum accepted width * height (defaults to UPLOAD_MAX_PIXELS)
+        sharded: Whether target_dir uses the hash-sharded layout
+
+    Returns:
+        Dictionary with fileUrl, width, height, contentHash and size
+
+    Raises:
+        UploadTooLargeError: If the stream exceeds the byte or pixel limits
+        InvalidImageError: If the stream is empty or not an image
+    """
+    max_bytes = max_bytes or UPLOAD_MAX_BYTES
+    max_pixels = max_pixels or UPLOAD_MAX_PIXELS
+
+    await run_io(os.makedirs, target_dir, exist_ok=True)
+    temp_path = os.path.join(target_dir, f".{uuid.uuid4().hex}.part")
+    hasher = hashlib.sha256()
+    size = 0
+
+    try:
+        async with aiofiles.open(temp_path, 'wb', executor=io_executor) as buffer:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(
+                        f"Upload exceeds the maximum size of {max_bytes} bytes")
+                hasher.update(chunk)
+                await buffer.write(chunk)
+
+        if size == 0:
+            raise InvalidImageError("Uploaded file is empty")
+
+        info = await run_io(_identify_image, temp_path)
+        if info['width'] * info['height'] > max_pixels:
+            raise UploadTooLargeError(
+                f"Image is {info['width']}x{info['height']}, which exceeds the maximum of {max_pixels} pixels")
+
+        content_hash = hasher.hexdigest()
+        extension = FORMAT_EXTENSIONS.get(info['format'], (info['format'] or 'bin').lower())
+
+        # The blob store keeps one copy per content and links it into target_dir
+        file_location = await run_io(
+            blob_store.store_temp, temp_path, content_hash, extension, target_dir, sharded)
+
+        return {
+            'fileUrl': f"{url_prefix}{os.path.basename(file_location)}",
+            'width': info['width'],
+            'height': info['height'],
+            'contentHash': content_hash,
+            'size': size,
+        }
+    finally:
+        await run_io(_discard, temp_path)
+
+
+async def save_upload_file(file: UploadFile,
+                           target_dir: str,
+                           url_prefix: str,
+                           max_bytes: Optional[int] = None,
+                           sharded: bool = True) -> Dict[str, Any]:
+    """
+    Stream an uploaded file to disk under a content-derived name
+
+    Args:
+        file: The uploaded file
+        target_dir: Directory to store the image in
+        url_prefix: Public URL prefix for the directory
+        max_bytes: Maximum accepted size in bytes
+        sharded: Whether target_dir uses the hash-sharded layout
+
+    Returns:
+        Dictionary with fileUrl, width, height, contentHash and size
+    """
+    return await save_image_stream(iter_upload_file(file), target_dir, url_prefix,
+                                   max_bytes=max_bytes, sharded=sharded)
@@ -6,22 +6,31 @@ import json
 import time
 import asyncio
 import base64
-import requests
 from copy import deepcopy
-from typing import Dict, Any, List, Optional
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
 from dotenv import load_dotenv
 from .utils.aidge_api import AidgeApiClient
+from .utils.aidge_batcher import AidgeTryOnBatcher
 from .utils.fashn_api import FashnApiClient
 from .utils.storage import StorageManager
+from .utils.asset_publisher import asset_publisher
+from .utils.fetch_cache import fetch_cache
+from .utils.async_io import read_bytes, run_io
+from .utils.job_registry import COMPLETED, FAILED, PROCESSING, Job, job_id, job_registry
+from .utils.gallery_query import GALLERY_DEFAULT_LIMIT, GalleryFilters, clamp_limit
 import random
 
 # Load environment variables
 load_dotenv()
 
+# Largest garment x model grid accepted by a matrix job
+TRYON_MATRIX_MAX_CELLS = int(os.getenv('TRYON_MATRIX_MAX_CELLS', '200'))
+
 
 class VirtualTryOnService:
     def __init__(self):
         self.aidge_client = AidgeApiClient()
+        self.aidge_batcher = AidgeTryOnBatcher(self.aidge_client)
         self.fashn_client = FashnApiClient()
         self.storage_manager = StorageManager()
         self.fashn_enabled = os.getenv(
@@ -47,7 +56,7 @@ class VirtualTryOnService:
         """
         return path.startswith(('http://', 'https://'))
 
-    def _download_image_to_base64(self, url: str) -> str:
+    async def _download_image_to_base64(self, url: str) -> str:
         """
         Download an image from a URL and convert it to base64.
 
@@ -62,12 +71,9 @@ class VirtualTryOnService:
         """
         try:
             print(f"Downloading image from URL: {url}")
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            image_data = response.content
+            # MIME type comes from the response headers, defaulting to jpeg
+            image_data, content_type = await fetch_cache.fetch_bytes(url)
             base64_data = base64.b64encode(image_data).decode('utf-8')
-            # Determine MIME type from response headers or default to jpeg
-            content_type = response.headers.get('Content-Type', 'image/jpeg')
             return f"data:{content_type};base64,{base64_data}"
         except Exception as e:
             print(f"Error downloading image from URL: {str(e)}")
@@ -134,9 +140,17 @@ class VirtualTryOnService:
 
             # Determine which API to use
             if self._is_fashn_enabled():
-                return await self._submit_try_on_fashn(processed_request_data)
+                response = await self._submit_try_on_fashn(processed_request_data)
             else:
-                return await self._submit_try_on_aidge(processed_request_data)
+                response = await self._submit_try_on_aidge(processed_request_data)
+
+            # Record the paid job so its result is still collected if this worker restarts
+            try:
+                await run_io(job_registry.record, 'tryon', response['provider'], response['taskId'],
+                             processed_request_data)
+            except Exception as error:
+                print(f"Error recording try-on job {response['taskId']}: {str(error)}")
+            return response
         except Exception as error:
             print(f"Error submitting try-on request: {str(error)}")
             raise error
@@ -174,32 +188,66 @@ class VirtualTryOnService:
         else:
             print("No model image provided, using base model only")
 
-        # Prepare the submit request
-        submit_request = {
-            'requestParams': json.dumps(request_params)
+        # Concurrent submissions are coalesced into one Aidge request
+        task_id = await self.aidge_batcher.submit(request_params[0])
+        print(f"Try-on request submitted successfully, task ID: {task_id}")
+        return {
+            'taskId': task_id,
+            'provider': 'aidge'
         }
 
-        # Call the Aidge AI API
-        submit_response = self.aidge_client.invoke_aidge_api(
-            '/ai/virtual/tryon',
-            json.dumps(submit_request)
-        )
+    async def _resolve_fashn_image(self, image: str, label: str) -> str:
+        """
+        Turn a model or garment image reference into something Fashn.ai accepts
 
-        # Extract and return the task ID
-        if (submit_response.get('success') and
-            submit_response.get('data') and
-                submit_response['data'].get('result')):
+        Remote URLs and base64 data are passed through. Local /uploads files are
+        published once and sent as a short URL; base64 encoding is only used if
+        publishing fails.
 
-            task_id = submit_response['data']['result'].get('taskId')
-            print(f"Try-on request submitted successfully, task ID: {task_id}")
-            return {
-                'taskId': task_id,
-                'provider': 'aidge'
-            }
-        else:
-            print(f"Try-on request failed: {submit_response}")
-            raise Exception(submit_response.get(
-                'resMessage', 'Failed to submit try-on request'))
+        Args:
+            image: Remote URL, /uploads path or base64 data URI
+            label: Image role used in messages (model, garment)
+
+        Returns:
+            URL or base64 data URI for the image
+        """
+        if self._is_url(image):
+            # It's a remote URL; assume it's preprocessed and use it as-is
+            print(f"Using remote {label} image URL: {image}")
+            return image
+
+        if image.startswith('/uploads/'):
+            try:
+                published_url = await asset_publisher.publish(image)
+                print(f"Using published {label} image URL: {published_url}")
+                return published_url
+            except FileNotFoundError as e:
+                raise Exception(f"{label.capitalize()} file not found: {str(e)}")
+            except Exception as e:
+                print(f"Error publishing {label} image, sending it inline: {str(e)}")
+
+            try:
+                file_path = asset_publisher.local_path(image)
+                file_bytes = await read_bytes(file_path)
+                return f"data:image/jpeg;base64,{base64.b64encode(file_bytes).decode('utf-8')}"
+            except Exception as e:
+                print(f"Error converting {label} image to base64: {str(e)}")
+                raise Exception(
+                    f'Failed to convert {label} image to base64: {str(e)}')
+
+        if image.startswith('data:'):
+            # Validate base64 format
+            if not image.startswith('data:image/'):
+                print(
+                    f"Invalid base64 format for {label} image: {image[:50]}...")
+                raise ValueError(
+                    f'Invalid base64 format for {label} image. Must start with "data:image/"')
+            print(f"Using base64 {label} image")
+            return image
+
+        print(f"Unrecognized {label} image format: {image[:50]}...")
+        raise ValueError(
+            f"Unrecognized {label} image format. Must be a URL, local path, or base64 data")
 
     async def _submit_try_on_fashn(self, processed_request_data: Dict[str, Any]) -> Dict[str, str]:
         """
@@ -261,86 +309,8 @@ class VirtualTryOnService:
         print(f"Processing model image: {model_image}")
         print(f"Processing garment image: {garment_image}")
 
-        # Handle model image - check if it's a URL, local path, or base64
-        if self._is_url(model_image):
-            # It's a remote URL; assume it's preprocessed and use it as-is
-            print(f"Using remote model image URL: {model_image}")
-        elif model_image.startswith('/uploads/'):
-            try:
-                uploads_dir = os.getenv('UPLOADS_DIR', os.path.join(
-                    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'uploads'))
-                # Split the path and remove the leading 'uploads' from the image path
-                path_parts = model_image.lstrip('/').split('/')
-                if path_parts[0] == 'uploads':
-                    # Remove the first 'uploads' segment
-                    path_parts = path_parts[1:]
-                model_file_path = os.path.join(uploads_dir, *path_parts)
-                print(f"Corrected model image path: {model_file_path}")
-
-                if not os.path.exists(model_file_path):
-                    raise Exception(f"Model file not found: {model_file_path}")
-
-                with open(model_file_path, 'rb') as f:
-                    model_bytes = f.read()
-                    model_base64 = base64.b64encode(
-                        model_bytes).decode('utf-8')
-                    model_image = f"data:image/jpeg;base64,{model_base64}"
-            except Exception as e:
-                print(f"Error converting model image to base64: {str(e)}")
-                raise Exception(
-                    f'Failed to convert model image to base64: {str(e)}')
-        elif model_image.startswith('data:'):
-            # Validate base64 format
-            if not model_image.startswith('data:image/'):
-                print(
-                    f"Invalid base64 format for model image: {model_image[:50]}...")
-                raise ValueError(
-                    'Invalid base64 format for model image. Must start with "data:image/"')
-            print("Using base64 model image")
-        else:
-            print(f"Unrecognized model image format: {model_image[:50]}...")
-            raise ValueError(
-                f"Unrecognized model image format. Must be a URL, local path, or base64 data")
-
-        # Handle garment image - check if it's a URL, local path, or base64
-        if self._is_url(garment_image):
-            # It's a remote URL; assume it's preprocessed and use it as-is
-            print(f"Using remote garment image URL: {garment_image}")
-        elif garment_image.startswith('/uploads/'):
-            try:
-                uploads_dir = os.getenv('UPLOADS_DIR', os.path.join(
-                    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'uploads'))
-                path_parts = garment_image.lstrip('/').split('/')
-                if path_parts[0] == 'uploads':
-                    path_parts = path_parts[1:]
-                garment_file_path = os.path.join(uploads_dir, *path_parts)
-                print(f"Corrected garment image path: {garment_file_path}")
-
-                if not os.path.exists(garment_file_path):
-                    raise Exception(
-                        f"Garment file not found: {garment_file_path}")
-
-                with open(garment_file_path, 'rb') as f:
-                    garment_bytes = f.read()
-                    garment_base64 = base64.b64encode(
-                        garment_bytes).decode('utf-8')
-                    garment_image = f"data:image/jpeg;base64,{garment_base64}"
-            except Exception as e:
-                print(f"Error converting garment image to base64: {str(e)}")
-                raise Exception(
-                    f'Failed to convert garment image to base64: {str(e)}')
-        elif garment_image.startswith('data:'):
-            if not garment_image.startswith('data:image/'):
-                print(
-                    f"Invalid base64 format for garment image: {garment_image[:50]}...")
-                raise ValueError(
-                    'Invalid base64 format for garment image. Must start with "data:image/"')
-            print("Using base64 garment image")
-        else:
-            print(
-                f"Unrecognized garment image format: {garment_image[:50]}...")
-            raise ValueError(
-                f"Unrecognized garment image format. Must be a URL, local path, or base64 data")
+        model_image = await self._resolve_fashn_image(model_image, 'model')
+        garment_image = await self._resolve_fashn_image(garment_image, 'garment')
 
         # Prepare the request data according to Fashn.ai API documentation
         fashn_request = {
@@ -369,7 +339,7 @@ class VirtualTryOnService:
             f"Submitting request to Fashn.ai API: {json.dumps(log_request, indent=2)}")
 
         # Call the fashn.ai API with the correct endpoint
-        fashn_response = self.fashn_client.invoke_fashn_api(
+        fashn_response = await self.fashn_client.invoke_fashn_api(
             '/run', fashn_request)
 
         # Extract and return the prediction ID
@@ -406,13 +376,97 @@ class VirtualTryOnService:
         try:
             # Use the appropriate API based on the provider
             if provider == 'fashn':
-                return await self._query_try_on_results_fashn(task_id)
+                response = await self._query_try_on_results_fashn(task_id)
             else:
-                return await self._query_try_on_results_aidge(task_id)
+                response = await self._query_try_on_results_aidge(task_id)
+
+            await self._record_status(task_id, provider, response)
+            return response
         except Exception as error:
             print(f"Error querying try-on results: {str(error)}")
             raise error
 
+    async def _record_status(self, task_id: str, provider: str, response: Dict[str, Any]) -> Tuple[str, bool]:
+        """
+        Record the outcome of a poll in the job registry
+
+        Every poll of a task, from the /query endpoint or a background follower,
+        goes through here. A job is marked completed only after its images are
+        saved to the gallery, so a failed save or a restart in between leaves it
+        to be polled and saved again.
+
+        Returns:
+            The job state and whether this poll moved the job to it
+        """
+        status = response.get('taskStatus')
+        if status in ('finished', 'completed'):
+            state, result, error = COMPLETED, response.get('images', []), None
+        elif status == 'failed':
+            state, result, error = FAILED, None, response.get('error', 'Unknown error')
+        else:
+            state, result, error = PROCESSING, None, None
+
+        key = job_id('tryon', provider, task_id)
+        try:
+            if state == COMPLETED:
+                job = await run_io(job_registry.get, key)
+                if not job or job.state == COMPLETED:
+                    return COMPLETED, False
+                await self._save_completed(task_id, provider, response, job.request)
+            moved = await run_io(job_registry.transition, key, state, result, error)
+        except Exception as e:
+            print(f"Error recording try-on job status for {task_id}: {str(e)}")
+            return (PROCESSING if state == COMPLETED else state), False
+        return state, moved
+
+    async def _save_completed(self, task_id: str, provider: str, response: Dict[str, Any],
+                              request: Optional[Dict[str, Any]]) -> None:
+        """Save the images of a completed task, keyed by its provider task ID so repeated polls save them once"""
+        request = request or {}
+        clothing = (request.get('clothesList') or [{}])[0]
+        model_images = request.get('modelImage') or ['']
+        for index, image in enumerate(response.get('images', [])):
+            await self.storage_manager.save_result({
+                'modelImageUrl': image.get('modelImageUrl') or model_images[0],
+                'clothingImageUrl': image.get('clothingImageUrl') or clothing.get('imageUrl', ''),
+                'outputImageUrl': image.get('outputImageUrl', ''),
+                'clothingType': clothing.get('type', 'tops'),
+                'gender': request.get('gender', 'female'),
+                'provider': provider
+            }, result_id=f"{provider}-{task_id}-{index}")
+
+    async def _poll_job(self, job: Job) -> str:
+        """Poll a registered try-on job, its images are saved to the gallery once it completes"""
+        if job.provider == 'fashn':
+            response = await self._query_try_on_results_fashn(job.task_id)
+        else:
+            response = await self._query_try_on_results_aidge(job.task_id)
+        state, _ = await self._record_status(job.task_id, job.provider, response)
+        return state
+
+    async def _follow_job(self, task_id: str, provider: str) -> None:
+        """Keep polling a job in the background after its caller stopped waiting"""
+        try:
+            job = await run_io(job_registry.get, job_id('tryon', provider, task_id))
+            if job:
+                job_registry.follow(job, self._poll_job)
+        except Exception as error:
+            print(f"Error following try-on job {task_id}: {str(error)}")
+
+    async def resume_jobs(self) -> int:
+        """
+        Resume polling for try-on jobs left unfinished by a previous run
+
+        Returns:
+            Number of resumed jobs
+        """
+        jobs = await run_io(job_registry.unfinished, 'tryon')
+        for job in jobs:
+            job_registry.follow(job, self._poll_job)
+        if jobs:
+            print(f"Resumed polling for {len(jobs)} unfinished try-on jobs")
+        return len(jobs)
+
     async def _query_try_on_results_aidge(self, task_id: str) -> Dict[str, Any]:
         """
         Query the status of a virtual try-on task using the Aidge API
@@ -429,7 +483,7 @@ class VirtualTryOnService:
         }
 
         # Call the Aidge AI API
-        query_response = self.aidge_client.invoke_aidge_api(
+        query_response = await self.aidge_client.invoke_aidge_api_async(
             '/ai/virtual/tryon/query',
             json.dumps(query_request)
         )
@@ -504,7 +558,7 @@ class VirtualTryOnService:
         """
         # Call the fashn.ai API to get status
         try:
-            status_response = self.fashn_client.get_fashn_api_status(
+            status_response = await self.fashn_client.get_fashn_api_status(
                 prediction_id)
 
             # Log the response for debugging
@@ -684,6 +738,8 @@ class VirtualTryOnService:
 
             # If we get here, the task timed out
             print(f"Try-on timed out after {elapsed_time:.1f} seconds")
+            # The provider is still working on it, collect the result in the background
+            await self._follow_job(task_id, provider)
             return {
                 'taskStatus': 'timeout',
                 'error': 'Try-on timed out',
@@ -694,15 +750,151 @@ class VirtualTryOnService:
             print(f"Error executing try-on: {str(e)}")
             raise Exception(f"Error executing try-on: {str(e)}")
 
-    async def get_gallery_results(self) -> List[Dict[str, Any]]:
+    async def stream_try_on_matrix(self, request_data: Dict[str, Any],
+                                   poll_interval: float = 2,
+                                   timeout: float = 300) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Try every garment on every model and stream the result grid as it fills
+
+        All cells are submitted concurrently, the provider rate limiter keeps
+        the fan-out within the provider budget. Accepted tasks are polled
+        together in one pass per interval, starting while the remaining cells
+        are still being submitted.
+
+        Args:
+            request_data: Try-on request whose clothesList and modelImage lists
+                form the rows and columns of the grid
+            poll_interval: Seconds between polling passes
+            timeout: Seconds from the start after which unfinished cells are reported as timed out
+
+        Yields:
+            Events for the grid:
+            - {"type": "submitted", "garmentIndex", "modelIndex", "taskId", "provider"}
+            - {"type": "result", "garmentIndex", "modelIndex", "images"}
+            - {"type": "error", "garmentIndex", "modelIndex", "error"}
+            - {"type": "done", "completed", "failed", "grid"}
+        """
+        garments = request_data.get('clothesList') or []
+        models = request_data.get('modelImage') or []
+        if not garments or not models:
+            raise ValueError('At least one garment and one model image are required')
+        if len(garments) * len(models) > TRYON_MATRIX_MAX_CELLS:
+            raise ValueError(
+                f"Matrix of {len(garments)}x{len(models)} exceeds the limit of {TRYON_MATRIX_MAX_CELLS} cells")
+
+        grid = [[{'status': 'pending'} for _ in models] for _ in garments]
+
+        async def submit_cell(garment_index: int, model_index: int):
+            cell_request = {
+                **request_data,
+                'clothesList': [garments[garment_index]],
+                'modelImage': [models[model_index]]
+            }
+            try:
+                return garment_index, model_index, await self.submit_try_on(cell_request), None
+            except Exception as error:
+                return garment_index, model_index, None, str(error)
+
+        pending = {}
+        submissions = [
+            asyncio.create_task(submit_cell(g, m))
+            for g in range(len(garments)) for m in range(len(models))
+        ]
+        in_flight = set(submissions)
+
+        try:
+            deadline = time.time() + timeout
+            next_poll = time.time() + poll_interval
+            while (in_flight or pending) and time.time() < deadline:
+                wait = max(0, min(next_poll, deadline) - time.time())
+                if in_flight:
+                    # Report submissions as they are accepted until the next polling pass
+                    done, in_flight = await asyncio.wait(
+                        in_flight, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                    for submission in done:
+                        garment_index, model_index, response, error = submission.result()
+                        cell = grid[garment_index][model_index]
+                        if error:
+                            cell.update({'status': 'failed', 'error': error})
+                            yield {'type': 'error', 'garmentIndex': garment_index, 'modelIndex': model_index, 'error': error}
+                            continue
+                        cell.update({'status': 'processing', 'taskId': response['taskId'], 'provider': response['provider']})
+                        pending[(garment_index, model_index)] = response
+                        yield {'type': 'submitted', 'garmentIndex': garment_index, 'modelIndex': model_index, **response}
+                    if time.time() < next_poll:
+                        continue
+                else:
+                    await asyncio.sleep(wait)
+
+                next_poll = time.time() + poll_interval
+                keys = list(pending)
+                responses = await asyncio.gather(
+                    *[self.query_try_on_results(pending[key]['taskId'], pending[key]['provider']) for key in keys],
+                    return_exceptions=True
+                )
+
+                for (garment_index, model_index), response in zip(keys, responses):
+                    cell = grid[garment_index][model_index]
+                    if isinstance(response, Exception):
+                        # Polling errors are transient, keep the cell pending
+                        print(f"Error polling try-on cell {garment_index},{model_index}: {response}")
+                        continue
+
+                    status = response.get('taskStatus')
+                    if status in ('finished', 'completed'):
+                        images = response.get('images', [])
+                        cell.update({'status': 'completed', 'images': images})
+                        del pending[(garment_index, model_index)]
+                        yield {'type': 'result', 'garmentIndex': garment_index, 'modelIndex': model_index, 'images': images}
+                    elif status == 'failed':
+                        error = response.get('error', 'Unknown error')
+                        cell.update({'status': 'failed', 'error': error})
+                        del pending[(garment_index, model_index)]
+                        yield {'type': 'error', 'garmentIndex': garment_index, 'modelIndex': model_index, 'error': error}
+
+            for (garment_index, model_index), response in pending.items():
+                await self._follow_job(response['taskId'], response['provider'])
+                grid[garment_index][model_index].update({'status': 'timeout', 'error': 'Try-on timed out'})
+                yield {'type': 'error', 'garmentIndex': garment_index, 'modelIndex': model_index, 'error': 'Try-on timed out'}
+            for garment_index, row in enumerate(grid):
+                for model_index, cell in enumerate(row):
+                    if cell['status'] == 'pending':
+                        # Still waiting for the provider to accept the submission
+                        cell.update({'status': 'timeout', 'error': 'Try-on submission timed out'})
+                        yield {'type': 'error', 'garmentIndex': garment_index, 'modelIndex': model_index,
+                               'error': 'Try-on submission timed out'}
+        finally:
+            for submission in submissions:
+                submission.cancel()
+
+        cells = [cell for row in grid for cell in row]
+        yield {
+            'type': 'done',
+            'completed': sum(1 for cell in cells if cell['status'] == 'completed'),
+            'failed': sum(1 for cell in cells if cell['status'] != 'completed'),
+            'grid': grid
+        }
+
+    async def get_gallery_results(self, filters: Optional[GalleryFilters] = None, cursor: Optional[str] = None,
+                                  limit: int = GALLERY_DEFAULT_LIMIT) -> Dict[str, Any]:
         """
-        Get all saved try-on results for the gallery
+        Get one page of saved try-on results for the gallery, newest first
+
+        Args:
+            filters: Filters on provider, clothing type, gender and date range
+            cursor: Cursor returned with the previous page
+            limit: Maximum number of results in the page
 
         Returns:
-            List of saved try-on results
+            Dictionary with the results and the cursor of the next page
+
+        Raises:
+            ValueError: If the cursor is malformed
         """
         try:
-            return self.storage_manager.get_all_results()
+            results, next_cursor = await run_io(
+                self.storage_manager.query_results, filters or GalleryFilters(), cursor, clamp_limit(limit))
+            return {"results": results, "nextCursor": next_cursor}
         except Exception as error:
             print(f"Error getting gallery results: {str(error)}")
             raise error
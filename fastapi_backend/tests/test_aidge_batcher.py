@@ -0,0 +1,86 @@
+"""
+Tests for the Aidge try-on batcher.
+"""
+import os
+import sys
+import json
+import asyncio
+import unittest
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.utils.aidge_batcher import AidgeTryOnBatcher
+
+
+class _FakeClient:
+    def __init__(self, result):
+        self.result = result
+        self.requests = []
+
+    async def invoke_aidge_api_async(self, api_name, data):
+        params = json.loads(json.loads(data)['requestParams'])
+        self.requests.append(params)
+        result = self.result(params) if callable(self.result) else self.result
+        return {'success': True, 'data': {'result': result}}
+
+
+def _params(name):
+    return {'clothesList': [{'imageUrl': f'{name}.jpg'}], 'modelImage': ['model.jpg']}
+
+
+class TestAidgeTryOnBatcher(unittest.TestCase):
+    """Test cases for AidgeTryOnBatcher."""
+
+    def test_concurrent_submissions_share_one_request(self):
+        """Submissions within the window are sent together and split by index."""
+        client = _FakeClient(lambda params: [{'taskId': f't{i}'} for i in range(len(params))])
+        batcher = AidgeTryOnBatcher(client, window=0.01, max_size=10)
+
+        async def run():
+            return await asyncio.gather(*[batcher.submit(_params(i)) for i in range(3)])
+
+        self.assertEqual(asyncio.run(run()), ['t0', 't1', 't2'])
+        self.assertEqual(len(client.requests), 1)
+
+    def test_max_size_splits_batches(self):
+        """Batches never exceed the maximum size."""
+        client = _FakeClient(lambda params: [{'taskId': 't'} for _ in params])
+        batcher = AidgeTryOnBatcher(client, window=0.01, max_size=2)
+
+        async def run():
+            await asyncio.gather(*[batcher.submit(_params(i)) for i in range(5)])
+
+        asyncio.run(run())
+        self.assertEqual([len(params) for params in client.requests], [2, 2, 1])
+
+    def test_shared_task_falls_back_to_single_requests(self):
+        """A single task for a batch is not split, every caller is submitted again on its own."""
+        client = _FakeClient(lambda params: {'taskId': f"t{len(client.requests)}"})
+        batcher = AidgeTryOnBatcher(client, window=0.01)
+
+        async def run():
+            first = await asyncio.gather(batcher.submit(_params('a')), batcher.submit(_params('b')))
+            later = await asyncio.gather(batcher.submit(_params('c')), batcher.submit(_params('d')))
+            return first, later
+
+        first, later = asyncio.run(run())
+        self.assertEqual(len(set(first + later)), 4)
+        self.assertFalse(batcher.batching)
+        # One shared batch request, then one request per submission
+        self.assertEqual([len(params) for params in client.requests], [2, 1, 1, 1, 1])
+
+    def test_failure_reaches_every_caller(self):
+        """A failed batch request fails all of its submissions."""
+        client = _FakeClient(None)
+        batcher = AidgeTryOnBatcher(client, window=0.01)
+
+        async def run():
+            return await asyncio.gather(
+                batcher.submit(_params('a')), batcher.submit(_params('b')), return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(result, Exception) for result in results))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+"""
+Tests for the storage I/O helpers.
+"""
+import os
+import sys
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi_backend.services.utils.async_io import read_bytes, read_json, write_atomic, write_json
+
+
+class TestAsyncIO(unittest.TestCase):
+    """Test cases for the async_io helpers."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_json_round_trip(self):
+        """A JSON file written on the pool reads back unchanged."""
+        path = self.root / "results.json"
+
+        async def run():
+            await write_json(path, {"results": [1, 2]}, indent=2)
+            return await read_json(path)
+
+        self.assertEqual(asyncio.run(run()), {"results": [1, 2]})
+
+    def test_write_replaces_without_leftovers(self):
+        """Overwriting a file leaves only the final content and no temporary files."""
+        path = self.root / "image.bin"
+        write_atomic(path, b"first")
+        write_atomic(path, b"second")
+
+        self.assertEqual(asyncio.run(read_bytes(path)), b"second")
+        self.assertEqual(os.listdir(self.root), ["image.bin"])
+
+    def test_missing_file_raises(self):
+        """Reading a missing JSON file raises instead of returning a default."""
+        with self.assertRaises(FileNotFoundError):
+            asyncio.run(read_json(self.root / "missing.json"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Tests for the content-addressed blob store.
+"""
+import os
+import sys
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi_backend.services.utils.blob_store import BlobStore, hash_bytes
+
+
+class TestBlobStore(unittest.TestCase):
+    """Test cases for BlobStore."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.store = BlobStore(self.root / "blobs")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_same_content_is_stored_once(self):
+        """Identical bytes linked into two directories share one blob."""
+        first = self.store.store_bytes(b"image", "jpg", str(self.root / "models"))
+        second = self.store.store_bytes(b"image", "jpg", str(self.root / "clothing"))
+
+        content_hash = hash_bytes(b"image")
+        self.assertEqual(os.path.basename(first), f"{content_hash}.jpg")
+        self.assertTrue(os.path.samefile(first, second))
+        self.assertEqual(self.store.ref_count(content_hash, "jpg"), 2)
+        self.assertEqual(self.store.stats()['blobs'], 1)
+
+    def test_storing_twice_in_one_place_is_idempotent(self):
+        """Re-storing the same content in the same directory adds no reference."""
+        self.store.store_bytes(b"image", "jpg", str(self.root / "models"))
+        self.store.store_bytes(b"image", "jpg", str(self.root / "models"))
+        self.assertEqual(self.store.ref_count(hash_bytes(b"image"), "jpg"), 1)
+
+    def test_blob_is_deleted_with_its_last_reference(self):
+        """Releasing every link removes the blob and its index entry."""
+        first = self.store.store_bytes(b"image", "png", str(self.root / "models"))
+        second = self.store.store_bytes(b"image", "png", str(self.root / "clothing"))
+        blob_path = self.store.blob_path(hash_bytes(b"image"), "png")
+
+        os.remove(first)
+        self.store.release(first)
+        self.assertTrue(blob_path.exists())
+
+        os.remove(second)
+        self.store.release(second)
+        self.assertFalse(blob_path.exists())
+        self.assertEqual(BlobStore(self.root / "blobs").stats()['blobs'], 0)
+
+    def test_same_content_with_another_extension_is_released(self):
+        """Blobs of the same bytes under different extensions are tracked and removed separately."""
+        jpg = self.store.store_bytes(b"image", "jpg", str(self.root / "models"))
+        png = self.store.store_bytes(b"image", "png", str(self.root / "models"))
+        self.assertEqual(self.store.stats()['blobs'], 2)
+
+        for link in (jpg, png):
+            os.remove(link)
+            self.store.release(link)
+
+        self.assertEqual(self.store.stats()['blobs'], 0)
+        self.assertFalse(self.store.blob_path(hash_bytes(b"image"), "jpg").exists())
+        self.assertFalse(self.store.blob_path(hash_bytes(b"image"), "png").exists())
+
+    def test_json_index_of_earlier_versions_is_imported(self):
+        """Links recorded in the old JSON index are still counted and released."""
+        content_hash = hash_bytes(b"legacy")
+        link = self.root / "models" / f"{content_hash}.jpg"
+        link.parent.mkdir()
+        blob_path = self.store.blob_path(content_hash, "jpg")
+        blob_path.parent.mkdir(parents=True)
+        blob_path.write_bytes(b"legacy")
+        (self.root / "blobs" / "index.json").write_text(json.dumps(
+            {content_hash: {'extension': 'jpg', 'size': 6, 'refs': [str(link)]}}))
+
+        store = BlobStore(self.root / "blobs")
+        self.assertEqual(store.ref_count(content_hash, "jpg"), 1)
+        store.release(str(link))
+        self.assertFalse(blob_path.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
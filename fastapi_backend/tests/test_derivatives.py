@@ -0,0 +1,70 @@
+"""
+Tests for gallery thumbnail derivatives.
+"""
+import os
+import sys
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+from PIL import Image
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi_backend.services.utils.derivatives import DerivativeGenerator
+from fastapi_backend.services.utils.sharding import shard_prefix, sharded_path
+
+
+class TestDerivativeGenerator(unittest.TestCase):
+    """Test cases for DerivativeGenerator."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source = Path(self.temp_dir.name) / "source.png"
+        Image.new('RGB', (500, 800), 'red').save(self.source)
+        self.generator = DerivativeGenerator(Path(self.temp_dir.name) / "thumbnails", widths=[160, 320, 640])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_generates_webp_thumbnails_and_placeholder(self):
+        """Thumbnails are rendered at each width below the original size."""
+        manifest = self.generator.generate(str(self.source), "key")
+
+        self.assertEqual(sorted(manifest['thumbnails']), ['160', '320'])
+        self.assertEqual(manifest['thumbnails']['160'], f"/storage/thumbnails/{shard_prefix('key')}/key/160.webp")
+        with Image.open(sharded_path(self.generator.output_dir, "key") / "320.webp") as thumbnail:
+            self.assertEqual(thumbnail.format, 'WEBP')
+            self.assertEqual(thumbnail.size, (320, 512))
+        self.assertTrue(manifest['placeholder'].startswith("data:image/webp;base64,"))
+
+    def test_existing_derivatives_are_reused(self):
+        """A second run returns the stored manifest without rendering again."""
+        first = self.generator.generate(str(self.source), "key")
+        self.source.unlink()
+        self.assertEqual(self.generator.generate(str(self.source), "key"), first)
+
+    def test_concurrent_requests_share_one_run(self):
+        """Requests for the same key while it renders share a single run."""
+        calls = []
+        generate = self.generator.generate
+
+        def counting_generate(source_path, key):
+            calls.append(key)
+            return generate(source_path, key)
+
+        self.generator.generate = counting_generate
+
+        async def run():
+            return await asyncio.gather(
+                *[self.generator.generate_for_path(str(self.source), "key") for _ in range(5)])
+
+        manifests = asyncio.run(run())
+        self.assertEqual(calls, ["key"])
+        self.assertTrue(all(manifest == manifests[0] for manifest in manifests))
+        self.assertEqual(self.generator._in_flight, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+Tests for the conditional-GET fetch cache.
+"""
+import os
+import sys
+import asyncio
+import tempfile
+import threading
+import unittest
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.utils.fetch_cache import FetchCache, FetchTooLargeError
+
+
+class _Handler(SimpleHTTPRequestHandler):
+    statuses = []
+
+    def send_response(self, code, message=None):
+        self.statuses.append(code)
+        super().send_response(code, message)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestFetchCache(unittest.TestCase):
+    """Test cases for FetchCache."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.site = os.path.join(self.tmp.name, "site")
+        os.makedirs(self.site)
+        for name, size in (("a.jpg", 100), ("b.jpg", 100), ("c.jpg", 100)):
+            with open(os.path.join(self.site, name), "wb") as f:
+                f.write(os.urandom(size))
+
+        _Handler.statuses = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_Handler, directory=self.site))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def _cache(self, **kwargs):
+        return FetchCache(cache_dir=os.path.join(self.tmp.name, "cache"), **kwargs)
+
+    def test_fresh_entries_are_served_from_disk(self):
+        """A fresh entry is returned without contacting the origin."""
+        cache = self._cache()
+        first = asyncio.run(cache.fetch(f"{self.base}/a.jpg"))
+        second = cache.fetch_sync(f"{self.base}/a.jpg")
+        self.assertEqual(first.path, second.path)
+        self.assertEqual(_Handler.statuses, [200])
+
+    def test_stale_entries_are_revalidated(self):
+        """A stale entry is revalidated with a conditional GET."""
+        cache = self._cache(fresh_seconds=0)
+        data, content_type = asyncio.run(cache.fetch_bytes(f"{self.base}/a.jpg"))
+        again, _ = asyncio.run(cache.fetch_bytes(f"{self.base}/a.jpg"))
+        self.assertEqual(data, again)
+        self.assertEqual(content_type, "image/jpeg")
+        self.assertEqual(_Handler.statuses, [200, 304])
+
+    def test_index_survives_restart(self):
+        """Cached entries are reused by a new cache instance."""
+        asyncio.run(self._cache().fetch(f"{self.base}/a.jpg"))
+        self._cache().fetch_sync(f"{self.base}/a.jpg")
+        self.assertEqual(_Handler.statuses, [200])
+
+    def test_lru_eviction(self):
+        """The least recently used file is evicted when over budget."""
+        cache = self._cache(max_bytes=150, in_use_seconds=0)
+        first = cache.fetch_sync(f"{self.base}/a.jpg")
+        second = cache.fetch_sync(f"{self.base}/b.jpg")
+        self.assertFalse(first.path.exists())
+        self.assertTrue(second.path.exists())
+
+    def test_hits_are_kept_over_older_files(self):
+        """A hit counts as a use for eviction, also in a cache started later."""
+        first = self._cache().fetch_sync(f"{self.base}/a.jpg")
+        second = self._cache().fetch_sync(f"{self.base}/b.jpg")
+        os.utime(first.path, (1000, 1000))
+        os.utime(second.path, (2000, 2000))
+
+        cache = self._cache(max_bytes=250, in_use_seconds=0)
+        cache.fetch_sync(f"{self.base}/a.jpg")
+        cache.fetch_sync(f"{self.base}/c.jpg")
+        self.assertTrue(first.path.exists())
+        self.assertFalse(second.path.exists())
+
+    def test_index_writes_are_batched(self):
+        """Misses under budget within the index interval do not rewrite the index."""
+        cache = self._cache(index_interval=60)
+        cache.fetch_sync(f"{self.base}/a.jpg")
+        cache.fetch_sync(f"{self.base}/b.jpg")
+        self.assertEqual(len(self._cache()._entries), 1)
+        cache._save_index()
+        self.assertEqual(len(self._cache()._entries), 2)
+
+    def test_just_stored_file_is_not_evicted(self):
+        """A download larger than the whole budget is still handed to its caller."""
+        cache = self._cache(max_bytes=50, in_use_seconds=0)
+        result = cache.fetch_sync(f"{self.base}/a.jpg")
+        self.assertTrue(result.path.exists())
+
+    def test_oversized_downloads_are_rejected(self):
+        """Files over the size limit are not downloaded into the cache."""
+        cache = self._cache(max_file_bytes=50)
+        with self.assertRaises(FetchTooLargeError):
+            asyncio.run(cache.fetch(f"{self.base}/a.jpg"))
+        with self.assertRaises(FetchTooLargeError):
+            cache.fetch_sync(f"{self.base}/a.jpg")
+        self.assertEqual(os.listdir(cache.cache_dir), [])
+
+    def test_files_in_use_are_not_evicted(self):
+        """A file served within the in-use window survives eviction."""
+        cache = self._cache(max_bytes=150)
+        first = cache.fetch_sync(f"{self.base}/a.jpg")
+        cache.fetch_sync(f"{self.base}/b.jpg")
+        self.assertTrue(first.path.exists())
+
+    def test_eviction_by_another_worker_sticks(self):
+        """A file evicted by one worker is not brought back by another worker's save."""
+        first_worker = self._cache(max_bytes=150, in_use_seconds=0)
+        second_worker = self._cache(max_bytes=150, in_use_seconds=0)
+        evicted = first_worker.fetch_sync(f"{self.base}/a.jpg")
+        second_worker.fetch_sync(f"{self.base}/b.jpg")
+        self.assertFalse(evicted.path.exists())
+
+        first_worker.fetch_sync(f"{self.base}/b.jpg")
+        self.assertNotIn(first_worker._key(f"{self.base}/a.jpg"), first_worker._entries)
+        self.assertEqual(len(self._cache()._entries), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Tests for the cross-process file locks.
+"""
+import os
+import sys
+import json
+import tempfile
+import unittest
+import multiprocessing
+from pathlib import Path
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi_backend.services.utils.file_lock import FileLock, file_lock, update_json_map
+
+
+def _write_keys(path, worker, count):
+    for index in range(count):
+        update_json_map(path, {f"{worker}-{index}": index})
+
+
+def _try_lock(path, queue):
+    lock = FileLock(path)
+    taken = lock.acquire(blocking=False)
+    queue.put(taken)
+    if taken:
+        lock.release()
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), "needs fork")
+class TestFileLock(unittest.TestCase):
+    """Test cases for FileLock and update_json_map."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.context = multiprocessing.get_context('fork')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_concurrent_updates_from_processes_are_all_kept(self):
+        """Entries merged by several processes at once all end up in the file."""
+        path = self.root / "map.json"
+        workers = [self.context.Process(target=_write_keys, args=(path, worker, 25)) for worker in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(len(json.loads(path.read_text())), 100)
+
+    def test_lock_excludes_other_processes(self):
+        """A held lock cannot be taken by another process until it is released."""
+        path = self.root / "shared.lock"
+        queue = self.context.Queue()
+
+        with file_lock(path):
+            child = self.context.Process(target=_try_lock, args=(path, queue))
+            child.start()
+            child.join()
+            self.assertFalse(queue.get())
+
+        child = self.context.Process(target=_try_lock, args=(path, queue))
+        child.start()
+        child.join()
+        self.assertTrue(queue.get())
+
+    def test_lock_is_reentrant_within_a_thread(self):
+        """Nested use of the same lock in one thread does not deadlock."""
+        lock = file_lock(self.root / "nested.lock")
+        with lock:
+            with lock:
+                pass
+        self.assertTrue(lock.acquire(blocking=False))
+        lock.release()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+"""
+Tests for cursor-paginated gallery queries.
+"""
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.utils.gallery_query import GalleryFilters, GalleryRecord, GalleryStore, decode_cursor, encode_cursor
+from services.utils.storage import DEFAULT_TITLE, StorageManager
+
+
+def _result(index, provider='fashn', gender='female'):
+    return {
+        'id': f'r{index}',
+        'timestamp': datetime(2025, 3, 1 + index).isoformat(),
+        'metadata': {'clothingType': 'tops', 'gender': gender, 'provider': provider}
+    }
+
+
+class TestGalleryQuery(unittest.TestCase):
+    """Test cases for gallery pagination."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.storage = StorageManager(Path(self.temp_dir.name))
+        results = [_result(i, provider='aidge' if i % 2 else 'fashn') for i in range(5)]
+        self.storage.results_file.write_text(json.dumps(results))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_cursor_round_trip(self):
+        """Cursors decode to the position they encode and reject garbage."""
+        self.assertEqual(decode_cursor(encode_cursor(12.5, 'abc')), (12.5, 'abc'))
+        with self.assertRaises(ValueError):
+            decode_cursor('not a cursor')
+
+    def test_pages_are_newest_first_and_disjoint(self):
+        """Following the cursor walks every result once, newest first."""
+        page, cursor = self.storage.query_results(GalleryFilters(), limit=2)
+        ids = [result['id'] for result in page]
+        while cursor:
+            page, cursor = self.storage.query_results(GalleryFilters(), cursor, limit=2)
+            ids.extend(result['id'] for result in page)
+        self.assertEqual(ids, ['r4', 'r3', 'r2', 'r1', 'r0'])
+
+    def test_filters(self):
+        """Provider and date range filters are applied server-side."""
+        filters = GalleryFilters(provider='aidge', date_from=datetime(2025, 3, 3))
+        page, cursor = self.storage.query_results(filters, limit=10)
+        self.assertEqual([result['id'] for result in page], ['r3'])
+        self.assertIsNone(cursor)
+
+    def test_legacy_results_are_imported_once(self):
+        """results.json is imported on first use, later changes go to the database only."""
+        self.assertEqual(len(self.storage.get_all_results()), 5)
+        self.storage.results_file.write_text(json.dumps([_result(9)]))
+
+        reopened = StorageManager(Path(self.temp_dir.name))
+        self.assertEqual([result['id'] for result in reopened.get_all_results()],
+                         ['r0', 'r1', 'r2', 'r3', 'r4'])
+
+    def test_updates_keep_the_gallery_position(self):
+        """Back-filling fields of a result changes its data but not its place in the gallery."""
+        self.storage._update_results({'r2': {'title': 'Red top'}, 'missing': {'title': 'x'}})
+        page, _ = self.storage.query_results(GalleryFilters(), limit=5)
+        self.assertEqual([result['id'] for result in page], ['r4', 'r3', 'r2', 'r1', 'r0'])
+        self.assertEqual(page[2]['title'], 'Red top')
+
+    def test_results_saved_under_one_id_are_stored_once(self):
+        """Saving a result again under its deterministic ID returns the stored record."""
+        async def save_twice():
+            first = await self.storage.save_result({'provider': 'aidge'}, result_id='aidge-t1-0')
+            second = await self.storage.save_result({'provider': 'fashn'}, result_id='aidge-t1-0')
+            return first, second
+
+        first, second = asyncio.run(save_twice())
+        self.assertEqual(second, first)
+        ids = [result['id'] for result in self.storage.get_all_results()]
+        self.assertEqual(ids.count('aidge-t1-0'), 1)
+
+    def test_untitled_results_are_queued_again(self):
+        """Results left with the placeholder title are queued for a title at startup."""
+        self.storage._update_results({
+            'r1': {'title': DEFAULT_TITLE, 'outputImageUrl': 'http://example.com/r1.jpg'},
+            'r2': {'title': 'Red top', 'outputImageUrl': 'http://example.com/r2.jpg'},
+            'r3': {'title': DEFAULT_TITLE, 'outputImageUrl': ''}
+        })
+        queued = []
+        self.storage.title_worker.enqueue = lambda result_id, url: queued.append((result_id, url))
+
+        self.assertEqual(asyncio.run(self.storage.resume_titles()), 1)
+        self.assertEqual(queued, [('r1', 'http://example.com/r1.jpg')])
+
+    def test_store_keeps_the_first_timestamp(self):
+        """Records are ordered by the timestamp they were first stored with, not by later saves."""
+        store = GalleryStore(Path(self.temp_dir.name) / "records.sqlite3")
+        for index in range(4):
+            store.put(GalleryRecord(f'g{index}', 1000 + index, {'id': f'g{index}'}, clothing_type='Casual'))
+        store.put(GalleryRecord('g1', 5000, {'id': 'g1', 'thumbnails': True}, clothing_type='Casual'))
+
+        page, cursor = store.page(GalleryFilters(), encode_cursor(1002, 'g2'), 10)
+        self.assertEqual([record['id'] for record in page], ['g1', 'g0'])
+        self.assertTrue(page[0]['thumbnails'])
+        self.assertIsNone(cursor)
+
+        page, _ = store.page(GalleryFilters(clothing_type='casual'), None, 2)
+        self.assertEqual([record['id'] for record in page], ['g3', 'g2'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+"""
+Tests for the idempotency key store.
+"""
+import os
+import sys
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi_backend.services.utils.idempotency import (
+    IdempotencyConflictError, IdempotencyInProgressError, IdempotencyStore, request_fingerprint
+)
+
+
+class TestIdempotencyStore(unittest.TestCase):
+    """Test cases for IdempotencyStore."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name) / "idempotency.sqlite3"
+        self.store = IdempotencyStore(self.path, wait_seconds=1, poll_interval=0.01)
+        self.calls = 0
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    async def _submit(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return {"taskId": f"task-{self.calls}"}
+
+    def test_replay_returns_original_response(self):
+        """A retry with the same key gets the first response without submitting again."""
+        async def run():
+            first = await self.store.run("submit", "key-1", {"a": 1}, self._submit)
+            second = await self.store.run("submit", "key-1", {"a": 1}, self._submit)
+            return first, second
+
+        first, second = asyncio.run(run())
+        self.assertEqual(first, ({"taskId": "task-1"}, False))
+        self.assertEqual(second, ({"taskId": "task-1"}, True))
+        self.assertEqual(self.calls, 1)
+
+    def test_concurrent_duplicates_are_coalesced(self):
+        """Duplicates arriving while the first request runs share its response."""
+        async def run():
+            return await asyncio.gather(
+                *[self.store.run("submit", "key-1", {"a": 1}, self._submit) for _ in range(5)])
+
+        results = asyncio.run(run())
+        self.assertEqual(self.calls, 1)
+        self.assertEqual({result["taskId"] for result, _ in results}, {"task-1"})
+        self.assertEqual(sum(1 for _, replayed in results if not replayed), 1)
+
+    def test_cancelled_original_does_not_cancel_duplicates(self):
+        """A duplicate still gets the response when the original caller goes away."""
+        async def run():
+            original = asyncio.create_task(self.store.run("submit", "key-1", {"a": 1}, self._submit))
+            await asyncio.sleep(0)
+            duplicate = asyncio.create_task(self.store.run("submit", "key-1", {"a": 1}, self._submit))
+            await asyncio.sleep(0)
+            original.cancel()
+            result = await duplicate
+            replay = await self.store.run("submit", "key-1", {"a": 1}, self._submit)
+            return original.cancelled(), result, replay
+
+        cancelled, result, replay = asyncio.run(run())
+        self.assertTrue(cancelled)
+        self.assertEqual(result, ({"taskId": "task-1"}, True))
+        self.assertEqual(replay, ({"taskId": "task-1"}, True))
+        self.assertEqual(self.calls, 1)
+
+    def test_key_reused_with_different_request_is_rejected(self):
+        """A key cannot be replayed for a request with another body."""
+        async def run():
+            await self.store.run("submit", "key-1", {"a": 1}, self._submit)
+            await self.store.run("submit", "key-1", {"a": 2}, self._submit)
+
+        with self.assertRaises(IdempotencyConflictError):
+            asyncio.run(run())
+
+    def test_failures_are_not_kept(self):
+        """A failed request releases its key so a retry runs again."""
+        async def fail():
+            raise RuntimeError("provider down")
+
+        async def run():
+            with self.assertRaises(RuntimeError):
+                await self.store.run("submit", "key-1", {"a": 1}, fail)
+            return await self.store.run("submit", "key-1", {"a": 1}, self._submit)
+
+        self.assertEqual(asyncio.run(run()), ({"taskId": "task-1"}, False))
+
+    def test_waits_for_request_in_another_worker(self):
+        """A duplicate waits for the original request held by another store on the same file."""
+        fingerprint = request_fingerprint({"a": 1})
+        other_worker = IdempotencyStore(self.path)
+        self.assertEqual(other_worker.begin("submit", "key-1", fingerprint), (None, None))
+
+        async def run():
+            waiting = asyncio.ensure_future(self.store.run("submit", "key-1", {"a": 1}, self._submit))
+            await asyncio.sleep(0.05)
+            other_worker.complete("submit", "key-1", {"taskId": "other"})
+            return await waiting
+
+        self.assertEqual(asyncio.run(run()), ({"taskId": "other"}, True))
+        self.assertEqual(self.calls, 0)
+
+        other_worker.begin("submit", "key-2", fingerprint)
+        with self.assertRaises(IdempotencyInProgressError):
+            asyncio.run(self.store.run("submit", "key-2", {"a": 1}, self._submit))
+
+
+if __name__ == '__main__':
+    unittest.main()
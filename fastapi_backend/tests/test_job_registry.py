@@ -0,0 +1,131 @@
+"""
+Tests for the durable job registry.
+"""
+import os
+import sys
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi_backend.services.utils.job_registry import (
+    COMPLETED, EXPIRED, FAILED, PROCESSING, SUBMITTED, JobRegistry, job_id
+)
+
+
+class TestJobRegistry(unittest.TestCase):
+    """Test cases for JobRegistry."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name) / "jobs.sqlite3"
+        self.registry = JobRegistry(self.path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_record_is_idempotent(self):
+        """Recording the same task twice keeps the first record and its request."""
+        first = self.registry.record("tryon", "fashn", "abc", {"gender": "female"})
+        second = self.registry.record("tryon", "fashn", "abc", {"gender": "male"})
+
+        self.assertEqual(first.id, job_id("tryon", "fashn", "abc"))
+        self.assertEqual(second.state, SUBMITTED)
+        self.assertEqual(second.request, {"gender": "female"})
+
+    def test_terminal_states_are_final(self):
+        """A completed job cannot be moved back to processing or failed."""
+        job = self.registry.record("generation", "leonardo", "g1")
+
+        self.assertTrue(self.registry.transition(job.id, PROCESSING))
+        self.assertTrue(self.registry.transition(job.id, COMPLETED, result=[{"url": "a"}]))
+        self.assertFalse(self.registry.transition(job.id, PROCESSING))
+        self.assertFalse(self.registry.transition(job.id, FAILED, error="late"))
+
+        stored = self.registry.get(job.id)
+        self.assertEqual(stored.state, COMPLETED)
+        self.assertEqual(stored.result, [{"url": "a"}])
+        self.assertIsNone(stored.error)
+
+    def test_unfinished_survives_reopen(self):
+        """Jobs that were in flight are found again by a new registry on the same file."""
+        done = self.registry.record("tryon", "aidge", "t1")
+        self.registry.record("tryon", "aidge", "t2")
+        self.registry.record("generation", "leonardo", "g1")
+        self.registry.transition(done.id, FAILED, error="boom")
+
+        reopened = JobRegistry(self.path)
+        self.assertEqual([job.task_id for job in reopened.unfinished("tryon")], ["t2"])
+        self.assertEqual(len(reopened.unfinished()), 2)
+
+    def test_lease_is_held_by_one_worker(self):
+        """Only one worker holds the lease on a job until it runs out."""
+        job = self.registry.record("tryon", "fashn", "abc")
+
+        self.assertTrue(self.registry.claim(job.id, lease=60, owner="worker-1"))
+        self.assertTrue(self.registry.claim(job.id, lease=60, owner="worker-1"))
+        self.assertFalse(self.registry.claim(job.id, lease=60, owner="worker-2"))
+
+        # An expired lease can be taken over
+        self.assertTrue(self.registry.claim(job.id, lease=-1, owner="worker-1"))
+        self.assertTrue(self.registry.claim(job.id, lease=60, owner="worker-2"))
+
+        self.registry.transition(job.id, COMPLETED)
+        self.assertFalse(self.registry.claim(job.id, lease=60, owner="worker-2"))
+
+    def test_follow_polls_until_terminal(self):
+        """A followed job is polled until the poller reports a terminal state."""
+        job = self.registry.record("tryon", "fashn", "abc")
+        states = [PROCESSING, PROCESSING, COMPLETED]
+        polled = []
+
+        async def poll(polled_job):
+            polled.append(polled_job.task_id)
+            state = states[len(polled) - 1]
+            self.registry.transition(polled_job.id, state)
+            return state
+
+        async def run():
+            self.registry.follow(job, poll, interval=0)
+            # Following the same job again is ignored
+            self.registry.follow(job, poll, interval=0)
+            await asyncio.gather(*self.registry._tasks)
+
+        asyncio.run(run())
+        self.assertEqual(polled, ["abc", "abc", "abc"])
+        self.assertEqual(self.registry.get(job.id).state, COMPLETED)
+
+    def test_follow_expires_old_jobs(self):
+        """Jobs older than the maximum age are marked expired without polling."""
+        job = self.registry.record("generation", "leonardo", "g1")
+
+        async def poll(polled_job):
+            raise AssertionError("expired jobs are not polled")
+
+        async def run():
+            self.registry.follow(job, poll, interval=0, max_age=-1)
+            await asyncio.gather(*self.registry._tasks)
+
+        asyncio.run(run())
+        self.assertEqual(self.registry.get(job.id).state, EXPIRED)
+
+    def test_prune_deletes_old_finished_jobs(self):
+        """Only finished jobs past the retention age are deleted."""
+        old_done = self.registry.record("tryon", "fashn", "old")
+        self.registry.record("tryon", "fashn", "running")
+        recent_done = self.registry.record("tryon", "fashn", "recent")
+        self.registry.transition(old_done.id, COMPLETED)
+        self.registry.transition(recent_done.id, FAILED, error="boom")
+        with self.registry._connect() as conn:
+            conn.execute('UPDATE jobs SET updated_at = 0 WHERE task_id IN (?, ?)', ("old", "running"))
+
+        self.assertEqual(self.registry.prune(max_age=3600), 1)
+        self.assertIsNone(self.registry.get(old_done.id))
+        self.assertEqual(sorted(job.task_id for job in self.registry.unfinished()), ["running"])
+        self.assertEqual(self.registry.get(recent_done.id).state, FAILED)
+
+
+if __name__ == '__main__':
+    unittest.main()
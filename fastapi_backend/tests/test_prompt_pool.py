@@ -0,0 +1,103 @@
+"""
+Tests for the background prompt pool.
+"""
+import os
+import sys
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services import prompt_pool
+from services.prompt_pool import PromptPool, attributes_key
+
+
+class _CountingGenerator:
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, attributes, count):
+        self.calls += 1
+        await asyncio.sleep(0)
+        return [f"prompt {self.calls}-{i}" for i in range(count)]
+
+
+class TestPromptPool(unittest.TestCase):
+    """Test cases for PromptPool."""
+
+    def test_equivalent_attributes_share_key(self):
+        """Case, whitespace and list order do not change the cache key."""
+        first, _ = attributes_key({"productType": "Dress ", "colors": ["Red", "blue"], "extra": 1})
+        second, _ = attributes_key({"productType": "dress", "colors": ["BLUE", "red"]})
+        self.assertEqual(first, second)
+
+    def test_hits_rotate_without_generating(self):
+        """Repeated requests rotate through the pool with one generator call."""
+        generator = _CountingGenerator()
+        pool = PromptPool(generator, batch_size=8)
+
+        async def run():
+            first = await pool.get_prompts({"productType": "dress"}, 4)
+            second = await pool.get_prompts({"productType": "Dress"}, 4)
+            return first, second
+
+        first, second = asyncio.run(run())
+        self.assertEqual(generator.calls, 1)
+        self.assertEqual(len(first), 4)
+        self.assertFalse(set(first) & set(second))
+
+    def test_concurrent_misses_are_coalesced(self):
+        """Concurrent misses for the same attributes share one generator call."""
+        generator = _CountingGenerator()
+        pool = PromptPool(generator, batch_size=4)
+
+        async def run():
+            return await asyncio.gather(
+                *[pool.get_prompts({"style": "boho"}, 2) for _ in range(5)])
+
+        results = asyncio.run(run())
+        self.assertEqual(generator.calls, 1)
+        self.assertTrue(all(len(prompts) == 2 for prompts in results))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        """The pool keeps at most max_entries attribute sets, dropping the least recently used."""
+        generator = _CountingGenerator()
+        pool = PromptPool(generator, batch_size=2, max_entries=2)
+
+        async def run():
+            await pool.get_prompts({"style": "boho"}, 1)
+            await pool.get_prompts({"style": "classic"}, 1)
+            await pool.get_prompts({"style": "boho"}, 1)
+            await pool.get_prompts({"style": "sporty"}, 1)
+
+        asyncio.run(run())
+        self.assertEqual(pool.take({"style": "classic"}, 1), None)
+        self.assertIsNotNone(pool.take({"style": "boho"}, 1))
+        self.assertIsNotNone(pool.take({"style": "sporty"}, 1))
+
+    def test_changes_are_written_in_batches(self):
+        """Misses within the save delay share one write, which drops evicted entries from the file."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pool_file = Path(temp_dir) / "prompt_pool.json"
+            pool = PromptPool(_CountingGenerator(), pool_file=pool_file, batch_size=2,
+                              max_entries=2, save_delay=0.01)
+
+            async def run():
+                for style in ("boho", "classic", "sporty"):
+                    await pool.get_prompts({"style": style}, 1)
+                await pool._save_task
+
+            with mock.patch.object(prompt_pool, "update_json_map", wraps=prompt_pool.update_json_map) as update:
+                asyncio.run(run())
+            self.assertEqual(update.call_count, 1)
+
+            reloaded = PromptPool(_CountingGenerator(), pool_file=pool_file)
+            self.assertIsNone(reloaded.take({"style": "boho"}, 1))
+            self.assertIsNotNone(reloaded.take({"style": "sporty"}, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
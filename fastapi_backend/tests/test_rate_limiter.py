@@ -0,0 +1,69 @@
+"""
+Tests for the per-provider rate limiter.
+"""
+import os
+import sys
+import time
+import asyncio
+import unittest
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.utils.rate_limiter import ProviderLimiter
+
+
+class TestProviderLimiter(unittest.TestCase):
+    """Test cases for ProviderLimiter."""
+
+    def test_burst_then_rate(self):
+        """Calls beyond the burst are spaced out at the configured rate."""
+        limiter = ProviderLimiter("test", rate=20, burst=2, max_concurrency=10)
+        starts = []
+
+        async def call():
+            async with limiter.limit():
+                starts.append(time.monotonic())
+
+        async def run():
+            begin = time.monotonic()
+            await asyncio.gather(*[call() for _ in range(4)])
+            return begin
+
+        begin = asyncio.run(run())
+        # Two calls pass immediately, the other two wait 50ms each
+        self.assertLess(starts[1] - begin, 0.03)
+        self.assertGreaterEqual(starts[3] - begin, 0.09)
+        self.assertEqual(limiter.stats()["throttled"], 2)
+
+    def test_concurrency_budget(self):
+        """No more than max_concurrency calls run at once."""
+        limiter = ProviderLimiter("test", rate=0, burst=1, max_concurrency=2)
+        running = []
+        peak = []
+
+        async def call():
+            async with limiter.limit():
+                running.append(1)
+                peak.append(len(running))
+                await asyncio.sleep(0.01)
+                running.pop()
+
+        async def run():
+            await asyncio.gather(*[call() for _ in range(6)])
+
+        asyncio.run(run())
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(limiter.stats()["requests"], 6)
+
+    def test_pause_holds_back_callers(self):
+        """A pause after a 429 delays the next call."""
+        limiter = ProviderLimiter("test", rate=100, burst=5, max_concurrency=5)
+        limiter.pause(0.05)
+        start = time.monotonic()
+        limiter.throttle()
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+        self.assertEqual(limiter.stats()["rateLimited"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+Tests for the retention sweeper.
+"""
+import os
+import sys
+import time
+import tempfile
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi_backend.services.utils.blob_store import BlobStore
+from fastapi_backend.services.utils.retention import RetentionPolicy, RetentionSweeper
+
+
+class TestRetentionSweeper(unittest.TestCase):
+    """Test cases for RetentionSweeper."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.references = set()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _file(self, name, size=100, age_days=0):
+        path = self.root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'x' * size)
+        mtime = time.time() - age_days * 86400
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def _sweeper(self, **limits):
+        policy = RetentionPolicy(name='test', directory=self.root, **limits)
+        return RetentionSweeper([policy], references=lambda: self.references, batch_size=2, grace_seconds=60)
+
+    def test_age_policy_keeps_referenced_and_recent_files(self):
+        """Old unreferenced files are removed, referenced and fresh files are kept."""
+        old = self._file("old.jpg", age_days=10)
+        referenced = self._file("referenced.jpg", age_days=10)
+        fresh = self._file("aa/fresh.jpg")
+        self.references.add(os.path.abspath(referenced))
+
+        self._sweeper(max_age_days=7).sweep()
+
+        self.assertFalse(old.exists())
+        self.assertTrue(referenced.exists())
+        self.assertTrue(fresh.exists())
+
+    def test_size_policy_removes_oldest_first(self):
+        """A directory over budget loses its oldest files until it fits."""
+        files = [self._file(f"{index}.jpg", size=100, age_days=5 - index) for index in range(5)]
+
+        sweeper = self._sweeper(max_bytes=250)
+        sweeper.sweep()
+
+        self.assertEqual([path.exists() for path in files], [False, False, False, True, True])
+        self.assertEqual(sweeper.stats()['test']['lastBytes'], 200)
+
+    def test_steps_are_bounded(self):
+        """A sweep over more entries than the batch size takes several steps."""
+        for index in range(5):
+            self._file(f"{index}.jpg")
+        sweeper = self._sweeper()
+        steps = 1
+        while not sweeper.step():
+            steps += 1
+        self.assertEqual(steps, 3)
+
+    def test_new_link_to_old_blob_is_kept(self):
+        """A fresh link to a blob stored long ago is aged by its own creation time."""
+        store = BlobStore(self.root / "blobs")
+        old = store.store_bytes(b"image", "jpg", str(self.root / "uploads" / "models"))
+        mtime = time.time() - 10 * 86400
+        os.utime(old, (mtime, mtime))
+        fresh = store.store_bytes(b"image", "jpg", str(self.root / "uploads" / "clothing"))
+        with store._connect() as conn:
+            conn.execute('UPDATE refs SET created_at = ? WHERE path = ?', (mtime, old))
+
+        policy = RetentionPolicy(name='test', directory=self.root / "uploads", max_age_days=7)
+        RetentionSweeper([policy], references=set, grace_seconds=60, on_remove=store.release,
+                         created_at=store.link_created_at).sweep()
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(fresh))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Tests for the async retry engine.
+"""
+import os
+import sys
+import time
+import asyncio
+import unittest
+
+import httpx
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.utils.retry import (
+    request_with_retry,
+    parse_retry_after,
+    RetryDeadlineExceeded
+)
+
+
+def _sender(responses):
+    calls = []
+
+    async def send(remaining):
+        calls.append(remaining)
+        result = responses[len(calls) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return send, calls
+
+
+class TestRetry(unittest.TestCase):
+    """Test cases for request_with_retry."""
+
+    def test_parse_retry_after(self):
+        """Retry-After accepts seconds and ignores garbage."""
+        self.assertEqual(parse_retry_after("3"), 3.0)
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertIsNone(parse_retry_after(None))
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+
+    def test_retries_until_success_honouring_retry_after(self):
+        """A 429 with Retry-After is retried after the given delay."""
+        send, calls = _sender([
+            httpx.Response(429, headers={"Retry-After": "0.05"}),
+            httpx.Response(200, json={"id": "abc"}),
+        ])
+        start = time.monotonic()
+        response = asyncio.run(request_with_retry(send, "test"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 2)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_transport_errors_are_retried(self):
+        """Timeouts are retried and the last one is raised."""
+        error = httpx.ReadTimeout("slow")
+        send, calls = _sender([error, error])
+        with self.assertRaises(httpx.ReadTimeout):
+            asyncio.run(request_with_retry(send, "test", max_retries=2, base_delay=0.01))
+        self.assertEqual(len(calls), 2)
+
+    def test_client_errors_are_returned(self):
+        """Non-retryable responses are returned without retrying."""
+        send, calls = _sender([httpx.Response(400)])
+        response = asyncio.run(request_with_retry(send, "test"))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(calls), 1)
+
+    def test_deadline_stops_backoff(self):
+        """A Retry-After past the deadline fails fast instead of sleeping."""
+        send, calls = _sender([httpx.Response(503, headers={"Retry-After": "30"})] * 3)
+        start = time.monotonic()
+        with self.assertRaises(RetryDeadlineExceeded):
+            asyncio.run(request_with_retry(send, "test", deadline=1))
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(len(calls), 1)
+
+    def test_backoff_does_not_block_other_tasks(self):
+        """Other coroutines keep running while a call backs off."""
+        send, _ = _sender([
+            httpx.Response(429, headers={"Retry-After": "0.1"}),
+            httpx.Response(200),
+        ])
+        ticks = []
+
+        async def ticker():
+            for _ in range(5):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        async def run():
+            await asyncio.gather(request_with_retry(send, "test"), ticker())
+
+        asyncio.run(run())
+        self.assertEqual(len(ticks), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
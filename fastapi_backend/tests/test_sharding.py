@@ -0,0 +1,72 @@
+"""
+Tests for the hash-sharded directory layout.
+"""
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from starlette.applications import Starlette
+from starlette.testclient import TestClient
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi_backend.services.utils.sharding import (
+    ShardedStaticFiles,
+    locate,
+    migrate_directory,
+    shard_prefix,
+    sharded_path
+)
+
+
+class TestSharding(unittest.TestCase):
+    """Test cases for the sharded layout."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        (self.root / "models").mkdir()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_hash_named_files_shard_on_their_digest(self):
+        """Content-hashed names use their own prefix, other names are hashed."""
+        self.assertEqual(shard_prefix("abcdef0123.jpg"), "ab/cd")
+        self.assertRegex(shard_prefix("photo.jpg"), r"^[0-9a-f]{2}/[0-9a-f]{2}$")
+
+    def test_migration_moves_flat_files(self):
+        """Flat files move into their shard and stay locatable throughout."""
+        flat = self.root / "models" / "photo.jpg"
+        flat.write_bytes(b"image")
+        self.assertEqual(locate(self.root / "models", "photo.jpg"), flat)
+
+        moves = []
+        self.assertEqual(migrate_directory(self.root / "models", on_move=lambda old, new: moves.append(new)), 1)
+
+        target = sharded_path(self.root / "models", "photo.jpg")
+        self.assertFalse(flat.exists())
+        self.assertEqual(target.read_bytes(), b"image")
+        self.assertEqual(locate(self.root / "models", "photo.jpg"), target)
+        self.assertEqual(moves, [str(target)])
+
+    def test_static_files_serve_flat_urls(self):
+        """Flat URLs are served from the shard, and from the flat path before migration."""
+        sharded = sharded_path(self.root / "models", "new.jpg")
+        sharded.parent.mkdir(parents=True)
+        sharded.write_bytes(b"sharded")
+        (self.root / "models" / "old.jpg").write_bytes(b"flat")
+
+        app = Starlette()
+        app.mount("/uploads", ShardedStaticFiles(directory=str(self.root), sharded_subdirs=["models"]))
+        client = TestClient(app)
+
+        self.assertEqual(client.get("/uploads/models/new.jpg").content, b"sharded")
+        self.assertEqual(client.get("/uploads/models/old.jpg").content, b"flat")
+        self.assertEqual(client.get("/uploads/models/missing.jpg").status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Tests for the background title worker.
+"""
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.utils.title_worker import TitleWorker
+
+
+class TestTitleWorker(unittest.TestCase):
+    """Test cases for TitleWorker."""
+
+    def setUp(self):
+        self.calls = []
+        self.titles = {}
+
+    async def _generate(self, urls):
+        self.calls.append(list(urls))
+        return [f"title {url}" for url in urls]
+
+    async def _on_titles(self, titles):
+        self.titles.update(titles)
+
+    def test_queued_images_are_batched(self):
+        """Images queued within the window are described in one call."""
+        worker = TitleWorker(self._generate, self._on_titles, batch_size=4, batch_window=0.05, workers=1)
+
+        async def run():
+            for i in range(3):
+                worker.enqueue(f"r{i}", f"img{i}.jpg")
+            await worker.join()
+
+        asyncio.run(run())
+        self.assertEqual(self.calls, [["img0.jpg", "img1.jpg", "img2.jpg"]])
+        self.assertEqual(self.titles["r1"], "title img1.jpg")
+
+    def test_cache_file_keeps_the_newest_titles(self):
+        """The title cache drops its oldest entries beyond its size."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache_file = Path(temp_dir) / "titles.json"
+            worker = TitleWorker(self._generate, self._on_titles, cache_file=cache_file,
+                                 batch_size=1, batch_window=0, workers=1, cache_size=2)
+
+            async def run():
+                for i in range(3):
+                    worker.enqueue(f"r{i}", f"img{i}.jpg")
+                    await worker.join()
+
+            asyncio.run(run())
+            cached = json.loads(cache_file.read_text())
+            self.assertEqual(sorted(cached.values()), ["title img1.jpg", "title img2.jpg"])
+            self.assertEqual(len(worker._titles), 2)
+
+    def test_identical_images_use_cached_title(self):
+        """Images with the same hash are only generated once, also across restarts."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache_file = Path(temp_dir) / "titles.json"
+
+            async def same_hash(url):
+                return "same"
+
+            async def run(worker, result_id):
+                worker.enqueue(result_id, f"{result_id}.jpg")
+                await worker.join()
+
+            asyncio.run(run(TitleWorker(self._generate, self._on_titles, hash_image=same_hash,
+                                        cache_file=cache_file, batch_window=0), "a"))
+            asyncio.run(run(TitleWorker(self._generate, self._on_titles, hash_image=same_hash,
+                                        cache_file=cache_file, batch_window=0), "b"))
+
+        self.assertEqual(self.calls, [["a.jpg"]])
+        self.assertEqual(self.titles["b"], "title a.jpg")
+
+    def test_failed_titles_are_not_cached(self):
+        """Images the generator could not describe are generated again next time."""
+        results = [[None], ["title a.jpg"]]
+
+        async def flaky(urls):
+            self.calls.append(list(urls))
+            return results[len(self.calls) - 1]
+
+        async def same_hash(url):
+            return "same"
+
+        async def run():
+            worker = TitleWorker(flaky, self._on_titles, hash_image=same_hash, batch_window=0)
+            worker.enqueue("a", "a.jpg")
+            await worker.join()
+            self.assertNotIn("a", self.titles)
+            worker.enqueue("b", "a.jpg")
+            await worker.join()
+
+        asyncio.run(run())
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.titles["b"], "title a.jpg")
+
+
+if __name__ == '__main__':
+    unittest.main()
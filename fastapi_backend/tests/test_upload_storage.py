@@ -0,0 +1,118 @@
+"""
+Tests for the streaming upload storage.
+"""
+import io
+import os
+import sys
+import asyncio
+import hashlib
+import tempfile
+import unittest
+
+from PIL import Image
+
+# Add the parent directory to the path so we can import our modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.utils import upload_storage
+from services.utils.blob_store import BlobStore
+from services.utils.upload_storage import (
+    read_image_upload,
+    save_image_stream,
+    UploadTooLargeError,
+    InvalidImageError
+)
+
+
+def _png_bytes(width=8, height=6):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def _chunks(data, size=7):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+class _Upload:
+    """Minimal stand-in for UploadFile.read"""
+
+    def __init__(self, data):
+        self.buffer = io.BytesIO(data)
+
+    async def read(self, size=-1):
+        return self.buffer.read(size)
+
+
+class TestUploadStorage(unittest.TestCase):
+    """Test cases for save_image_stream."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        # Keep test blobs out of the real store
+        self.blob_dir = tempfile.TemporaryDirectory()
+        self.real_blob_store = upload_storage.blob_store
+        upload_storage.blob_store = BlobStore(self.blob_dir.name)
+
+    def tearDown(self):
+        upload_storage.blob_store = self.real_blob_store
+        self.blob_dir.cleanup()
+        self.tmp.cleanup()
+
+    def test_content_derived_name_and_dimensions(self):
+        """Files are named after their SHA-256 and report dimensions."""
+        data = _png_bytes()
+        result = asyncio.run(save_image_stream(_chunks(data), self.dir, "/uploads/models/"))
+
+        digest = hashlib.sha256(data).hexdigest()
+        self.assertEqual(result["contentHash"], digest)
+        self.assertEqual(result["fileUrl"], f"/uploads/models/{digest}.png")
+        self.assertEqual((result["width"], result["height"]), (8, 6))
+        self.assertEqual(result["size"], len(data))
+        # Stored in the hash-sharded layout
+        self.assertEqual(os.listdir(self.dir), [digest[:2]])
+        self.assertEqual(os.listdir(os.path.join(self.dir, digest[:2], digest[2:4])), [f"{digest}.png"])
+
+    def test_duplicate_upload_reuses_file(self):
+        """Uploading the same bytes twice stores a single file."""
+        data = _png_bytes()
+        first = asyncio.run(save_image_stream(_chunks(data), self.dir, "/u/"))
+        second = asyncio.run(save_image_stream(_chunks(data), self.dir, "/u/"))
+        self.assertEqual(first["fileUrl"], second["fileUrl"])
+        self.assertEqual(len(os.listdir(self.dir)), 1)
+
+    def test_size_limit(self):
+        """Uploads over the byte limit are rejected and leave no files behind."""
+        data = _png_bytes()
+        with self.assertRaises(UploadTooLargeError):
+            asyncio.run(save_image_stream(_chunks(data), self.dir, "/u/", max_bytes=10))
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_pixel_limit(self):
+        """Images over the pixel limit are rejected."""
+        data = _png_bytes(100, 100)
+        with self.assertRaises(UploadTooLargeError):
+            asyncio.run(save_image_stream(_chunks(data), self.dir, "/u/", max_pixels=50))
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_invalid_image(self):
+        """Non-image content is rejected."""
+        with self.assertRaises(InvalidImageError):
+            asyncio.run(save_image_stream(_chunks(b"not an image"), self.dir, "/u/"))
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_read_image_upload_limits(self):
+        """In-memory reads enforce the byte and pixel limits before decoding."""
+        data = _png_bytes(8, 6)
+        self.assertEqual(asyncio.run(read_image_upload(_Upload(data))), data)
+        with self.assertRaises(UploadTooLargeError):
+            asyncio.run(read_image_upload(_Upload(data), max_bytes=10))
+        with self.assertRaises(UploadTooLargeError):
+            asyncio.run(read_image_upload(_Upload(data), max_pixels=40))
+        with self.assertRaises(InvalidImageError):
+            asyncio.run(read_image_upload(_Upload(b"not an image")))
+
+
+if __name__ == "__main__":
+    unittest.main()